@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to check the data type of the id, version, timestamp,
+changeset, uid, user, lat and lon attributes of <node>, <way> and <relation>, for
+MapStructureAudit, without an exception and a datetime.strptime for each value.
+
+isANumber, isAFloat and isTimestamp give the same answer as int(), float() and
+datetime.strptime(val, "%Y-%m-%dT%H:%M:%SZ"), but the values in the usual format are
+checked first with str.isdigit or a precompiled regex, and only the others go through
+int(), float() or strptime.  For a timestamp, the regex checks the time, and the date
+is checked with datetime() once per distinct day, the result is cached.
+
+AttributeCheck keeps the attributes of a batch of elements of one type in columns,
+one list per attribute.  A column is joined and checked with a single regex match, and
+the values are only checked one by one in a column that has an invalid value.
+
+Usage:
+    check = AttributeCheck("node")
+    check.add({"id": "1", "version": "2", ...}, row)
+    for row, attrib, valid in check.validate():
+        ...
+"""
+
+from datetime import datetime
+import re
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+_time = r"\d{4}-\d\d-\d\dT(?:[01]\d|2[0-3]):[0-5]\d:[0-5]\dZ"
+_float = r"-?\d+\.\d+"
+
+timestamp = re.compile(_time + r"\Z")
+floatValue = re.compile(_float + r"\Z")
+intColumn = re.compile(r"\d+(?:\n\d+)*\Z")
+floatColumn = re.compile(_float + r"(?:\n" + _float + r")*\Z")
+timestampColumn = re.compile(_time + r"(?:\n" + _time + r")*\Z")
+
+MAX_DATES = 100000
+_dates = {}
+
+
+def validDate(date):
+    """
+        Whether date, "YYYY-MM-DD", is a day of the calendar.
+    """
+    valid = _dates.get(date, None)
+    if valid is None:
+        try:
+            datetime(int(date[:4]), int(date[5:7]), int(date[8:10]))
+            valid = True
+        except ValueError:
+            valid = False
+        if len(_dates) < MAX_DATES: _dates[date] = valid
+    return valid
+
+
+def isTimestamp(val):
+    if type(val) is str and timestamp.match(val): return validDate(val[:10])
+    try:
+        datetime.strptime(val, TIMESTAMP_FORMAT)
+        return True
+    except:
+        return False
+
+
+def isANumber(val):
+    if type(val) is str and val.isdigit(): return True
+    try:
+        int(val)
+        return True
+    except:
+        return False
+
+
+def isAFloat(val):
+    if type(val) is str and floatValue.match(val): return True
+    try:
+        float(val)
+        return True
+    except:
+        return False
+
+
+def checkColumn(values, pattern, check):
+    """
+        Returns None if all the values are valid, else whether each value is valid.
+            pattern - regex matching the values joined with "\\n" if all of them are valid
+            check - the check of a single value
+    """
+    try:
+        joined = "\n".join(values)
+    except TypeError:
+        joined = None   #a missing attribute
+    #a value with a "\n" in it would match as two values
+    if type(joined) is str and joined.count("\n") == len(values) - 1 and pattern.match(joined): return None
+    return [check(v) for v in values]
+
+
+def checkTimestamps(values):
+    valid = checkColumn(values, timestampColumn, isTimestamp)
+    if valid is None and not all(validDate(date) for date in set(v[:10] for v in values)):
+        return [isTimestamp(v) for v in values]
+    return valid
+
+
+class AttributeCheck(object):
+
+    def __init__(self, tag):
+        """
+            tag - "node", "way" or "relation", only the nodes have lat and lon
+        """
+        self.tag = tag
+        self.coordinates = tag == "node"
+        self.clear()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def clear(self):
+        self.rows = []
+        self.attribs = []
+        self.ids = []
+        self.versions = []
+        self.timestamps = []
+        self.changesets = []
+        self.uids = []
+        self.users = []
+        self.lats = []
+        self.lons = []
+
+    def add(self, attrib, row):
+        """
+            Adds the attributes of an element, row is returned with them by validate().
+            A missing id, version, timestamp or changeset raises a KeyError, a missing uid
+            and user (an anonymous edit) make the element invalid.
+        """
+        self.ids.append(attrib["id"])
+        self.versions.append(attrib["version"])
+        self.timestamps.append(attrib["timestamp"])
+        self.changesets.append(attrib["changeset"])
+        self.uids.append(attrib.get("uid", ""))
+        self.users.append(attrib.get("user", ""))
+        if self.coordinates:
+            self.lats.append(attrib.get("lat", None))
+            self.lons.append(attrib.get("lon", None))
+        #a copy, the etree backends clear the attributes of the element
+        self.attribs.append(dict(attrib))
+        self.rows.append(row)
+
+    def validate(self):
+        """
+            Returns (row, attrib, valid) of each element added since the last validate().
+        """
+        columns = [checkColumn(self.ids, intColumn, isANumber),
+                   checkColumn(self.versions, intColumn, isANumber),
+                   checkTimestamps(self.timestamps),
+                   checkColumn(self.changesets, intColumn, isANumber),
+                   checkColumn(self.uids, intColumn, isANumber)]
+        if self.coordinates:
+            columns.append(checkColumn(self.lats, floatColumn, isAFloat))
+            columns.append(checkColumn(self.lons, floatColumn, isAFloat))
+        columns = [column for column in columns if column is not None]
+
+        results = []
+        for i, user in enumerate(self.users):
+            valid = len(user.strip()) > 0
+            for column in columns:
+                if not column[i]:
+                    valid = False
+                    break
+            results.append((self.rows[i], self.attribs[i], valid))
+        self.clear()
+        return results
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to measure auditMap, auditTag, process_map and the Pipeline
+in a reproducible way, on synthetic OSM files of any size.
+
+generateOSM() writes a deterministic (seeded) OSM xml with a given no. of nodes, ways and
+relations, tags per element, nodes per way and street name noise, i.e. abbreviated
+street types, lower case names, typos and problem words like "cor".  The counts are
+saved to <file>.meta.json.
+
+runBenchmark() runs each entry point in its own process, in a work directory with a
+generated mapcontentAudit_WithCorrection.csv, and appends one json line per run to the
+results file with the wall time, elements/sec and peak RSS, along with the git commit,
+so the results of different commits can be compared.
+
+Usage:
+    python Benchmark.py generate synthetic.osm --size 100MB
+    python Benchmark.py run synthetic.osm --entries auditMap,process_map --backend expat
+    python Benchmark.py suite --sizes 10MB,100MB,1GB
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ENTRIES = ["auditMap", "auditTag", "process_map", "pipeline"]
+RESULTS_FILE = "benchmark_results.jsonl"
+
+STREET_NAMES = ["Katipunan", "Aurora", "Quirino", "Commonwealth", "Tandang Sora", "Timog",
+                "Tomas Morato", "Kalayaan", "Visayas", "Mindanao", "Congressional", "Santolan",
+                "Ortigas", "Marcos", "Espana", "Mayon", "Banawe", "Del Monte", "Roosevelt",
+                "West", "East", "Maginhawa", "Matalino", "Kamias", "Anonas", "Xavierville"]
+STREET_TYPES = ["Street", "Avenue", "Road", "Highway", "Boulevard", "Drive", "Extension"]
+ABBREVIATIONS = {"Street": ["St", "St.", "st"], "Avenue": ["Ave", "Ave."], "Road": ["Rd", "rd"],
+                 "Highway": ["Hiway"], "Boulevard": ["Blvd"], "Drive": ["Dr"], "Extension": ["Ext", "Ext."]}
+AMENITIES = ["restaurant", "school", "bank", "pharmacy", "fast_food", "cafe", "place_of_worship"]
+HIGHWAYS = ["residential", "primary", "secondary", "tertiary", "service", "footway"]
+
+BYTES_PER_NODE = 148
+BYTES_PER_WAY = 112
+BYTES_PER_ND = 21
+BYTES_PER_TAG = 34
+
+
+def parseSize(size):
+    units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+    size = size.strip().upper()
+    for unit, factor in units.iteritems():
+        if size.endswith(unit): return int(float(size[:-2]) * factor)
+    return int(size)
+
+
+def countsForSize(size, tagsPerElement=1.0, nodesPerWay=6):
+    """
+        No. of nodes, ways and relations for a file of about size bytes, with the ratios of
+        qc.osm, about 5 nodes per way and 1 relation per 200 ways.
+    """
+    bytesPerWay = BYTES_PER_WAY + nodesPerWay * BYTES_PER_ND + tagsPerElement * BYTES_PER_TAG
+    bytesPerNode = BYTES_PER_NODE + tagsPerElement * BYTES_PER_TAG * 0.4
+    ways = int(size / (bytesPerWay + 5 * bytesPerNode))
+    return {"nodes": ways * 5, "ways": ways, "relations": max(1, ways // 200)}
+
+
+class StreetNames(object):
+
+    def __init__(self, rnd, noise):
+        self.rnd = rnd
+        self.noise = noise
+
+    def name(self):
+        rnd = self.rnd
+        base = rnd.choice(STREET_NAMES)
+        streetType = rnd.choice(STREET_TYPES)
+        if rnd.random() >= self.noise: return base + " " + streetType
+
+        kind = rnd.randint(0, 3)
+        if kind == 0:
+            return base + " " + rnd.choice(ABBREVIATIONS[streetType])
+        elif kind == 1:
+            return (base + " " + streetType).lower()
+        elif kind == 2:
+            #typo, a dropped or doubled letter
+            i = rnd.randint(1, len(base) - 1)
+            base = base[:i] + base[i + 1:] if rnd.random() < 0.5 else base[:i] + base[i] + base[i:]
+            return base + " " + streetType
+        return base + " " + streetType + " cor " + rnd.choice(STREET_NAMES)
+
+
+def _attrs(rnd, id1, users):
+    uid = rnd.randint(1, users)
+    return ('id="%d" version="%d" changeset="%d" timestamp="20%02d-%02d-%02dT%02d:%02d:%02dZ" user="user%d" uid="%d"'
+            % (id1, rnd.randint(1, 9), rnd.randint(1000000, 40000000), rnd.randint(8, 16), rnd.randint(1, 12),
+               rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59), uid, uid))
+
+
+def _tags(rnd, count, streets, kind):
+    tags = []
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.3:
+            tags.append(("addr:street", streets.name()))
+        elif r < 0.45:
+            tags.append(("addr:postcode", str(rnd.randint(1100, 1199) if rnd.random() < 0.9 else rnd.randint(1000, 4000))))
+        elif r < 0.55:
+            tags.append(("addr:city", "Quezon City" if rnd.random() < 0.8 else "Manila"))
+        elif r < 0.75:
+            tags.append(("amenity" if kind == "node" else "highway",
+                         rnd.choice(AMENITIES if kind == "node" else HIGHWAYS)))
+        else:
+            tags.append(("name", streets.name()))
+    return "".join('\n  <tag k="%s" v="%s"/>' % tag for tag in tags)
+
+
+def generateOSM(filename, nodes, ways, relations, tagsPerElement=1.0, streetNoise=0.1,
+                nodesPerWay=6, users=1000, seed=1):
+    """
+        Writes a synthetic OSM xml, the same arguments always write the same file.
+            tagsPerElement - average no. of <tag> per way, nodes have 40% of it
+            streetNoise - fraction of street names that are abbreviated, lower case, misspelled
+                          or have a problem word
+            nodesPerWay - average no. of <nd> per way
+    """
+    rnd = random.Random(seed)
+    streets = StreetNames(rnd, streetNoise)
+    with open(filename, "wb") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6" generator="Benchmark.py">\n')
+        f.write(' <bounds minlat="14.5" minlon="120.9" maxlat="14.8" maxlon="121.2"/>\n')
+        for id1 in xrange(1, nodes + 1):
+            ntags = int(rnd.expovariate(1.0 / (tagsPerElement * 0.4))) if tagsPerElement > 0 else 0
+            node = ' <node %s lat="%.7f" lon="%.7f"' % (_attrs(rnd, id1, users), rnd.uniform(14.5, 14.8), rnd.uniform(120.9, 121.2))
+            if ntags == 0:
+                f.write(node + '/>\n')
+            else:
+                f.write(node + '>' + _tags(rnd, ntags, streets, "node") + '\n </node>\n')
+
+        for id1 in xrange(1, ways + 1):
+            start = rnd.randint(1, max(1, nodes - nodesPerWay * 2))
+            count = max(2, int(rnd.gauss(nodesPerWay, nodesPerWay / 3.0)))
+            refs = "".join('\n  <nd ref="%d"/>' % min(nodes, start + i) for i in range(count))
+            ntags = int(rnd.expovariate(1.0 / tagsPerElement)) + 1 if tagsPerElement > 0 else 0
+            f.write(' <way %s>%s%s\n </way>\n' % (_attrs(rnd, id1, users), refs, _tags(rnd, ntags, streets, "way")))
+
+        for id1 in xrange(1, relations + 1):
+            members = "".join('\n  <member type="way" ref="%d" role="outer"/>' % rnd.randint(1, max(1, ways))
+                              for i in range(rnd.randint(1, 5)))
+            f.write(' <relation %s>%s\n  <tag k="type" v="multipolygon"/>\n </relation>\n'
+                    % (_attrs(rnd, id1, users), members))
+        f.write('</osm>\n')
+
+    meta = {"nodes": nodes, "ways": ways, "relations": relations, "tagsPerElement": tagsPerElement,
+            "streetNoise": streetNoise, "nodesPerWay": nodesPerWay, "users": users, "seed": seed,
+            "bytes": os.path.getsize(filename)}
+    with open(filename + ".meta.json", "w") as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+    return meta
+
+
+def writeCorrections(filename):
+    """
+        Writes a mapcontentAudit_WithCorrection.csv that corrects the generated typos.
+    """
+    with open(filename, "wb") as f:
+        f.write("Comment,Tag K,Tag Value,Correction\n")
+        for base in STREET_NAMES:
+            for streetType in STREET_TYPES:
+                for i in range(1, len(base)):
+                    typo = base[:i] + base[i + 1:]
+                    f.write("Spelling Check,street,%s %s,%s %s\n" % (typo, streetType, base, streetType))
+
+
+def gitCommit():
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=devnull,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def runOne(entry, osmFile, backend):
+    """
+        Runs one entry point in this process, with the output sent to /dev/null, and prints
+        a json line with the wall time and the peak RSS.
+    """
+    import MapStructureAudit
+    import MapContentAudit
+    import PrepForDB
+    import Pipeline
+    from OSMReader import peakMemoryMB
+
+    stdout = sys.stdout
+    start = time.time()
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            if entry == "auditMap":
+                MapStructureAudit.auditMap(osmFile, backend=backend)
+            elif entry == "auditTag":
+                MapContentAudit.auditTag("tagKV.stats")
+            elif entry == "process_map":
+                PrepForDB.process_map(osmFile, backend=backend)
+            elif entry == "pipeline":
+                Pipeline.runPipeline(osmFile, Pipeline.createStages(osmFile), backend)
+            else:
+                raise ValueError("Unknown entry point: {0}".format(entry))
+        finally:
+            sys.stdout = stdout
+    print json.dumps({"wall": time.time() - start, "peakRssMB": peakMemoryMB()})
+
+
+def runBenchmark(osmFile, entries=ENTRIES, backend="etree", resultsFile=RESULTS_FILE, workDir=None):
+    osmFile = os.path.abspath(osmFile)
+    resultsFile = os.path.abspath(resultsFile)
+    if workDir is None: workDir = osmFile + ".work"
+    if not os.path.isdir(workDir): os.makedirs(workDir)
+    writeCorrections(os.path.join(workDir, "mapcontentAudit_WithCorrection.csv"))
+
+    meta = {}
+    if os.path.exists(osmFile + ".meta.json"):
+        with open(osmFile + ".meta.json") as f: meta = json.load(f)
+    elements = meta.get("nodes", 0) + meta.get("ways", 0) + meta.get("relations", 0)
+
+    #auditTag reads the tagKV.stats written by auditMap
+    if "auditTag" in entries and "auditMap" not in entries and not os.path.exists(os.path.join(workDir, "tagKV.stats")):
+        entries = ["auditMap"] + list(entries)
+
+    commit = gitCommit()
+    results = []
+    for entry in entries:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "run-one", entry, osmFile,
+                                          "--backend", backend], cwd=workDir)
+        measured = json.loads(output.strip().splitlines()[-1])
+        result = {"entry": entry, "backend": backend, "file": os.path.basename(osmFile),
+                  "bytes": os.path.getsize(osmFile), "elements": elements,
+                  "wall": round(measured["wall"], 3),
+                  "elementsPerSec": round(elements / measured["wall"], 1) if elements and measured["wall"] > 0 else None,
+                  "peakRssMB": round(measured["peakRssMB"], 1),
+                  "commit": commit, "python": sys.version.split()[0],
+                  "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        results.append(result)
+        with open(resultsFile, "a") as f:
+            f.write(json.dumps(result, sort_keys=True) + "\n")
+        print "%-12s %-7s %10.2f s %12s elements/s %8.1f MB" % (
+            entry, backend, result["wall"], result["elementsPerSec"], result["peakRssMB"])
+    return results
+
+
+def runSuite(sizes, entries=ENTRIES, backends=["etree"], directory="benchmark", resultsFile=RESULTS_FILE, seed=1):
+    """
+        Generates (once) a synthetic file for each size and runs the benchmark on them.
+    """
+    if not os.path.isdir(directory): os.makedirs(directory)
+    for size in sizes:
+        osmFile = os.path.join(directory, "synthetic_{0}_seed{1}.osm".format(size, seed))
+        if not os.path.exists(osmFile + ".meta.json"):
+            print "generating", osmFile
+            counts = countsForSize(parseSize(size))
+            generateOSM(osmFile, counts["nodes"], counts["ways"], counts["relations"], seed=seed)
+        for backend in backends:
+            runBenchmark(osmFile, entries, backend, resultsFile)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the OSM audit and export")
+    commands = parser.add_subparsers(dest="command")
+
+    generate = commands.add_parser("generate", help="write a synthetic OSM file")
+    generate.add_argument("file_out")
+    generate.add_argument("--size", help="approximate file size, i.e. 10MB or 2GB, instead of the counts")
+    generate.add_argument("--nodes", type=int, default=50000)
+    generate.add_argument("--ways", type=int, default=10000)
+    generate.add_argument("--relations", type=int, default=50)
+    generate.add_argument("--tags", type=float, default=1.0, help="average no. of tags per way")
+    generate.add_argument("--noise", type=float, default=0.1, help="fraction of noisy street names")
+    generate.add_argument("--nodesPerWay", type=int, default=6)
+    generate.add_argument("--seed", type=int, default=1)
+
+    run = commands.add_parser("run", help="run the entry points on an OSM file")
+    run.add_argument("file_in")
+    run.add_argument("--entries", default=",".join(ENTRIES))
+    run.add_argument("--backend", default="etree")
+    run.add_argument("--results", default=RESULTS_FILE)
+
+    suite = commands.add_parser("suite", help="generate files of several sizes and run the entry points")
+    suite.add_argument("--sizes", default="10MB,100MB,1GB")
+    suite.add_argument("--entries", default=",".join(ENTRIES))
+    suite.add_argument("--backends", default="etree")
+    suite.add_argument("--dir", default="benchmark")
+    suite.add_argument("--results", default=RESULTS_FILE)
+
+    runOneParser = commands.add_parser("run-one")
+    runOneParser.add_argument("entry")
+    runOneParser.add_argument("file_in")
+    runOneParser.add_argument("--backend", default="etree")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        if args.size:
+            counts = countsForSize(parseSize(args.size), args.tags, args.nodesPerWay)
+        else:
+            counts = {"nodes": args.nodes, "ways": args.ways, "relations": args.relations}
+        meta = generateOSM(args.file_out, counts["nodes"], counts["ways"], counts["relations"], args.tags,
+                           args.noise, args.nodesPerWay, seed=args.seed)
+        print json.dumps(meta, indent=2, sort_keys=True)
+    elif args.command == "run":
+        runBenchmark(args.file_in, args.entries.split(","), args.backend, args.results)
+    elif args.command == "suite":
+        runSuite(args.sizes.split(","), args.entries.split(","), args.backends.split(","), args.dir, args.results)
+    else:
+        runOne(args.entry, args.file_in, args.backend)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to update the output of PrepForDB.process_map with an OSM
+change file (.osc, or .osc.gz), instead of processing the whole map again.
+
+An osmChange file lists the elements created, modified and deleted since the extract:
+
+<osmChange version="0.6">
+  <create> <node id="..." ...> <tag .../> </node> </create>
+  <modify> <way id="..." ...> <nd .../> <tag .../> </way> </modify>
+  <delete> <node id="..." .../> </delete>
+</osmChange>
+
+The created and modified <node> and <way> are shaped with PrepForDB.shape_element, with
+the same corrections as process_map.  Only the last change of an element is kept, and a
+modified element that is filtered out by shape_element (i.e. onlyQC) is deleted.
+The changes are then applied to either:
+    - the json file, one document per line (not the pretty output), see applyToFile
+    - a MongoDB collection, see applyToCollection
+
+Usage:
+    python ChangeFile.py daily.osc qc.osm.json
+    python ChangeFile.py daily.osc --mongo osm.qc
+"""
+
+import argparse
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from CompressedInput import compression, openInput
+import PrepForDB
+import Sinks
+
+ACTIONS = ["create", "modify", "delete"]
+
+
+def iterChanges(source):
+    """
+        Yields (action, element) for each element of the osmChange file, the element is
+        cleared after use, the same way as OSMReader.
+    """
+    if compression(source) is not None:
+        #i.e. the .osc.gz of the minutely diffs
+        f = openInput(source)
+        try:
+            for change in iterChanges(f): yield change
+        finally:
+            f.close()
+        return
+
+    depth = 0
+    root = None
+    action = None
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if depth == 0: root = element
+            elif depth == 1: action = element
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 2:
+            yield action.tag, element
+            element.clear()
+            del action[:]
+        elif depth == 1:
+            element.clear()
+            del root[:]
+
+
+def loadChanges(source, corrections, onlyQC = False):
+    """
+        Returns (type, id) -> shaped document, None for the deleted elements.
+    """
+    changes = {}
+    corrected_values = {}
+    for action, element in iterChanges(source):
+        if action not in ACTIONS or element.tag not in ["node", "way"]: continue
+        key = (element.tag, element.attrib["id"])
+        if action == "delete":
+            changes[key] = None
+        else:
+            changes[key] = PrepForDB.shape_element(element, corrections, corrected_values, onlyQC)
+    return changes
+
+
+def applyToFile(changes, file_out):
+    """
+        Rewrites file_out with the changed documents replaced, the deleted documents
+        removed and the new documents appended at the end.
+    """
+    remaining = dict(changes)
+    counts = dict.fromkeys(["replaced", "deleted", "created", "unchanged"], 0)
+    tmp = file_out + ".tmp"
+    with open(file_out, "rb") as fi:
+        with open(tmp, "wb") as fo:
+            for line in fi:
+                doc = json.loads(line)
+                key = (doc["type"], doc["id"])
+                if key not in remaining:
+                    fo.write(line)
+                    counts["unchanged"] += 1
+                    continue
+                new = remaining.pop(key)
+                if new is None:
+                    counts["deleted"] += 1
+                else:
+                    fo.write(json.dumps(new) + "\n")
+                    counts["replaced"] += 1
+
+            for key, new in sorted(remaining.iteritems()):
+                if new is None: continue
+                fo.write(json.dumps(new) + "\n")
+                counts["created"] += 1
+    os.rename(tmp, file_out)
+    return counts
+
+
+def applyToCollection(changes, collection, batchSize = 1000):
+    """
+        Replaces (upsert) the changed documents and deletes the deleted documents of the
+        collection, found by type and id.
+    """
+    if hasattr(collection, "create_index"): collection.create_index([("type", 1), ("id", 1)])
+    counts = dict.fromkeys(["replaced", "deleted"], 0)
+    batch = []
+    for (osmType, id1), new in changes.iteritems():
+        query = {"type": osmType, "id": id1}
+        if new is None:
+            batch.append(("delete", query, None))
+            counts["deleted"] += 1
+        else:
+            batch.append(("replace", query, new))
+            counts["replaced"] += 1
+        if len(batch) >= batchSize:
+            _writeBatch(collection, batch)
+            batch = []
+    _writeBatch(collection, batch)
+    return counts
+
+
+def _writeBatch(collection, batch):
+    if len(batch) == 0: return
+    if Sinks.pymongo is not None and hasattr(collection, "bulk_write"):
+        ops = [Sinks.pymongo.DeleteOne(query) if action == "delete" else Sinks.pymongo.ReplaceOne(query, doc, upsert=True)
+               for action, query, doc in batch]
+        #each element is changed once, so the order of the operations does not matter
+        collection.bulk_write(ops, ordered=False)
+    else:
+        for action, query, doc in batch:
+            if action == "delete": collection.delete_one(query)
+            else: collection.replace_one(query, doc, upsert=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply an OSM change file to the process_map output")
+    parser.add_argument("change_file")
+    parser.add_argument("file_out", nargs="?", help="json file to update")
+    parser.add_argument("--mongo", help="db.collection to update instead of the json file")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--onlyQC", action="store_true")
+    args = parser.parse_args()
+
+    start = time.time()
+    changes = loadChanges(args.change_file, PrepForDB.loadCorrections(), args.onlyQC)
+    if args.mongo:
+        db, name = args.mongo.split(".", 1)
+        counts = applyToCollection(changes, Sinks.getClient(args.uri)[db][name])
+    elif args.file_out:
+        counts = applyToFile(changes, args.file_out)
+    else:
+        parser.error("file_out or --mongo is needed")
+    print "\n", counts
+    print "elapsed time (s): %.1f" % (time.time() - start)
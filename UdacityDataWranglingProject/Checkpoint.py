@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to resume a long process_map or auditMap run that crashed or
+was killed, from its last checkpoint instead of from the start of the file.
+
+The input is read in segments of about interval bytes, cut on the <node>, <way> and
+<relation> start tags (see OSMShards.py), and each segment is parsed as a ShardFile.
+After a segment, the checkpoint file is written with:
+    offset   - the input byte offset where the next segment starts
+    position - the size of the output file, the sink being flushed
+    state    - the state of the run, i.e. the element counts, users, invalid attributes,
+               references and tag counts of auditMap
+and the size and modification time of the input, so the checkpoint of another input is
+not used.  It is written to a temporary file and renamed, so it is always complete.
+
+The big parts of the state are kept in files that are only appended to (i.e. the
+SortedIdIndex of auditMap with a nodeIndexFile), and only hard linked by a checkpoint.
+The rest is pickled, and the next segment is at least STATE_RATIO times the size of the
+last checkpoint, so the checkpoints are at most 1 / STATE_RATIO of the input read, even
+with a state of a fixed size like the Bloom filters of auditMap(approximate=True).
+
+When resumed, the output is truncated to the position of the checkpoint, the state is
+restored and the reading starts at the offset, so the output is the same as the output
+of a run that was not interrupted.  The checkpoint is removed at the end of the run.
+
+The segments are read at byte offsets, so only an uncompressed xml file can be resumed.
+
+Usage:
+    process_map("philippines.osm", checkpointBytes=256 << 20)
+    #killed, then
+    process_map("philippines.osm", checkpointBytes=256 << 20, resume=True)
+"""
+
+import os
+import pickle
+
+from CompressedInput import compression
+from OSMReader import OSMReader, isPBF
+from OSMShards import findElementStart, findRootEnd, ShardFile
+from Metrics import NULL_METRICS
+
+CHECKPOINT_BYTES = 256 << 20
+STATE_RATIO = 16
+
+
+class Checkpoint(object):
+
+    def __init__(self, filename, path, interval=CHECKPOINT_BYTES):
+        """
+            filename - the input, an uncompressed OSM xml file
+            path - the checkpoint file
+            interval - input bytes between two checkpoints
+        """
+        if compression(filename) is not None or isPBF(filename):
+            raise ValueError("Only an uncompressed xml file can be checkpointed")
+        self.filename = filename
+        self.path = path
+        self.interval = interval
+        self.stateSize = 0
+        self.root = None
+
+    def _input(self):
+        stat = os.stat(self.filename)
+        return [stat.st_size, stat.st_mtime]
+
+    def load(self):
+        """
+            Returns the saved {"offset", "position", "state"}, or None if there is no
+            checkpoint.
+        """
+        if not os.path.exists(self.path): return None
+        with open(self.path, "rb") as f:
+            saved = pickle.load(f)
+        self.stateSize = os.path.getsize(self.path)
+        if saved["input"] != self._input():
+            raise ValueError("{0} is the checkpoint of another version of {1}".format(self.path, self.filename))
+        return saved
+
+    def save(self, offset, position, state):
+        saved = {"input": self._input(), "offset": offset, "position": position, "state": state}
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(saved, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
+        self.stateSize = os.path.getsize(self.path)
+
+    def remove(self):
+        if os.path.exists(self.path): os.remove(self.path)
+
+    def iterElements(self, snapshot, offset=0, tags=None, backend="etree", metrics=NULL_METRICS):
+        """
+            Yields the elements from offset to the end of the file.  After each segment,
+            snapshot() returns (output position, state) and the checkpoint is saved.
+        """
+        size = os.path.getsize(self.filename)
+        if metrics.enabled and metrics.totalBytes is None: metrics.totalBytes = size
+        with open(self.filename, "rb") as f:
+            end = findRootEnd(f, size)
+            start = offset
+            while True:
+                #the first segment has the <osm> and <bounds> of the file, the last one </osm>
+                interval = max(self.interval, STATE_RATIO * self.stateSize)
+                segmentEnd = findElementStart(f, start + interval, end) if start < end else end
+                last = segmentEnd >= end
+                shard = ShardFile(self.filename, start, size if last else segmentEnd,
+                                  "" if start == 0 else "<osm>", "" if last else "</osm>")
+                try:
+                    source = metrics.watch(shard)
+                    if metrics.enabled: source.bytesRead = start
+                    reader = OSMReader(source, tags, backend)
+                    for element in reader: yield element
+                    self.root = reader.root
+                finally:
+                    shard.close()
+                if last: break
+                position, state = snapshot()
+                self.save(segmentEnd, position, state)
+                start = segmentEnd
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to read .osm.bz2 and .osm.gz files directly, without
+decompressing them to a temporary file first.
+
+openInput(filename) returns a read only file object of the decompressed xml, that is
+read by OSMReader like the xml file itself:
+    .bz2 - decompressed by lbzip2 or pbzip2 when one of them is installed, through a
+           pipe, they use all the cores.  Otherwise, if the file is made of several bz2
+           streams (pbzip2 and lbzip2 write one stream per block), the streams are
+           decompressed in parallel by a pool of processes.  A file with a single
+           stream is decompressed on a background thread.
+    .gz  - decompressed on a background thread
+so the decompression runs alongside the parsing instead of stalling it.
+
+The file objects have a bytesRead attribute, the compressed bytes read so far, for the
+progress of Metrics.
+
+The start of a bz2 stream is "BZh" + block size + the block magic, but these bytes can
+also be found inside the compressed data.  A stream only starts where the previous one
+ends, with the bit aligned end of stream marker, its crc and the padding to a byte, so
+the 11 bytes before the start are checked too.
+"""
+
+from collections import deque
+from distutils.spawn import find_executable
+import bz2
+import multiprocessing
+import os
+import Queue
+import re
+import subprocess
+import threading
+import zlib
+
+COMPRESSED = {".bz2": "bz2", ".gz": "gz"}
+BZ2_TOOLS = ["lbzip2", "pbzip2"]
+READ_SIZE = 1 << 20
+CHUNK_SIZE = 4 << 20           #compressed bytes decompressed by a process at once
+SCAN_SIZE = 16 << 20           #a file without a second stream in it has a single stream
+QUEUE_SIZE = 8
+
+streamStart = re.compile(b"BZh[1-9]1AY&SY")
+END_OF_STREAM = 0x177245385090
+
+
+def compression(filename):
+    """
+        "bz2", "gz" or None, from the extension of filename.
+    """
+    if not isinstance(filename, basestring): return None
+    return COMPRESSED.get(os.path.splitext(filename)[1].lower(), None)
+
+
+def stripCompression(filename):
+    return os.path.splitext(filename)[0] if compression(filename) else filename
+
+
+def openInput(filename, processes=None, tools=True):
+    """
+        Returns a file object of the decompressed content of filename, filename itself
+        opened if it is not compressed.
+            processes - no. of processes for the multi stream bz2, None for the no. of cpus
+            tools - use lbzip2 or pbzip2 if installed
+    """
+    kind = compression(filename)
+    if kind is None: return open(filename, "rb")
+    if kind == "gz":
+        return ThreadedDecompressFile(filename, lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+    tool = None
+    if tools:
+        for name in BZ2_TOOLS:
+            tool = find_executable(name)
+            if tool is not None: break
+    if tool is not None: return PipeDecompressFile(filename, [tool, "-d", "-c"])
+
+    if processes is None: processes = multiprocessing.cpu_count()
+    if processes > 1:
+        with open(filename, "rb") as f:
+            head = f.read(SCAN_SIZE)
+        if len(streamStarts(head, 1)) > 0:
+            return ParallelBz2File(filename, processes)
+    return ThreadedDecompressFile(filename, bz2.BZ2Decompressor)
+
+
+def streamStarts(data, start=0):
+    """
+        Offsets in data, after start, where a bz2 stream starts right after the end of
+        another one.
+    """
+    offsets = []
+    for match in streamStart.finditer(data, max(start, 11)):
+        if _endsStream(data[match.start() - 11:match.start()]): offsets.append(match.start())
+    return offsets
+
+
+def _endsStream(before):
+    #end of stream marker (48 bits), crc (32 bits) and 0 to 7 bits of zero padding
+    bits = int(before.encode("hex"), 16)
+    for pad in xrange(8):
+        if bits & ((1 << pad) - 1): break
+        if (bits >> (pad + 32)) & 0xFFFFFFFFFFFF == END_OF_STREAM: return True
+    return False
+
+
+class DecompressFile(object):
+    """
+        File object reading the decompressed chunks of the chunks() generator.
+    """
+
+    def __init__(self):
+        self.bytesRead = 0
+        self.chunk = b""
+        self.position = 0
+        self.iterator = None
+
+    def read(self, size=-1):
+        if self.iterator is None: self.iterator = self.chunks()
+        if size < 0: return self.chunk[self.position:] + b"".join(self.iterator)
+
+        #the chunks are big, only the part that is read is copied
+        while self.position >= len(self.chunk):
+            self.chunk = next(self.iterator, None)
+            self.position = 0
+            if self.chunk is None:
+                self.chunk = b""
+                return b""
+        data = self.chunk[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        if self.iterator is not None: self.iterator.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ThreadedDecompressFile(DecompressFile):
+    """
+        A thread reads and decompresses the file, the chunks are passed through a
+        bounded queue.  Several concatenated streams (or gzip members) are decompressed
+        one after the other.
+    """
+
+    def __init__(self, filename, decompressor):
+        DecompressFile.__init__(self)
+        self.filename = filename
+        self.decompressor = decompressor
+
+    def chunks(self):
+        queue = Queue.Queue(QUEUE_SIZE)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._decompress, args=(queue, stop))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                chunk = queue.get()
+                if chunk is None: break
+                if isinstance(chunk, Exception): raise chunk
+                yield chunk
+        finally:
+            stop.set()
+            #unblock the thread if it is waiting on a full queue
+            while thread.is_alive():
+                try:
+                    queue.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+
+    def _decompress(self, queue, stop):
+        try:
+            with open(self.filename, "rb") as f:
+                decompressor = self.decompressor()
+                while not stop.is_set():
+                    data = f.read(READ_SIZE)
+                    if len(data) == 0: break
+                    self.bytesRead += len(data)
+                    while len(data) > 0:
+                        try:
+                            chunk = decompressor.decompress(data)
+                        except EOFError:
+                            #the stream ended with the previous data, this is a new one
+                            decompressor = self.decompressor()
+                            continue
+                        if len(chunk) > 0: queue.put(chunk)
+                        #the rest is the next stream or gzip member
+                        data = decompressor.unused_data
+                        if len(data) > 0: decompressor = self.decompressor()
+            queue.put(None)
+        except Exception as e:
+            queue.put(e)
+
+
+class PipeDecompressFile(DecompressFile):
+    """
+        Reads the output of a decompression command, a thread feeds it the file so the
+        compressed bytes read are known.
+    """
+
+    def __init__(self, filename, command):
+        DecompressFile.__init__(self)
+        self.filename = filename
+        self.command = command
+        self.process = None
+
+    def chunks(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        thread = threading.Thread(target=self._feed)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                chunk = self.process.stdout.read(READ_SIZE)
+                if len(chunk) == 0: break
+                yield chunk
+            if self.process.wait() != 0:
+                raise IOError("{0} failed on {1}".format(os.path.basename(self.command[0]), self.filename))
+        finally:
+            if self.process.poll() is None: self.process.kill()
+            self.process.stdout.close()
+            thread.join()
+
+    def _feed(self):
+        try:
+            with open(self.filename, "rb") as f:
+                while True:
+                    data = f.read(READ_SIZE)
+                    if len(data) == 0: break
+                    self.bytesRead += len(data)
+                    self.process.stdin.write(data)
+        except (IOError, OSError):
+            pass        #the command stopped, the error is reported by chunks()
+        finally:
+            try:
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+
+
+class ParallelBz2File(DecompressFile):
+    """
+        The file is cut at the stream boundaries in ranges of about CHUNK_SIZE bytes, the
+        ranges are decompressed by a pool of processes.  At most 2 ranges per process are
+        in progress, so the decompressed data waiting to be parsed is bounded.
+    """
+
+    def __init__(self, filename, processes):
+        DecompressFile.__init__(self)
+        self.filename = filename
+        self.processes = processes
+
+    def chunks(self):
+        pool = multiprocessing.Pool(self.processes)
+        pending = deque()
+        try:
+            for start, end in self.ranges():
+                pending.append((end, pool.apply_async(decompressRange, (self.filename, start, end))))
+                if len(pending) < 2 * self.processes: continue
+                end, result = pending.popleft()
+                self.bytesRead = end
+                yield result.get()
+            while pending:
+                end, result = pending.popleft()
+                self.bytesRead = end
+                yield result.get()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def ranges(self):
+        """
+            Yields the (start, end) ranges made of whole streams.
+        """
+        size = os.path.getsize(self.filename)
+        start = 0
+        with open(self.filename, "rb") as f:
+            data = b""
+            offset = 0          #file offset of data
+            while True:
+                block = f.read(CHUNK_SIZE)
+                if len(block) == 0: break
+                data += block
+                #the first stream start after start + CHUNK_SIZE ends the range
+                while True:
+                    found = streamStarts(data, start + CHUNK_SIZE - offset)
+                    if len(found) == 0: break
+                    yield start, offset + found[0]
+                    start = offset + found[0]
+                #keep the bytes that can still be part of a stream start, with the 11
+                #bytes before it
+                keep = min(start + CHUNK_SIZE, offset + len(data) - len("BZh91AY&SY")) - 11
+                if keep > offset:
+                    data = data[keep - offset:]
+                    offset = keep
+        yield start, size
+
+
+def decompressRange(filename, start, end):
+    with open(filename, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    chunks = []
+    while len(data) > 0:
+        decompressor = bz2.BZ2Decompressor()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b"".join(chunks)
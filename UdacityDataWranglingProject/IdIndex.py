@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to keep a compact set of OSM ids (64 bit integers), for
+checking references like <nd ref="..."/> against the <node> ids.
+
+A set of strings costs around 100 bytes per id, SortedIdIndex keeps the ids in a sorted
+array of 8 byte integers and looks them up with a binary search.  With a path, the
+sorted ids are written to that file and memory-mapped, so only the pages being searched
+are in memory.
+
+The ids in an OSM file are usually sorted, so add() appends to the sorted array.
+Ids added out of order are kept in a small pending set.  Once it gets bigger than
+pendingLimit, it is sorted into a separate run, a SortedIdIndex of its own (written to
+path.runN), and the sorted array is left as it is.  Like a log-structured merge tree, a
+run is merged with the previous one while that one is not more than twice as big, so
+there are O(log n) runs and each id is rewritten O(log n) times, for unsorted input
+too.  A lookup searches the sorted array and each run.
+
+Usage:
+    nodeIds = SortedIdIndex()               #in memory
+    nodeIds = SortedIdIndex("nodeIds.idx")  #disk-backed, memory-mapped
+    nodeIds.add(2406124091)
+    2406124091 in nodeIds   #True
+    nodeIds.close()
+"""
+
+from array import array
+from bisect import bisect_left
+from heapq import merge
+import mmap
+import os
+import shutil
+import struct
+
+
+def _idTypecode():
+    #'l' is 64 bits on Linux and Mac OS X, 'q' is only available in Python 3
+    for typecode in ["l", "q"]:
+        try:
+            if array(typecode).itemsize == 8: return typecode
+        except ValueError:
+            pass
+    raise ValueError("No 64 bit integer array type on this platform")
+
+ID_TYPECODE = _idTypecode()
+ID_STRUCT = struct.Struct("q")
+ID_SIZE = ID_STRUCT.size
+
+
+class SortedIdIndex(object):
+
+    def __init__(self, path=None, bufferSize=1 << 16, pendingLimit=1 << 16):
+        """
+            path - file for the sorted ids, None to keep them in memory
+            bufferSize - ids appended in memory before writing them to path
+            pendingLimit - out of order ids kept in a set before merging them
+        """
+        self.path = path
+        self.bufferSize = bufferSize
+        self.pendingLimit = pendingLimit
+        self.ids = array(ID_TYPECODE)  #sorted ids not yet written to path
+        self.pending = set()
+        self.last = None               #largest id in the sorted ids
+        self.stored = 0                #no. of ids in path
+        self.mapped = None
+        self.mappedCount = 0
+        self.runs = []                 #SortedIdIndex of the ids added out of order
+        self.runCount = 0
+        self.dropped = []              #checkpoint links of the runs merged since the last one
+        self.f = open(path, "w+b") if path is not None else None
+
+    def __len__(self):
+        if self.pending: self.mergePending()
+        if len(self.runs) == 0: return self.stored + len(self.ids)
+        #an id added out of order can also be in the sorted array or in another run
+        return sum(1 for id1 in self)
+
+    def add(self, id1):
+        if self.last is None or id1 > self.last:
+            self.ids.append(id1)
+            self.last = id1
+            if self.f is not None and len(self.ids) >= self.bufferSize: self.flush()
+        elif id1 != self.last:
+            self.pending.add(id1)
+            if len(self.pending) > self.pendingLimit: self.mergePending()
+
+    def __contains__(self, id1):
+        if id1 in self.pending or self._containsSorted(id1): return True
+        for run in self.runs:
+            if run._containsSorted(id1): return True
+        return False
+
+    def _containsSorted(self, id1):
+        ids = self.ids
+        if len(ids) > 0 and id1 >= ids[0]:
+            i = bisect_left(ids, id1)
+            return i < len(ids) and ids[i] == id1
+        return self.stored > 0 and self._searchStored(id1)
+
+    def __iter__(self):
+        if self.pending: self.mergePending()
+        if len(self.runs) == 0: return merge(self._iterStored(), iter(self.ids))
+        return self._dedup(merge(self._iterStored(), iter(self.ids), *[iter(run) for run in self.runs]))
+
+    def flush(self):
+        if self.f is None or len(self.ids) == 0: return
+        self.f.seek(self.stored * ID_SIZE)
+        self.ids.tofile(self.f)
+        self.f.flush()
+        self.stored += len(self.ids)
+        self.ids = array(ID_TYPECODE)
+
+    def mergePending(self):
+        """
+            Sorts the out of order ids into a new run, merging the runs if needed.
+        """
+        pending = sorted(self.pending)
+        self.pending = set()
+        self.runs.append(self._newRun(pending))
+        #a run is merged with the previous one while that one is not more than twice as big
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            second = self.runs.pop()
+            first = self.runs.pop()
+            self.runs.append(self._newRun(self._dedup(merge(iter(first), iter(second)))))
+            self._dropRun(first)
+            self._dropRun(second)
+
+    def _newRun(self, ids):
+        path = "{0}.run{1}".format(self.path, self.runCount) if self.path is not None else None
+        self.runCount += 1
+        run = SortedIdIndex(path, self.bufferSize)
+        chunk = array(ID_TYPECODE)
+        for id1 in ids:
+            chunk.append(id1)
+            if len(chunk) >= self.bufferSize:
+                run._extend(chunk)
+                chunk = array(ID_TYPECODE)
+        run._extend(chunk)
+        run.flush()
+        return run
+
+    def _extend(self, ids):
+        #sorted ids, all bigger than the ones already added
+        if len(ids) == 0: return
+        self.ids.extend(ids)
+        self.last = ids[-1]
+        if self.f is not None: self.flush()
+
+    def _dropRun(self, run):
+        run._unmap()
+        if run.f is not None:
+            run.f.close()
+            run.f = None
+            os.remove(run.path)
+            #the last checkpoint may still need it, see __getstate__
+            self.dropped.append(run.path + ".checkpoint")
+
+    def close(self):
+        self._unmap()
+        for run in self.runs: run.close()
+        self.runs = []
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+            if os.path.exists(self.path + ".checkpoint"): os.remove(self.path + ".checkpoint")
+            #the runs, and those left by a run that was interrupted
+            directory, name = os.path.split(self.path)
+            for filename in os.listdir(directory or "."):
+                if filename.startswith(name + ".run"): os.remove(os.path.join(directory, filename))
+
+    def __getstate__(self):
+        #pickled for a checkpoint (see Checkpoint.py), the ids written to path are linked
+        #to path.checkpoint: a later flush() only appends to the file, that is cut when it
+        #is restored, and a later mergePending() writes a new file
+        self.flush()
+        #the runs merged since the last checkpoint are no longer needed
+        for link in self.dropped:
+            if os.path.exists(link): os.remove(link)
+        self.dropped = []
+        state = self.__dict__.copy()
+        state["f"] = state["mapped"] = None
+        if self.f is not None:
+            self.f.flush()
+            link = self.path + ".checkpoint"
+            if os.path.exists(link): os.remove(link)
+            try:
+                os.link(self.path, link)
+            except OSError:
+                shutil.copyfile(self.path, link)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            link = self.path + ".checkpoint"
+            if not (os.path.exists(self.path) and os.path.samefile(self.path, link)): shutil.copyfile(link, self.path)
+            self.f = open(self.path, "r+b")
+            self.f.truncate(self.stored * ID_SIZE)
+
+    def _dedup(self, ids):
+        prev = None
+        for id1 in ids:
+            if id1 != prev: yield id1
+            prev = id1
+
+    def _iterStored(self):
+        if self.stored == 0: return
+        self.f.flush()
+        self.f.seek(0)
+        remaining = self.stored
+        while remaining > 0:
+            chunk = array(ID_TYPECODE)
+            n = min(remaining, self.bufferSize)
+            chunk.fromfile(self.f, n)
+            remaining -= n
+            for id1 in chunk: yield id1
+
+    def _map(self):
+        if self.mapped is None or self.mappedCount != self.stored:
+            self._unmap()
+            self.mapped = mmap.mmap(self.f.fileno(), self.stored * ID_SIZE, access=mmap.ACCESS_READ)
+            self.mappedCount = self.stored
+        return self.mapped
+
+    def _unmap(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+    def _searchStored(self, id1):
+        mapped = self._map()
+        unpack = ID_STRUCT.unpack_from
+        lo, hi = 0, self.stored
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if unpack(mapped, mid * ID_SIZE)[0] < id1: lo = mid + 1
+            else: hi = mid
+        return lo < self.stored and unpack(mapped, lo * ID_SIZE)[0] == id1
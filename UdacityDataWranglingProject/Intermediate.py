@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to rerun process_map after a change of
+mapcontentAudit_WithCorrection.csv without parsing the OSM xml again.
+
+process_map(file_in, intermediate=True) writes the parsed <node> and <way> elements,
+before any correction, to <file_in>.records while it reads file_in.  The next runs read
+the elements back from that file instead, and apply the corrections of the time, until
+file_in changes.
+
+The file is a header followed by batches of BATCH_SIZE elements, each one marshalled
+and prefixed with its length:
+    <4 byte length><marshal of the header>
+    <4 byte length><marshal of [(tag, names, values, children), ...]>
+    ...
+with the children as (tag, names, values), the same as a CompactRecord (see
+OSMReader.py).  marshal is several times faster than parsing the xml, and the attribute
+names and tags are interned, so they are written once per batch.
+
+The header has the size, modification time and sha1 hash of file_in, and the element
+tags.  Like the corrections cache, the records are used if the size and modification
+time are the same, or else if the sha1 hash is the same (i.e. the file was only
+touched or copied).  Otherwise file_in is parsed again and the records rewritten.  The
+records are written to a temporary file and renamed once complete, so a run that was
+interrupted leaves no partial records.
+
+Usage:
+    records = Intermediate("qc.osm", ["node", "way"])
+    elements = records.read() if records.valid() else records.write(OSMReader("qc.osm", ["node", "way"]))
+    for element in elements:
+        ...
+"""
+
+import hashlib
+import marshal
+import os
+import struct
+
+from OSMReader import CompactRecord, Interner, toRecord
+from Metrics import NULL_METRICS
+
+VERSION = 1
+BATCH_SIZE = 1000
+LENGTH = struct.Struct("<I")
+HASH_CHUNK = 1 << 20
+
+
+def _intern(s):
+    #intern() only takes str, the attribute names of the expat backend can be unicode
+    return intern(s) if type(s) is str else s
+
+
+def intermediateFileName(file_in):
+    return "{0}.records".format(file_in)
+
+
+def sha1File(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, "rb") as f:
+        while True:
+            data = f.read(HASH_CHUNK)
+            if len(data) == 0: break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+class Intermediate(object):
+
+    def __init__(self, filename, tags, path=None, batchSize=BATCH_SIZE):
+        """
+            filename - the OSM file, tags - the element tags that are kept
+            path - records file, <filename>.records if None
+        """
+        self.filename = filename
+        self.tags = sorted(tags)
+        self.path = path if path is not None else intermediateFileName(filename)
+        self.batchSize = batchSize
+
+    def _header(self, sha1=None):
+        stat = os.stat(self.filename)
+        return {"version": VERSION, "size": stat.st_size, "mtime": stat.st_mtime,
+                "sha1": sha1 if sha1 is not None else sha1File(self.filename), "tags": self.tags}
+
+    def readHeader(self):
+        try:
+            with open(self.path, "rb") as f:
+                return marshal.loads(f.read(LENGTH.unpack(f.read(LENGTH.size))[0]))
+        except (IOError, EOFError, ValueError, TypeError, struct.error):
+            return None
+
+    def valid(self):
+        """
+            Whether the records are those of the current filename.
+        """
+        header = self.readHeader()
+        if header is None or header["version"] != VERSION or header["tags"] != self.tags: return False
+        stat = os.stat(self.filename)
+        if header["size"] == stat.st_size and header["mtime"] == stat.st_mtime: return True
+        if header["size"] != stat.st_size or header["sha1"] != sha1File(self.filename): return False
+        #same content, the header gets the new modification time
+        self._rewriteHeader(self._header(header["sha1"]))
+        return True
+
+    def _rewriteHeader(self, header):
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as f:
+            with open(tmp, "wb") as out:
+                f.seek(LENGTH.unpack(f.read(LENGTH.size))[0], os.SEEK_CUR)
+                self._writeBlock(out, header)
+                while True:
+                    data = f.read(HASH_CHUNK)
+                    if len(data) == 0: break
+                    out.write(data)
+        os.rename(tmp, self.path)
+
+    def _writeBlock(self, out, value):
+        data = marshal.dumps(value)
+        out.write(LENGTH.pack(len(data)))
+        out.write(data)
+
+    def write(self, elements):
+        """
+            Yields the elements (as CompactRecords) while writing them to the records file.
+        """
+        header = self._header()
+        tmp = self.path + ".tmp"
+        out = open(tmp, "wb")
+        try:
+            self._writeBlock(out, header)
+            batch = []
+            for element in elements:
+                record = toRecord(element)
+                batch.append((_intern(record.tag), tuple(_intern(name) for name in record.names), record.values,
+                              tuple((_intern(child.tag), tuple(_intern(name) for name in child.names), child.values)
+                                    for child in record.children)))
+                if len(batch) >= self.batchSize:
+                    self._writeBlock(out, batch)
+                    batch = []
+                yield record
+            if len(batch) > 0: self._writeBlock(out, batch)
+            out.close()
+            os.rename(tmp, self.path)
+        finally:
+            #not read to the end, the records are incomplete
+            if not out.closed: out.close()
+            if os.path.exists(tmp): os.remove(tmp)
+
+    def read(self, metrics=NULL_METRICS):
+        """
+            Yields the elements of the records file as CompactRecords.
+        """
+        interned = Interner()
+        if metrics.enabled and metrics.totalBytes is None: metrics.totalBytes = os.path.getsize(self.path)
+        f = metrics.watch(open(self.path, "rb"))
+        try:
+            f.read(LENGTH.unpack(f.read(LENGTH.size))[0])
+            while True:
+                length = f.read(LENGTH.size)
+                if len(length) == 0: break
+                for tag, names, values, children in marshal.loads(f.read(LENGTH.unpack(length)[0])):
+                    yield CompactRecord(tag, interned(names), values,
+                                        tuple(CompactRecord(childTag, interned(childNames), childValues)
+                                              for childTag, childNames, childValues in children))
+        finally:
+            f.close()
@@ -9,30 +9,48 @@
             a.  it has non-street words like corner, Along, etc
             b.  it has problem characters like comma
             c.  are all in lower case
-            d.  might be duplicate
+            d.  might be duplicate, i.e. a near duplicate of a more frequent value
+                (see NearDuplicates.py), which is written as the Suggested Value
     2.  If k=="postcode", determine whether it's a valid Quezon City postcode
     
     Note that only k attributes that has up to two identifiers like "addr:street" 
     are checked, the rest are ignored.
     
-    All are written to mapContentAudit.csv with the following headers: Comment, Tag K, Tag V
+    All are written to mapContentAudit.csv with the following headers: Comment, Tag K, Tag V,
+    Suggested Value
     Sample:
-    Comment,            Tag K,        Tag Value
-    Spelling Check,       street,        15th
-    Duplicate,            street,        15th Avenue
-    Has problem words,    street,        "4th Avenue, corner C. Cordero"
-    Has problem chars,    street,        "537 EDSA, Cubao"
+    Comment,            Tag K,        Tag Value,                         Suggested Value
+    Spelling Check,       street,        15th Avenue,
+    Duplicate,            street,        Quirno Highway,                    Quirino Highway
+    Has problem words,    street,        "4th Avenue, corner C. Cordero",
+    Has problem chars,    street,        "537 EDSA, Cubao",
 
     The purpose of writing to a csv file is to have a thorough check of the "v" value, so that
-    corrections can be added on the 4th column "Corrections".  The updated csv should be saved as 
-    mapContentAudit_WithCorrections.csv.  This file is used as input to PrepForDB.py.
+    corrections can be added in a 5th column named "Correction" (the Suggested Value can be
+    copied there).  Rows with an empty Correction are ignored.  The updated csv should be
+    saved as mapcontentAudit_WithCorrection.csv.  This file is used as input to PrepForDB.py.
+
+    The k and v are read from the tagKV.stats store written by MapStructureAudit.py, one
+    key at a time, so the whole set of values is never in memory.  The tagKV.pickle of
+    older runs and OSM xml files can be audited too.
+
+    The keys are independent of each other, auditTag(filename, processes=4) audits them
+    in a pool of processes, each reading the values of its keys from the store.  The rows
+    are written in the order of the keys whatever the number of processes.
     
 
 """
-import xml.etree.ElementTree as ET
 import re
 import pickle
 import csv
+import multiprocessing
+
+import os
+import tempfile
+
+from OSMReader import OSMReader, peakMemoryMB
+from TagStats import TagStatsWriter, TagStatsReader
+from NearDuplicates import canonicalValues
 
 streetduplicate = {
                    u'Ara\xf1eta AVenue': "Araneta Avenue"
@@ -70,67 +88,167 @@ streetduplicate = {
 problemchars = re.compile(r'[=\+/&<>;\'"?%#$@,]')
 problemwords = re.compile("([C|c]or(ner)?)|(Along)|(Infront)|(Intersection)|([S|s]ubdivision)|(Intramuros)|(Mall)|(Department)")
 
-def auditTag(filename):
+def auditTag(filename, backend="etree", processes=1):
+    if filename.endswith(".stats") or filename.endswith(".pickle"):
+        writeAudit(loadTags(filename, backend), processes=processes)
+    else:
+        #an OSM xml file, the k and v are counted into a temporary store first
+        fd, path = tempfile.mkstemp(suffix=".stats", dir=".")
+        os.close(fd)
+        try:
+            writeTagStats(filename, path, backend)
+            writeAudit(TagStatsReader(path), processes=processes)
+        finally:
+            for name in [path, path + ".idx"]:
+                if os.path.exists(name): os.remove(name)
+    print "\npeak memory (MB): %.1f" % peakMemoryMB()
+
+
+def loadTags(filename, backend="etree"):
+    """
+        Returns the k -> values of filename, a TagStatsReader for a .stats store, a dict
+        of k -> set(v) for a tagKV.pickle or an OSM xml file.
+    """
     tags = {}
-    if filename == "tagKV.pickle":
+    if filename.endswith(".stats"):
+        tags = TagStatsReader(filename)
+    elif filename.endswith(".pickle"):
         with open(filename, "rb") as ifile:
             tags = pickle.load(ifile)
     else:    
-        with open(filename, "r") as osm_file:
-            for _, elem in ET.iterparse(osm_file):
-                if elem.tag in ["node", "way"]:
-                    for elem1 in elem.iter("tag"):
-                        k = elem1.attrib["k"].strip()
-                        v = elem1.attrib["v"].strip()
-                        tag = tags.get(k, set())
-                        tag.add(v)
-                        tags[k] = v
-    
-    with open("mapcontentAudit.csv", "wb") as csvfile:
-        fieldnames = ["Comment", "Tag K", "Tag Value"]
-        writer = csv.DictWriter(csvfile, fieldnames)
+        #OSMReader opens the file, decompressing .bz2 and .gz
+        for elem in OSMReader(filename, ["node", "way"], backend):
+            for elem1 in elem.iter("tag"):
+                k = elem1.attrib["k"].strip()
+                v = elem1.attrib["v"].strip()
+                tag = tags.get(k, set())
+                tag.add(v)
+                tags[k] = tag
+    return tags
+
+
+def writeTagStats(filename, path, backend="etree"):
+    writer = TagStatsWriter(path)
+    #OSMReader opens the file, decompressing .bz2 and .gz
+    for elem in OSMReader(filename, ["node", "way"], backend):
+        for elem1 in elem.iter("tag"):
+            writer.add(elem1.attrib["k"].strip(), elem1.attrib["v"].strip())
+    writer.close()
+
+
+FIELDNAMES = ["Comment", "Tag K", "Tag Value", "Suggested Value"]
+
+def writeAudit(tags, filename="mapcontentAudit.csv", processes=1):
+    """
+        Writes the rows of each key to filename, the keys are in sorted order.
+            tags - a TagStatsReader, or a dict of k -> values
+            processes - with more than 1, the keys are audited by a pool of processes,
+                        the rows are still written in the order of the keys
+    """
+    with open(filename, "wb") as csvfile:
+        writer = csv.DictWriter(csvfile, FIELDNAMES)
         writer.writeheader()
-        for k, vset in tags.iteritems():
+        for k, rows in auditKeys(tags, processes):
             print "\nchecking values for k: ", k
-            k = k.split(":")
-            if len(k) > 2:
+            if rows is None:
                 print "\nignoring k, for now we are only checking up to 2 identifier"
                 continue
             
-            row = {}
-            kId = k[1] if len(k) == 2 else k[0]
-            prev = None
-            for v in sorted(vset, key=lambda v: getKey(kId, v)):
-                comment = ""
-                aNumber = False
-                if kId == "street": 
-                    comment = auditStreet(v)
-                elif kId == "postcode": 
-                    comment = validPostCode(v)
-                    aNumber = True
-                #all are in lower case
-                elif v.lower() == v: 
-                    aNumber = isANumber(v)
-                    if aNumber == False:  comment = "Lower Case"
-                
-                
-                #might be duplicate
-                cleanedVal = getKey(kId, v)
-                if comment == "" and aNumber == False and prev is not None and cleanedVal.find(prev) > -1:
-                    comment = "Duplicate"
-                else: prev = cleanedVal
-                    
-                if aNumber == False and comment == "": comment = "Spelling Check"
-                
-                row[fieldnames[0]] = comment
-                row[fieldnames[1]] = kId
-                row[fieldnames[2]] = v
-
+            for row in rows:
                 try:
-                    if comment != "":  writer.writerow(row)
+                    writer.writerow(row)
                 except:
                     print "Ignored: ", row
 
+
+def auditKeys(tags, processes=1):
+    """
+        Yields (k, rows of auditKey) for each key in sorted order.
+    """
+    stored = isinstance(tags, TagStatsReader)
+    if processes <= 1:
+        items = tags.iteritems() if stored else sorted(tags.iteritems())
+        for k, vset in items: yield k, auditKey(k, vset)
+        return
+
+    #a worker reads the values of its keys from the store, a dict is sent key by key
+    if stored:
+        keys = tags.keys()
+        pool = multiprocessing.Pool(processes, _initAuditWorker, (tags.path,))
+        tasks, worker = keys, _auditStoredKey
+    else:
+        keys = sorted(tags)
+        pool = multiprocessing.Pool(processes)
+        tasks, worker = ((k, tags[k]) for k in keys), _auditKeyValues
+    try:
+        #the few big keys (name, street) take most of the time, small chunks keep the
+        #processes busy until the end
+        chunksize = max(1, len(keys) // (processes * 16))
+        for result in pool.imap(worker, tasks, chunksize): yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+_worker = {}
+
+def _initAuditWorker(path):
+    _worker["tags"] = TagStatsReader(path)
+
+
+def _auditStoredKey(k):
+    return k, auditKey(k, _worker["tags"].values(k))
+
+
+def _auditKeyValues(args):
+    k, vset = args
+    return k, auditKey(k, vset)
+
+
+def auditKey(k, vset):
+    """
+        Returns the csv rows of the values of the key k, None if the key is ignored.
+            vset - the values, a {v: count} dict of a TagStatsReader or a set
+    """
+    k = k.split(":")
+    if len(k) > 2: return None
+    
+    rows = []
+    kId = k[1] if len(k) == 2 else k[0]
+    #a TagStats store gives the number of occurrences of each value
+    counts = vset if isinstance(vset, dict) else None
+    #the known typos of the streets are never suggested
+    corrections = streetduplicate if kId.find("street") > -1 else None
+    canonical = canonicalValues(vset, counts, lambda v: getKey(kId, v), corrections=corrections)
+    for v in sorted(vset, key=lambda v: getKey(kId, v)):
+        comment = ""
+        aNumber = False
+        if kId == "street": 
+            comment = auditStreet(v)
+        elif kId == "postcode": 
+            comment = validPostCode(v)
+            aNumber = True
+        #all are in lower case
+        elif v.lower() == v: 
+            aNumber = isANumber(v)
+            if aNumber == False:  comment = "Lower Case"
+        
+        
+        #might be duplicate
+        suggested = canonical.get(v, v)
+        if comment == "" and aNumber == False and suggested != v:
+            comment = "Duplicate"
+            
+        if aNumber == False and comment == "": comment = "Spelling Check"
+        
+        if comment != "":
+            rows.append({FIELDNAMES[0]: comment, FIELDNAMES[1]: kId, FIELDNAMES[2]: v,
+                         FIELDNAMES[3]: suggested if suggested != v else ""})
+    return rows
+
 def getKey(k, v):
     value = v
     if k.find("street") > -1:
@@ -168,4 +286,4 @@ def auditStreet(street):
         
 
 if __name__ == "__main__":
-    auditTag("tagKV.pickle")
+    auditTag("tagKV.stats")
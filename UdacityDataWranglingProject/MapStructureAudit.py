@@ -7,11 +7,19 @@ Below are the actions/processes that are executed:
         whether they conform to the expected data type.
     2.  Checks whether k has problem characters.
     3.  Checks whether k and v is empty
-    4.  Checks whether node references in <way> tag has corresponding nodes.
+    4.  Checks whether node references in <way> tag has corresponding nodes, and
+        whether the member references in <relation> tag has corresponding node, way
+        or relation, whatever the order of the elements (see ReferenceCheck.py).
+        The node ids are kept in a compact SortedIdIndex, pass nodeIndexFile to
+        auditMap to keep it in a memory-mapped file instead of in memory.
     5.  Keeps track of all the element/tags, print their total at the end
     6.  Prints out the total unique users/contributors
-    7.  Saves the k and v attribute values in a tagKV.pickle file.  
+        With auditMap(filename, approximate=True), the users, invalid attributes, references
+        and tags are counted approximately in a fixed amount of memory, for huge files
+    7.  Saves the k and v attribute values, with their number of occurrences, in a
+        tagKV.stats store (see TagStats.py).
         This file is use as an input to MapContentAudit.py for content evaluation
+    8.  A long run can be checkpointed and resumed, see auditMap and Checkpoint.py
         
 
 Output of this class when evaluating qc.osm
@@ -65,124 +73,372 @@ set([])
 
 no. of unique users 934
 
-Writing tagKV.pickle for K and V attributes
+Writing tagKV.stats for K and V attributes
 
          
 """
 
 
-import xml.etree.ElementTree as ET
+import os
 import pprint
 import re
-import pickle
+from itertools import chain
+
+from OSMReader import OSMReader, peakMemoryMB, isPBF
+from CompressedInput import compression
+from ReferenceCheck import ReferenceCheck, BloomReferenceCheck
+from Sketches import HyperLogLog, HeavyHitters, ReservoirSample
+from Metrics import NULL_METRICS, clock
+from TagStats import TagStatsWriter
+from AttributeCheck import AttributeCheck, isTimestamp, isANumber, isAFloat
+from Checkpoint import Checkpoint, CHECKPOINT_BYTES
 
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
-from datetime import datetime
-def isTimestamp(val):
-    try:
-        datetime.strptime(val, "%Y-%m-%dT%H:%M:%SZ")
-        return True
-    except:
-        return False
-    
-def isANumber(val):
-    try:
-        int(val)
-        return True
-    except:        
-        return False
-    
-def isAFloat(val):
-    try:
-        float(val)
-        return True
-    except:
-        return False
-
-def auditMap(filename):
-        tags = {}
-        users = {}
-        nodeIds = set()
-        unknownNodeIds = set()
-        tagKV = {}
-        invalids = []
-        
-        for _, element in ET.iterparse(filename):
+#input bytes per node, low so the Bloom filters of the approximate audit are big enough
+BYTES_PER_NODE = {"xml": 100, "bz2": 10, "gz": 10, "pbf": 5}
+
+class StructureAudit(object):
+    """
+        Validates the attributes of <node>, <way>, <relation> and their child elements,
+        keeps track of the element counts, users and node references.
+        process() is called for each top level element handed back by OSMReader.
+        
+        The attributes of the <node>, <way> and <relation> are checked in batches of
+        batchSize elements (see AttributeCheck.py).  The invalid ones are inserted in
+        self.invalids where they would have been appended, so the report is in the order
+        of the file, and the valid ids are declared to the ReferenceCheck.
+    """
+
+    def __init__(self, nodeIndexFile=None, batchSize=4096):
+        self.tags = {}
+        self.users = {}
+        self.refs = ReferenceCheck(nodeIndexFile)
+        self.invalids = []
+        self.batchSize = batchSize
+        self.checks = dict((tag, AttributeCheck(tag)) for tag in ["node", "way", "relation"])
+        self.pending = 0
+
+    def process(self, element):
+        #children (nd, tag, member) are visited before their parent, same as iterparse end events
+        for elem in chain(element, [element]): self.processOne(elem)
+
+    def processOne(self, element):
+        tags = self.tags
+        
+        #keep track of tags
+        tag_ctr = tags.get(element.tag,0)
+        tags[element.tag] = tag_ctr + 1
+        
+        #validate data type            
+        eInvalid = {}
+        eInvalid["node"] = element.tag
+        if element.tag in ["node", "way", "relation"]:
+            #keep track of users
+            attrib = element.attrib
+            uid = attrib.get("uid", None)
+            if uid is not None: self.countUser(uid)
             
-            #keep track of tags
-            tag_ctr = tags.get(element.tag,0)
-            tags[element.tag] = tag_ctr + 1
+            #checked with the batch, the row is where it goes in self.invalids
+            self.checks[element.tag].add(attrib, (len(self.invalids), self.pending))
+            self.pending += 1
+            if self.pending >= self.batchSize: self.validate()
             
-            #validate data type            
-            eInvalid = {}
-            eInvalid["node"] = element.tag
-            if element.tag in ["node", "way", "relation"]:
-                id1 = element.attrib["id"]
-                lat = element.attrib.get("lat", None)
-                lon = element.attrib.get("lon", None)
-                ver = element.attrib["version"]
-                timestamp = element.attrib["timestamp"]
-                changeset = element.attrib["changeset"]
-                uid = element.attrib["uid"]
-                
-                #keep track of users
-                n = users.get(uid, 0)
-                users[uid] = n + 1
-                
-                if (isANumber(id1)  == False or isANumber(ver)  == False or isTimestamp(timestamp) == False or isANumber(changeset)  == False
-                    or isANumber(uid)  == False or len(element.attrib["user"].strip()) == 0):
-                    eInvalid.update(element.attrib)
-                elif (element.tag == "node" and (isAFloat(lat)  == False or  isAFloat(lon) == False)):
-                    eInvalid.update(element.attrib)
-                elif element.tag == "node": nodeIds.add(id1)
-                
-            elif element.tag == "nd":
-                if element.attrib["ref"] not in nodeIds: unknownNodeIds.add(element.attrib["ref"])
-                
-            elif element.tag == "tag":
-                k = element.attrib["k"].strip()
-                v = element.attrib["v"].strip()
-                 
-                #check if k has problem characters?
-                if problemchars.search(k): eInvalid.update(element.attrib)
+        elif element.tag == "nd":
+            self.refs.reference("nd", "node", element.attrib["ref"])
+            
+        elif element.tag == "member":
+            self.refs.reference("member", element.attrib["type"], element.attrib["ref"])
+            
+        elif element.tag == "tag":
+            k = element.attrib["k"].strip()
+            v = element.attrib["v"].strip()
+             
+            #check if k has problem characters?
+            if problemchars.search(k): eInvalid.update(element.attrib)
+            
+            elif (len(k) == 0 or len(v) == 0):
+                eInvalid.update(element.attrib)
                 
-                elif (len(k) == 0 or len(v) == 0):
-                    eInvalid.update(element.attrib)
-                else:
-                    values = tagKV.get(k, set())
-                    values.add(v)
-                    tagKV[k] = values
-                    
-                    """
-                    kArr = k.split(":")
-                    if (len(kArr)==2 and kArr[0] in ["addr",""]):
-                        if kArr[1] == "street": streets.add(v)
-                        if kArr[1] == "postcode":
-                            totalPostalCode.add(v)
-                            if validPostCode(v) == False: invalidPostalCodes.add(v)
-                    elif kArr[0] == "postal_code":
-                        totalPostalCode.add(v)
-                        if validPostCode(v) == False: invalidPostalCodes.add(v)
-                    """
-            if len(eInvalid) > 1: invalids.append(eInvalid)
+        if len(eInvalid) > 1: self.addInvalid(eInvalid)
+
+    def countUser(self, uid):
+        self.users[uid] = self.users.get(uid, 0) + 1
+
+    def addInvalid(self, eInvalid, position=None):
+        if position is None: self.invalids.append(eInvalid)
+        else: self.invalids.insert(position, eInvalid)
+
+    def validate(self):
+        """
+            Checks the batch of <node>, <way> and <relation> attributes.
+        """
+        invalid = []
+        for tag, check in self.checks.iteritems():
+            for row, attrib, valid in check.validate():
+                if valid: self.refs.declare(tag, int(attrib["id"]))
+                else: invalid.append((row, tag, attrib))
+        
+        #rows are (position in self.invalids, order in the batch)
+        invalid.sort()
+        for inserted, ((position, order), tag, attrib) in enumerate(invalid):
+            eInvalid = {"node": tag}
+            eInvalid.update(attrib)
+            self.addInvalid(eInvalid, position + inserted)
+        self.pending = 0
+
+    def finish(self, root):
+        self.validate()
+        unknown = self.refs.unknown()
+        self.refs.close()
+        if root is not None: self.tags[root.tag] = self.tags.get(root.tag, 0) + 1
         
         print "\n*******************INVALID ATTRIBUTE VALUES / DATA TYPE**********************"                
-        pprint.pprint(invalids)
+        pprint.pprint(self.invalids)
         
         print "\n*******************UNKNOWN  NODE REFERENCE**********************"                
-        pprint.pprint(unknownNodeIds)
+        pprint.pprint(unknown.get(("nd", "node"), set()))
+        
+        print "\n*******************UNKNOWN  MEMBER REFERENCE**********************"                
+        pprint.pprint(dict((osmType, refs) for (source, osmType), refs in unknown.iteritems() if source == "member"))
         
         print "\n*******************TAG/ELEMENTS**********************"                
-        pprint.pprint(tags)
+        pprint.pprint(self.tags)
         
         
-        print "\nno. of unique users", len(users)
+        print "\nno. of unique users", len(self.users)
+
+
+class ApproximateStructureAudit(StructureAudit):
+    """
+        StructureAudit in a fixed amount of memory, for country or planet files (see
+        Sketches.py): the unique users are counted with a HyperLogLog, the invalid
+        attributes are a random sample of sampleSize, and the references are checked
+        against Bloom filters of the ids declared before them (see BloomReferenceCheck).
+        
+        The memory is fixed once the filters are sized: about 1.5 bytes per expected node
+        id for the Bloom filters (1.2 for the nodes, 0.15 for each of the ways and the
+        relations), i.e. 15 MB for 10 million nodes, plus 2 ** p bytes for the users and
+        the sampleSize invalid elements of the sample.
+    """
+
+    def __init__(self, sampleSize=100, p=14, capacity=10000000, batchSize=4096):
+        """
+            p - 2 ** p registers of the HyperLogLog of the users
+            capacity - expected no. of node ids, for sizing the Bloom filters, see
+                       expectedNodes()
+        """
+        self.tags = {}
+        self.users = HyperLogLog(p)
+        self.refs = BloomReferenceCheck(capacity)
+        self.invalids = ReservoirSample(sampleSize)
+        self.batchSize = batchSize
+        self.checks = dict((tag, AttributeCheck(tag)) for tag in ["node", "way", "relation"])
+        self.pending = 0
+
+    def processOne(self, element):
+        #the ids of the batch are only declared by validate(), a reference is checked
+        #against the ids declared before it, those of the batch included
+        if element.tag == "nd": osmType = "node"
+        elif element.tag == "member": osmType = element.attrib["type"]
+        else: osmType = None
+        if osmType in self.checks and len(self.checks[osmType]) > 0: self.validate()
+        StructureAudit.processOne(self, element)
 
-        #tagKV.pickle will be further evaluated in MapContentAudit.py        
-        print "\nWriting tagKV.pickle for K and V attributes"
-        with open("tagKV.pickle", "wb") as output:
-            pickle.dump(tagKV, output)
+    def countUser(self, uid):
+        self.users.add(uid)
+
+    def addInvalid(self, eInvalid, position=None):
+        self.invalids.add(eInvalid)
+
+    def finish(self, root):
+        self.validate()
+        if root is not None: self.tags[root.tag] = self.tags.get(root.tag, 0) + 1
+        
+        print "\n*******************INVALID ATTRIBUTE VALUES / DATA TYPE (SAMPLE)**********************"
+        print "%d invalid, a random sample of %d:" % (self.invalids.seen, len(self.invalids))
+        pprint.pprint(list(self.invalids))
+        
+        print "\n*******************REFERENCES NOT DECLARED BEFORE THEM**********************"
+        pprint.pprint(self.refs.unknown())
+        print "up to %.2g%% of the references not declared are missed (Bloom filter false positives)" % (
+            100 * self.refs.falsePositiveRate())
+        
+        print "\n*******************TAG/ELEMENTS**********************"
+        pprint.pprint(self.tags)
+        
+        print "\nno. of unique users ~%d (+/- %.1f%%, 95%% confidence)" % (len(self.users), 200 * self.users.error())
+
+
+def expectedNodes(filename):
+    """
+        A generous estimate of the no. of nodes of filename, from its size.
+    """
+    if isPBF(filename): kind = "pbf"
+    else: kind = compression(filename) or "xml"
+    return max(1000, os.path.getsize(filename) // BYTES_PER_NODE[kind])
+
+
+class TagKVCollector(object):
+    """
+        Counts the valid k and v attributes of <tag> elements into a TagStats store,
+        tagKV.stats, this file is evaluated further in MapContentAudit.py
+    """
+
+    def __init__(self, filename="tagKV.stats", maxEntries=1000000):
+        self.filename = filename
+        self.writer = TagStatsWriter(filename, maxEntries)
+
+    def process(self, element):
+        add = self.writer.add
+        for elem in element.iter("tag"):
+            k = elem.attrib["k"].strip()
+            v = elem.attrib["v"].strip()
+            
+            #same as the validation in StructureAudit, skip invalid k and empty k or v
+            if problemchars.search(k) or len(k) == 0 or len(v) == 0: continue
+            
+            add(k, v)
+            
+            """
+            kArr = k.split(":")
+            if (len(kArr)==2 and kArr[0] in ["addr",""]):
+                if kArr[1] == "street": streets.add(v)
+                if kArr[1] == "postcode":
+                    totalPostalCode.add(v)
+                    if validPostCode(v) == False: invalidPostalCodes.add(v)
+            elif kArr[0] == "postal_code":
+                totalPostalCode.add(v)
+                if validPostCode(v) == False: invalidPostalCodes.add(v)
+            """
+
+    def finish(self, root):
+        print "\nWriting %s for K and V attributes" % self.filename
+        self.writer.close()
+
+
+class ApproximateTagCollector(object):
+    """
+        Counts the valid k and v attributes of <tag> elements in a fixed amount of memory
+        (see Sketches.py): the most frequent keys and (k, v) pairs, and the no. of distinct
+        values of the first maxKeys keys.  Nothing is written for MapContentAudit.py.
+    """
+
+    def __init__(self, k=50, p=10, maxKeys=10000):
+        """
+            k - no. of most frequent keys and (k, v) pairs reported
+            p - 2 ** p registers of the HyperLogLog of the values of each key
+        """
+        self.keys = HeavyHitters(k)
+        self.pairs = HeavyHitters(k)
+        self.values = {}
+        self.p = p
+        self.maxKeys = maxKeys
+
+    def process(self, element):
+        values = self.values
+        for elem in element.iter("tag"):
+            k = elem.attrib["k"].strip()
+            v = elem.attrib["v"].strip()
+            
+            #same as the validation in StructureAudit, skip invalid k and empty k or v
+            if problemchars.search(k) or len(k) == 0 or len(v) == 0: continue
+            
+            self.keys.add(k)
+            self.pairs.add((k, v))
+            distinct = values.get(k, None)
+            if distinct is None:
+                if len(values) >= self.maxKeys: continue
+                distinct = values[k] = HyperLogLog(self.p)
+            distinct.add(v)
+
+    def finish(self, root):
+        error, probability = self.keys.errorBound()
+        valueError = 200 * HyperLogLog(self.p).error()
+        
+        print "\n*******************MOST FREQUENT TAG KEYS (APPROXIMATE)**********************"
+        print "counts are at most %d above the real count (%.0f%% probability)," % (error, 100 * probability)
+        print "distinct values are +/- %.0f%% (95%% confidence)" % valueError
+        for k, count in self.keys.top():
+            distinct = self.values.get(k, None)
+            print "%-30s %10d %10s" % (k, count, "~%d" % len(distinct) if distinct is not None else "")
+        
+        print "\n*******************MOST FREQUENT TAG VALUES (APPROXIMATE)**********************"
+        pprint.pprint(self.pairs.top())
+        if len(self.values) >= self.maxKeys:
+            print "\ndistinct values only counted for the first %d keys" % self.maxKeys
+
+
+def auditMap(filename, nodeIndexFile=None, backend="etree", metrics=NULL_METRICS, checkpointBytes=None,
+             resume=False, approximate=False, capacity=None):
+        """
+            With approximate=True, the audit runs in a fixed amount of memory for country or
+            planet files, with approximate counts and their error bounds (see
+            ApproximateStructureAudit and ApproximateTagCollector), and no tagKV.stats.
+            The Bloom filters are sized for capacity node ids, estimated from the size of
+            filename if None.
+            
+            With checkpointBytes, the state of the audit is saved to
+            <filename>.audit.checkpoint, in the current directory, every checkpointBytes of
+            input, and resume=True continues an interrupted run from its last checkpoint
+            (see Checkpoint.py).  The ids are then kept in nodeIndexFile, or
+            <filename>.audit.ids if None, so a checkpoint does not copy them.
+        """
+        timed = metrics.enabled
+        
+        if resume and checkpointBytes is None: checkpointBytes = CHECKPOINT_BYTES
+        checkpoint = None
+        saved = None
+        indexFile = None
+        if checkpointBytes is not None:
+            base = os.path.basename(filename) + ".audit"
+            checkpoint = Checkpoint(filename, base + ".checkpoint", checkpointBytes)
+            if nodeIndexFile is None and not approximate: nodeIndexFile = indexFile = base + ".ids"
+            if resume: saved = checkpoint.load()
+        
+        #a new StructureAudit would empty the nodeIndexFile of the checkpoint
+        if saved is not None:
+            print "\nResuming from byte %d of %s" % (saved["offset"], filename)
+            audit, collector = saved["state"]
+        elif approximate:
+            audit = ApproximateStructureAudit(capacity=capacity or expectedNodes(filename))
+            collector = ApproximateTagCollector()
+        else:
+            audit = StructureAudit(nodeIndexFile)
+            collector = TagKVCollector()
+        
+        if checkpoint is not None:
+            reader = checkpoint
+            elements = checkpoint.iterElements(lambda: (None, (audit, collector)), saved["offset"] if saved else 0,
+                                               backend=backend, metrics=metrics)
+        else:
+            reader = OSMReader(metrics.watch(filename), backend=backend)
+            elements = reader
+        
+        if timed: t = clock()
+        for element in elements:
+            if timed:
+                t = metrics.add("parse", t)
+                metrics.count(element.tag)
+            audit.process(element)
+            if timed: t = metrics.add("validate", t)
+            collector.process(element)
+            if timed:
+                metrics.add("tags", t)
+                metrics.tick()
+                t = clock()
+        
+        audit.finish(reader.root)
+        
+        #tagKV.stats will be further evaluated in MapContentAudit.py        
+        if timed: t = clock()
+        collector.finish(reader.root)
+        if timed: metrics.add("write", t)
+        metrics.close()
+        if checkpoint is not None: checkpoint.remove()
+        if indexFile is not None and os.path.exists(indexFile): os.remove(indexFile)
+        
+        print "\npeak memory (MB): %.1f" % peakMemoryMB()
         
         """        
         import StreetInspect
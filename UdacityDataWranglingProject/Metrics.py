@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to show the progress of long runs of process_map and auditMap,
+and where the time goes.
+
+Metrics keeps:
+    - a timer per stage, i.e. parse, shape, correction, serialize, write
+    - a counter per element type, i.e. node, way, relation
+    - the bytes read out of the total size of the input, with the rate and the ETA
+    - the peak memory
+and emits them as a json line every interval seconds, and once more at the end, to a
+metrics file or to stderr.
+
+The instrumented code asks for metrics.enabled once and only reads the clock when it is
+True.  NULL_METRICS is the disabled Metrics, the default, so the cost when disabled is a
+boolean check per element.
+
+Usage:
+    process_map("qc.osm", metrics=Metrics("metrics.jsonl"))
+    auditMap("qc.osm", metrics=Metrics("-"))    #to stderr
+
+    #in the instrumented code
+    if metrics.enabled: t = clock()
+    ...
+    if metrics.enabled: metrics.add("shape", t)
+"""
+
+import json
+import os
+import sys
+import time
+
+from OSMReader import peakMemoryMB
+from CompressedInput import compression, openInput
+
+clock = time.time
+
+
+class CountingFile(object):
+    """
+        Read only file object that counts the bytes read, for the progress.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.name = getattr(f, "name", None)
+        self.bytesRead = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.bytesRead += len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class Metrics(object):
+    enabled = True
+
+    def __init__(self, output="-", interval=5.0, totalBytes=None):
+        """
+            output - file name for the json lines, "-" for stderr
+            interval - seconds between two json lines
+            totalBytes - size of the input, for the percent done and the ETA
+        """
+        self.out = sys.stderr if output == "-" else open(output, "a")
+        self.interval = interval
+        self.totalBytes = totalBytes
+        self.timers = {}
+        self.counters = {}
+        self.bytesRead = 0
+        self.start = clock()
+        self.lastEmit = self.start
+        self.source = None
+
+    def watch(self, source):
+        """
+            Returns source (file name or file object) wrapped in a CountingFile, so the
+            bytes read are reported.  For a compressed file, the bytes read are the
+            compressed bytes.
+        """
+        if isinstance(source, basestring):
+            if self.totalBytes is None: self.totalBytes = os.path.getsize(source)
+            if compression(source) is not None:
+                self.source = openInput(source)
+                return self.source
+            source = open(source, "rb")
+        self.source = CountingFile(source)
+        return self.source
+
+    def add(self, stage, start):
+        """
+            Adds the time since start to the stage timer, returns the current time so it can
+            be used as the start of the next stage.
+        """
+        now = clock()
+        self.timers[stage] = self.timers.get(stage, 0.0) + now - start
+        return now
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def tick(self):
+        """
+            Called once per element, emits a json line every interval seconds.
+        """
+        now = clock()
+        if now - self.lastEmit >= self.interval:
+            self.lastEmit = now
+            self.emit()
+
+    def snapshot(self, final=False):
+        now = clock()
+        elapsed = now - self.start
+        if self.source is not None: self.bytesRead = self.source.bytesRead
+        snapshot = {"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+                    "elapsed": round(elapsed, 2),
+                    "bytesRead": self.bytesRead,
+                    "mbPerSec": round(self.bytesRead / elapsed / 1048576.0, 2) if elapsed > 0 else None,
+                    "counters": self.counters,
+                    "timers": dict((k, round(v, 3)) for k, v in self.timers.iteritems()),
+                    "peakMemoryMB": round(peakMemoryMB(), 1),
+                    "final": final}
+        if self.totalBytes:
+            done = float(self.bytesRead) / self.totalBytes
+            snapshot["totalBytes"] = self.totalBytes
+            snapshot["percent"] = round(100 * done, 1)
+            snapshot["eta"] = round(elapsed * (1 - done) / done, 1) if done > 0 else None
+        return snapshot
+
+    def emit(self, final=False):
+        self.out.write(json.dumps(self.snapshot(final), sort_keys=True) + "\n")
+        self.out.flush()
+
+    def close(self):
+        self.emit(True)
+        if self.source is not None: self.source.close()
+        if self.out is not sys.stderr: self.out.close()
+
+
+class NullMetrics(object):
+    """
+        Disabled metrics, every method does nothing.
+    """
+    enabled = False
+
+    def watch(self, source):
+        return source
+
+    def add(self, stage, start):
+        return start
+
+    def count(self, name, n=1):
+        pass
+
+    def tick(self):
+        pass
+
+    def emit(self, final=False):
+        pass
+
+    def close(self):
+        pass
+
+NULL_METRICS = NullMetrics()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to find the values of a tag key that are probably the same
+value typed differently, i.e. "Quirno Highway" and "Quirino Highway", "Santola Road" and
+"Santolan Road", without comparing every pair of values.
+
+Values are compared after normalization (by default lower case without "." and spaces),
+and two values are near duplicates if their edit distance (Levenshtein) is at most one
+edit per charsPerEdit characters of the shorter value, and at most maxDistance.
+
+Candidate pairs come from an index of the deletion neighborhoods of the values: if two
+values are within d edits, deleting at most d characters from each of them gives a
+common string.  Each value is looked up and indexed with all the strings obtained by
+deleting up to d of its characters, so it is only compared to the values sharing such a
+string, which are nearly always real near duplicates, and the cost is linear in the
+number of values.  Segment or q-gram indexes are not used because every street name
+shares "street", "avenue" or "road" with thousands of others.
+
+The values are processed by increasing length and the index of the lengths that can no
+longer match is dropped, so only the neighborhoods of a few lengths are in memory.  The
+candidates are verified with a banded edit distance.  Values that differ in their numbers
+are never near duplicates, "4th Avenue" and "5th Avenue" or "Road 1" and "Road 11" are
+different streets.
+
+The groups are not the transitive closure of the near duplicate pairs, which would chain
+values one edit apart into a single group of unrelated values.  Each group is built
+around its canonical value: the values are taken from the best to the worst, and each
+value not yet in a group starts a group with its near duplicates not yet in a group.
+The best value is the most frequent one (using the counts of the TagStats store when
+available), then the longest, then the first in sorted order.  A value of the corrections
+table (i.e. a known typo) stands for its correction: its length is that of the correction,
+it comes after the correction itself, and it is replaced by the correction when it is the
+best value of its group, so a known typo is never the canonical value.
+
+Usage:
+    clusters = findClusters(["Quirino Highway", "Quirno Highway", "Santolan Road"],
+                            {"Quirino Highway": 12, "Quirno Highway": 1})
+    #[("Quirino Highway", ["Quirino Highway", "Quirno Highway"])]
+    canonical = canonicalValues(values, counts, corrections={"Quirno Highway": "Quirino Highway"})
+"""
+
+import gc
+import re
+
+_numbers = re.compile(r"\d+")
+
+
+def normalize(value):
+    return value.replace(".", "").replace(" ", "").lower()
+
+
+def deletions(value, d):
+    """
+        The strings obtained by deleting up to d characters of value, value included.
+    """
+    result = set([value])
+    frontier = result
+    for i in xrange(d):
+        frontier = set(w[:j] + w[j + 1:] for w in frontier for j in xrange(len(w)))
+        result |= frontier
+    return result
+
+
+def editDistance(a, b, limit):
+    """
+        Levenshtein distance of a and b, or limit + 1 if it is more than limit.  Only the
+        band of width 2 * limit + 1 around the diagonal is computed.
+    """
+    if abs(len(a) - len(b)) > limit: return limit + 1
+    if len(a) > len(b): a, b = b, a
+    big = limit + 1
+    previous = range(len(b) + 1)
+    for i in xrange(1, len(a) + 1):
+        lo = max(1, i - limit)
+        hi = min(len(b), i + limit)
+        current = [big] * (len(b) + 1)
+        current[0] = i if i <= limit else big
+        ca = a[i - 1]
+        best = current[0]
+        for j in xrange(lo, hi + 1):
+            cost = previous[j - 1] + (ca != b[j - 1])
+            if previous[j] + 1 < cost: cost = previous[j] + 1
+            if current[j - 1] + 1 < cost: cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best: best = cost
+        if best > limit: return big
+        previous = current
+    return min(previous[len(b)], big)
+
+
+def findClusters(values, counts=None, normalizer=normalize, maxDistance=2, charsPerEdit=5, corrections=None):
+    """
+        Returns [(canonical, [values])] for each group of near duplicate values, in sorted
+        order of the canonical values.  Values without near duplicates are left out.
+            values - the distinct values of a tag key
+            counts - {value: occurrences}, to choose the canonical value
+            corrections - {typo: correction}, the typos are never canonical values
+    """
+    if counts is None: counts = {}
+    if corrections is None: corrections = {}
+    #the index is millions of small objects, the garbage collector would go through them
+    #again and again while they are created
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        return _findClusters(values, counts, normalizer, maxDistance, charsPerEdit, corrections)
+    finally:
+        if gcEnabled: gc.enable()
+
+
+def _findClusters(values, counts, normalizer, maxDistance, charsPerEdit, corrections):
+    #values with the same normalized form are exact duplicates, only the forms are compared
+    forms = {}
+    for v in values:
+        forms.setdefault(normalizer(v), []).append(v)
+    formList = sorted(forms)
+
+    #near duplicate forms of each form
+    neighbors = [[] for form in formList]
+
+    #allowed edits of each form, it only depends on the length
+    limit = lambda length: min(maxDistance, length // charsPerEdit)
+
+    #length of the deleted strings -> deleted string -> forms
+    index = {}
+    for f in sorted(xrange(len(formList)), key=lambda f: len(formList[f])):
+        form = formList[f]
+        size = len(form)
+        d = limit(size)
+        if d == 0: continue
+        for length in [length for length in index if length < size - maxDistance]: del index[length]
+
+        numbers = _numbers.findall(form)
+        candidates = set()
+        for deleted in deletions(form, d):
+            byLength = index.get(len(deleted), None)
+            if byLength is None: byLength = index[len(deleted)] = {}
+            #most deleted strings belong to a single form, only the others get a list
+            postings = byLength.get(deleted, None)
+            if postings is None:
+                byLength[deleted] = f
+            elif type(postings) is int:
+                candidates.add(postings)
+                byLength[deleted] = [postings, f]
+            else:
+                candidates.update(postings)
+                postings.append(f)
+
+        for c in candidates:
+            other = formList[c]
+            pairLimit = min(d, limit(len(other)))
+            if _numbers.findall(other) != numbers: continue
+            if editDistance(form, other, pairLimit) <= pairLimit:
+                neighbors[f].append(c)
+                neighbors[c].append(f)
+
+    #the best value of each form, and the forms from the best to the worst
+    rank = lambda v: (-counts.get(v, 0), -len(corrections.get(v, v)), v in corrections, v)
+    best = [min(forms[form], key=rank) for form in formList]
+    order = sorted(xrange(len(formList)), key=lambda f: rank(best[f]))
+
+    clusters = []
+    grouped = [False] * len(formList)
+    for f in order:
+        if grouped[f]: continue
+        grouped[f] = True
+        members = list(forms[formList[f]])
+        for c in neighbors[f]:
+            if grouped[c]: continue
+            grouped[c] = True
+            members.extend(forms[formList[c]])
+        if len(members) < 2: continue
+        clusters.append((corrections.get(best[f], best[f]), sorted(members)))
+    clusters.sort()
+    return clusters
+
+
+def canonicalValues(values, counts=None, normalizer=normalize, maxDistance=2, charsPerEdit=5, corrections=None):
+    """
+        Returns {value: canonical value} for the values that have a near duplicate.
+    """
+    canonical = {}
+    for value, members in findClusters(values, counts, normalizer, maxDistance, charsPerEdit, corrections):
+        for v in members: canonical[v] = value
+    return canonical
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to keep the position of every node while streaming the map,
+so the <way> documents can have the coordinates of their nodes, not only the node_refs.
+
+NodeStore keeps fixed width arrays instead of Python dicts, written to two files and
+memory-mapped for the lookups:
+    <path>.ids    - sorted node ids, 8 bytes each
+    <path>.coords - lat and lon of each id, as 4 byte integers in 1e-7 degrees, the
+                    precision of the OSM xml
+so it costs 16 bytes per node on disk and only the pages being searched in memory.
+
+The nodes of an OSM file are sorted by id and come before the ways.  A node that is
+added out of order is kept in a small dict.  Once it has unsortedLimit nodes, they are
+sorted into a run, a NodeStore of its own (<path>.runN.ids/.coords), and runs are
+merged like the runs of IdIndex.SortedIdIndex, so memory stays bounded for unsorted or
+merged extracts too.  A way can only be resolved with the nodes that come before it in
+the file.
+
+Usage:
+    store = NodeStore("qc.nodes")
+    store.add(2406124091, 14.6500000, 121.0300000)
+    store.get(2406124091)   #(14.65, 121.03)
+    store.close()
+"""
+
+from array import array
+from bisect import bisect_left
+from heapq import merge
+import mmap
+import os
+import struct
+import tempfile
+
+from IdIndex import ID_TYPECODE, ID_STRUCT, ID_SIZE
+
+COORD_TYPECODE = "i"
+COORD_STRUCT = struct.Struct("ii")
+SCALE = 10000000
+
+
+class NodeStore(object):
+
+    def __init__(self, path=None, bufferSize=1 << 16, unsortedLimit=1 << 16):
+        """
+            path - prefix of the .ids and .coords files, None for temporary files that are
+                   removed on close
+            unsortedLimit - nodes added out of order kept in a dict before sorting them
+                            into a run
+        """
+        self.temporary = path is None
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".nodes")
+            os.close(fd)
+            os.remove(path)
+        self.path = path
+        self.bufferSize = bufferSize
+        self.unsortedLimit = unsortedLimit
+        self.idFile = open(path + ".ids", "w+b")
+        self.coordFile = open(path + ".coords", "w+b")
+        self.ids = array(ID_TYPECODE)         #not yet written to the files
+        self.coords = array(COORD_TYPECODE)
+        self.unsorted = {}
+        self.runs = []                        #NodeStore of the nodes added out of order
+        self.runCount = 0
+        self.last = None
+        self.stored = 0
+        self.mapped = None
+        self.mappedCount = 0
+
+    def __len__(self):
+        return self.stored + len(self.ids) + len(self.unsorted) + sum(len(run) for run in self.runs)
+
+    def add(self, id1, lat, lon):
+        lat7 = int(round(lat * SCALE))
+        lon7 = int(round(lon * SCALE))
+        if self.last is None or id1 > self.last:
+            self._append(id1, lat7, lon7)
+        else:
+            self.unsorted[id1] = (lat7, lon7)
+            if len(self.unsorted) >= self.unsortedLimit: self.spill()
+
+    def _append(self, id1, lat7, lon7):
+        self.ids.append(id1)
+        self.coords.append(lat7)
+        self.coords.append(lon7)
+        self.last = id1
+        if len(self.ids) >= self.bufferSize: self.flush()
+
+    def spill(self):
+        """
+            Sorts the nodes added out of order into a new run, merging the runs if needed.
+        """
+        unsorted = sorted((id1, lat7, lon7) for id1, (lat7, lon7) in self.unsorted.iteritems())
+        self.unsorted = {}
+        self.runs.append(self._newRun(unsorted))
+        #a run is merged with the previous one while that one is not more than twice as big
+        while len(self.runs) > 1 and len(self.runs[-2]) <= 2 * len(self.runs[-1]):
+            second = self.runs.pop()
+            first = self.runs.pop()
+            self.runs.append(self._newRun(_mergeNewest(first._iterStored(), second._iterStored())))
+            first._remove()
+            second._remove()
+
+    def _newRun(self, nodes):
+        run = NodeStore("{0}.run{1}".format(self.path, self.runCount), self.bufferSize)
+        self.runCount += 1
+        for id1, lat7, lon7 in nodes: run._append(id1, lat7, lon7)
+        run.flush()
+        return run
+
+    def _iterStored(self):
+        #(id, lat7, lon7) of the nodes written to the files
+        self.idFile.seek(0)
+        self.coordFile.seek(0)
+        remaining = self.stored
+        while remaining > 0:
+            n = min(remaining, self.bufferSize)
+            ids = array(ID_TYPECODE)
+            ids.fromfile(self.idFile, n)
+            coords = array(COORD_TYPECODE)
+            coords.fromfile(self.coordFile, 2 * n)
+            remaining -= n
+            for i, id1 in enumerate(ids): yield id1, coords[2 * i], coords[2 * i + 1]
+
+    def _remove(self):
+        self._unmap()
+        self.idFile.close()
+        self.coordFile.close()
+        os.remove(self.path + ".ids")
+        os.remove(self.path + ".coords")
+
+    def get(self, id1):
+        """
+            Returns (lat, lon) of the node, None if it is not in the store.
+        """
+        coord = self.unsorted.get(id1, None)
+        #the last one added wins, the newest runs first
+        for run in reversed(self.runs):
+            if coord is not None: break
+            coord = run._getSorted(id1)
+        if coord is None: coord = self._getSorted(id1)
+        if coord is None: return None
+        return (coord[0] / float(SCALE), coord[1] / float(SCALE))
+
+    def _getSorted(self, id1):
+        ids = self.ids
+        if len(ids) > 0 and id1 >= ids[0]:
+            i = bisect_left(ids, id1)
+            if i == len(ids) or ids[i] != id1: return None
+            return (self.coords[2 * i], self.coords[2 * i + 1])
+        if self.stored > 0: return self._getStored(id1)
+        return None
+
+    def flush(self):
+        if len(self.ids) == 0: return
+        self.ids.tofile(self.idFile)
+        self.coords.tofile(self.coordFile)
+        self.idFile.flush()
+        self.coordFile.flush()
+        self.stored += len(self.ids)
+        self.ids = array(ID_TYPECODE)
+        self.coords = array(COORD_TYPECODE)
+
+    def close(self):
+        if not self.temporary: self.flush()
+        for run in self.runs: run._remove()
+        self.runs = []
+        self._unmap()
+        self.idFile.close()
+        self.coordFile.close()
+        if self.temporary:
+            os.remove(self.path + ".ids")
+            os.remove(self.path + ".coords")
+
+    def _map(self):
+        if self.mapped is None or self.mappedCount != self.stored:
+            self._unmap()
+            self.mapped = (mmap.mmap(self.idFile.fileno(), self.stored * ID_SIZE, access=mmap.ACCESS_READ),
+                           mmap.mmap(self.coordFile.fileno(), self.stored * COORD_STRUCT.size, access=mmap.ACCESS_READ))
+            self.mappedCount = self.stored
+        return self.mapped
+
+    def _unmap(self):
+        if self.mapped is not None:
+            for m in self.mapped: m.close()
+            self.mapped = None
+
+    def _getStored(self, id1):
+        mappedIds, mappedCoords = self._map()
+        unpack = ID_STRUCT.unpack_from
+        lo, hi = 0, self.stored
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if unpack(mappedIds, mid * ID_SIZE)[0] < id1: lo = mid + 1
+            else: hi = mid
+        if lo == self.stored or unpack(mappedIds, lo * ID_SIZE)[0] != id1: return None
+        return COORD_STRUCT.unpack_from(mappedCoords, lo * COORD_STRUCT.size)
+
+
+def _mergeNewest(older, newer):
+    """
+        Merges two sorted iterables of (id, lat7, lon7), keeping the node of newer for
+        an id in both.
+    """
+    previous = None
+    for node in merge(((id1, 1, lat7, lon7) for id1, lat7, lon7 in newer),
+                      ((id1, 2, lat7, lon7) for id1, lat7, lon7 in older)):
+        if node[0] != previous: yield node[0], node[2], node[3]
+        previous = node[0]
+
+
+def addNode(store, element):
+    """
+        Adds the position of a <node> element, ignoring nodes without a valid position.
+    """
+    try:
+        store.add(int(element.attrib["id"]), float(element.attrib["lat"]), float(element.attrib["lon"]))
+    except (KeyError, ValueError):
+        pass
+
+
+def addGeometry(doc, store, geometry="coords"):
+    """
+        Adds the coordinates of the node_refs of a way document, if all the nodes are in
+        the store.  Returns False if some nodes are missing.
+            geometry - "coords" adds "coords": [[lat, lon], ...], in the same order as "pos"
+                       "geojson" adds "geometry", a GeoJSON LineString, or a Polygon if the
+                       way is closed, with [lon, lat] coordinates
+    """
+    coords = []
+    for ref in doc.get("node_refs", []):
+        try:
+            coord = store.get(int(ref))
+        except ValueError:
+            coord = None
+        if coord is None: return False
+        coords.append(coord)
+    if len(coords) == 0: return False
+
+    if geometry == "geojson":
+        points = [[lon, lat] for lat, lon in coords]
+        if len(points) >= 4 and points[0] == points[-1]:
+            doc["geometry"] = {"type": "Polygon", "coordinates": [points]}
+        else:
+            doc["geometry"] = {"type": "LineString", "coordinates": points}
+    else:
+        doc["coords"] = [[lat, lon] for lat, lon in coords]
+    return True
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to read the OSM xml in a streaming fashion, with memory
+that stays flat regardless of the size of the map.
+
+ET.iterparse() keeps every parsed element attached to the root, so the whole tree ends up
+in memory even if the elements are no longer used.  OSMReader listens to the start and end
+events, keeps track of the depth and only hands back the top level elements, i.e.
+<node>, <way>, <relation>, <bounds>, once they are fully built (children included).
+After the caller is done with an element, the element is cleared and removed from the
+root together with its earlier siblings.
+
+The xml parser is selected with backend:
+    etree  - xml.etree.ElementTree.iterparse, the default
+    cetree - xml.etree.cElementTree.iterparse, the C version of etree (Python 2)
+    lxml   - lxml.etree.iterparse, only if lxml is installed
+    expat  - a handler on the expat parser that builds lightweight Record objects
+             directly, without building Element objects for the <nd> and <tag> children
+
+A Record has the same tag, attrib, iteration over the children and iter() as an
+Element, so shape_element, auditMap and auditTag work with any of the backends.
+
+toRecord() copies an element to a CompactRecord, to keep it in a batch (see
+PrepForDB.ShapePipeline).  Its attribute names are a tuple shared by the elements with
+the same attributes, the values a tuple, and the repeated values (tag keys and values,
+user, uid, ...) are interned, so a batch of records costs a fraction of the memory of
+Records with a dict each, and leaves less garbage to collect.
+
+A .osm.bz2 or .osm.gz file name is decompressed while reading, see CompressedInput.py.
+A .osm.pbf file is read by PBFReader, with any backend, its blocks are decoded by
+processes (None for the no. of cpus) processes.
+
+Usage:
+    reader = OSMReader("qc.osm", ["node", "way"], backend="expat")
+    for element in reader:
+        ...     #element is only valid until the next iteration
+    print reader.root.tag   #osm
+
+peakMemoryMB() returns the peak resident memory of the current process, it is printed
+at the end of auditMap, auditTag and process_map to confirm that memory stays flat.
+
+Running this file compares the speed of the backends:
+    python OSMReader.py qc.osm
+"""
+
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+import re
+import resource
+import sys
+import time
+
+from CompressedInput import compression, openInput
+
+try:
+    import xml.etree.cElementTree as cET
+except ImportError:
+    cET = ET
+
+try:
+    from lxml import etree as lxmlET
+except ImportError:
+    lxmlET = None
+
+OSM_ELEMENTS = ["node", "way", "relation"]
+BACKENDS = ["etree", "cetree", "expat", "lxml"]
+READ_SIZE = 64 * 1024
+#attributes with values repeated across elements, interned by toRecord
+INTERNED_ATTRIBUTES = frozenset(["version", "changeset", "user", "uid", "k", "v", "type", "role"])
+INTERNED_SIZE = 1 << 16
+
+nonascii = re.compile(b"[\x80-\xff]").search
+
+
+class Record(object):
+    """
+        Lightweight element built by the expat backend, children are Records too.
+    """
+    __slots__ = ["tag", "attrib", "children"]
+
+    def __init__(self, tag, attrib, children=()):
+        self.tag = tag
+        self.attrib = attrib
+        self.children = children
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def items(self):
+        return self.attrib.items()
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag: yield self
+        for child in self.children:
+            if tag is None or child.tag == tag: yield child
+
+    def clear(self):
+        self.attrib = {}
+        self.children = []
+
+    def __reduce__(self):
+        return (Record, (self.tag, self.attrib, self.children))
+
+
+class CompactRecord(object):
+    """
+        Element copied by toRecord, with the attribute names and values in two tuples,
+        children are CompactRecords too.
+    """
+    __slots__ = ["tag", "names", "values", "children"]
+
+    def __init__(self, tag, names, values, children=()):
+        self.tag = tag
+        self.names = names
+        self.values = values
+        self.children = children
+
+    @property
+    def attrib(self):
+        #a new dict on each access, the hot paths use get() and items() instead
+        return dict(zip(self.names, self.values))
+
+    def __iter__(self):
+        return iter(self.children)
+
+    def __len__(self):
+        return len(self.children)
+
+    def get(self, key, default=None):
+        try:
+            return self.values[self.names.index(key)]
+        except ValueError:
+            return default
+
+    def items(self):
+        return zip(self.names, self.values)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag: yield self
+        for child in self.children:
+            if tag is None or child.tag == tag: yield child
+
+    def __reduce__(self):
+        return (CompactRecord, (self.tag, self.names, self.values, self.children))
+
+
+class Interner(object):
+    """
+        Table of the values seen so far, returning the first one of the equal values, so
+        a repeated value is kept once.  Unlike intern(), it also takes unicode and tuples,
+        and stops growing once it has maxSize values of a type.
+    """
+
+    def __init__(self, maxSize=INTERNED_SIZE):
+        self.maxSize = maxSize
+        #one table per type, "a" and u"a" are equal but not interchangeable
+        self.tables = {}
+
+    def __call__(self, value):
+        table = self.tables.get(type(value), None)
+        if table is None: table = self.tables[type(value)] = {}
+        interned = table.get(value, None)
+        if interned is not None: return interned
+        if len(table) < self.maxSize: table[value] = value
+        return value
+
+
+class OSMReader(object):
+
+    def __init__(self, source, tags=None, backend="etree", processes=None):
+        """
+            source - file name or file object of the OSM xml (or pbf)
+            tags - top level element tags to hand back, None for all top level elements
+            backend - one of BACKENDS
+            processes - no. of processes decoding a pbf file
+        """
+        if backend not in BACKENDS: raise ValueError("Unknown backend: {0}".format(backend))
+        if backend == "lxml" and lxmlET is None: raise ImportError("lxml is not installed")
+        self.source = source
+        self.tags = set(tags) if tags is not None else None
+        self.backend = backend
+        self.processes = processes
+        self.root = None
+
+    def __iter__(self):
+        if isPBF(self.source): return self._iterPBF()
+        if compression(self.source) is not None: return self._iterCompressed()
+        return self._iter(self.source)
+
+    def _iter(self, source):
+        if self.backend == "expat": return self._iterExpat(source)
+        if self.backend == "cetree": return self._iterTree(source, cET.iterparse)
+        if self.backend == "lxml": return self._iterTree(source, lxmlET.iterparse)
+        return self._iterTree(source, ET.iterparse)
+
+    def _iterCompressed(self):
+        source = openInput(self.source)
+        try:
+            for element in self._iter(source): yield element
+        finally:
+            source.close()
+
+    def _iterPBF(self):
+        #PBFReader builds OSMReader Records, so it is imported here and not at the top
+        from PBFReader import PBFReader
+        reader = PBFReader(self.source, self.tags, self.processes)
+        for element in reader:
+            self.root = reader.root
+            yield element
+        self.root = reader.root
+
+    def _iterTree(self, source, iterparse):
+        depth = 0
+        for event, element in iterparse(source, events=("start", "end")):
+            if event == "start":
+                if depth == 0: self.root = element
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth != 1: continue
+
+            if self.tags is None or element.tag in self.tags:
+                yield element
+
+            #free the element and drop it, and anything before it, from the root
+            element.clear()
+            del self.root[:]
+
+    def _iterExpat(self, source):
+        records = []
+        state = {"depth": 0, "current": None}
+        tags = self.tags
+
+        def start(name, attrs):
+            #attrs is [name, value, name, value, ...] of utf-8 str, same as ElementTree
+            #ascii values are kept as str and the others are converted to unicode
+            if nonascii(b"".join(attrs)):
+                attrs = [_fixtext(a.decode("utf-8")) for a in attrs]
+            attrs = dict(zip(attrs[::2], attrs[1::2]))
+            depth = state["depth"]
+            if depth == 0:
+                self.root = Record(name, attrs, [])
+            elif depth == 1:
+                state["current"] = Record(name, attrs, []) if tags is None or name in tags else None
+            else:
+                current = state["current"]
+                if current is not None: current.children.append(Record(name, attrs))
+            state["depth"] = depth + 1
+
+        def end(name):
+            state["depth"] -= 1
+            if state["depth"] == 1 and state["current"] is not None:
+                records.append(state["current"])
+                state["current"] = None
+
+        parser = expat.ParserCreate()
+        parser.returns_unicode = False
+        parser.ordered_attributes = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+
+        f = open(source, "rb") if isinstance(source, basestring) else source
+        try:
+            while True:
+                data = f.read(READ_SIZE)
+                parser.Parse(data, len(data) == 0)
+                for record in records: yield record
+                del records[:]
+                if len(data) == 0: break
+        finally:
+            if f is not source: f.close()
+
+
+_interned = Interner()
+
+def toRecord(element, interned=_interned):
+    """
+        A CompactRecord copy of an element and its children.  The etree backends clear
+        the element when the next one is read, the copy can be kept.
+    """
+    if isinstance(element, CompactRecord): return element
+    return CompactRecord(interned(element.tag), *_compactAttrib(element.attrib, interned),
+                         children=tuple(CompactRecord(interned(child.tag), *_compactAttrib(child.attrib, interned))
+                                        for child in element))
+
+
+def _compactAttrib(attrib, interned):
+    items = attrib.items()
+    names = interned(tuple(name for name, val in items))
+    values = tuple(interned(val) if name in INTERNED_ATTRIBUTES else val for name, val in items)
+    return names, values
+
+
+def _fixtext(text):
+    try:
+        return str(text)
+    except UnicodeError:
+        return text
+
+
+def isPBF(source):
+    #a file name, or a file object with a name, i.e. the CountingFile of Metrics
+    name = source if isinstance(source, basestring) else getattr(source, "name", None)
+    return isinstance(name, basestring) and name.endswith(".pbf")
+
+
+def iterElements(source, tags=None, backend="etree"):
+    return iter(OSMReader(source, tags, backend))
+
+
+def peakMemoryMB():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on Mac OS X and in kilobytes on Linux
+    if sys.platform == "darwin": return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+
+def benchmarkBackends(filename, backends=None):
+    """
+        Reads filename with each backend, the same way as auditMap does (every element and
+        child is visited), and prints the time and the speedup compared to etree.
+    """
+    if backends is None: backends = [b for b in BACKENDS if b != "lxml" or lxmlET is not None]
+    results = {}
+    for backend in backends:
+        start = time.time()
+        count = 0
+        for element in OSMReader(filename, backend=backend):
+            for child in element:
+                count += len(child.attrib)
+            count += 1
+        results[backend] = time.time() - start
+
+    base = results.get("etree", None)
+    for backend in backends:
+        speedup = " (%.1fx)" % (base / results[backend]) if base else ""
+        print "%-8s %8.2f s%s" % (backend, results[backend], speedup)
+    return results
+
+
+if __name__ == "__main__":
+    benchmarkBackends(sys.argv[1] if len(sys.argv) > 1 else "qc.osm")
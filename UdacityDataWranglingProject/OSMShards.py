@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to split a large OSM xml file into byte ranges that can be
+parsed independently, i.e. by several worker processes.
+
+Each range starts on a top level <node, <way or <relation start tag, so no element is
+split between two ranges.  A "<" can not appear unescaped inside an attribute value and
+the OSM xml has no comments or CDATA, so searching for the start tag text is enough.
+
+ShardFile wraps a byte range in <osm> and </osm> so it can be read by OSMReader:
+
+    for start, end in shardOffsets("qc.osm", 8):
+        for element in OSMReader(ShardFile("qc.osm", start, end), ["node", "way"]):
+            ...
+"""
+
+import os
+import re
+
+elementStart = re.compile(r'<(node|way|relation)[\s/>]')
+rootEnd = re.compile(r'</osm\s*>')
+
+SCAN_SIZE = 1024 * 1024
+
+
+def findElementStart(f, offset, limit):
+    """
+        Returns the offset of the first <node, <way or <relation start tag at or after
+        offset, or limit if there is none before limit.
+    """
+    f.seek(offset)
+    tail = ""
+    while offset < limit:
+        chunk = f.read(min(SCAN_SIZE, limit - offset))
+        if not chunk: break
+        buf = tail + chunk
+        m = elementStart.search(buf)
+        if m: return offset - len(tail) + m.start()
+        #keep the end of the chunk in case the start tag is split between two reads
+        tail = buf[-16:]
+        offset += len(chunk)
+    return limit
+
+
+def findRootEnd(f, size):
+    """
+        Returns the offset of the closing </osm> tag, searching backwards from the end.
+    """
+    offset = size
+    while offset > 0:
+        start = max(0, offset - SCAN_SIZE)
+        f.seek(start)
+        buf = f.read(offset - start + 16)
+        matches = list(rootEnd.finditer(buf))
+        if matches: return start + matches[-1].start()
+        offset = start
+    return size
+
+
+def shardOffsets(filename, shards):
+    """
+        Splits filename into at most shards (start, end) byte ranges aligned on element
+        boundaries, in file order.  The ranges cover all the <node>, <way> and <relation>
+        elements, the header (<osm>, <bounds>) and the closing </osm> are left out.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        end = findRootEnd(f, size)
+        first = findElementStart(f, 0, end)
+        starts = [first]
+        for i in range(1, shards):
+            target = first + (end - first) * i // shards
+            if target <= starts[-1]: continue
+            start = findElementStart(f, target, end)
+            if start < end and start > starts[-1]: starts.append(start)
+
+    return zip(starts, starts[1:] + [end])
+
+
+class ShardFile(object):
+    """
+        Read only file object over the byte range [start, end) of filename, wrapped in
+        <osm> and </osm>.
+    """
+
+    def __init__(self, filename, start, end, header="<osm>", footer="</osm>"):
+        self.f = open(filename, "rb")
+        self.f.seek(start)
+        self.remaining = end - start
+        self.header = header
+        self.footer = footer
+
+    def read(self, size=-1):
+        if size is None or size < 0: size = self.remaining + len(self.header) + len(self.footer)
+        data = ""
+        if self.header:
+            data, self.header = self.header[:size], self.header[size:]
+        if len(data) < size and self.remaining > 0:
+            chunk = self.f.read(min(size - len(data), self.remaining))
+            self.remaining -= len(chunk)
+            if not chunk: self.remaining = 0
+            data += chunk
+        if len(data) < size and self.remaining == 0 and self.footer:
+            n = size - len(data)
+            data, self.footer = data + self.footer[:n], self.footer[n:]
+        return data
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
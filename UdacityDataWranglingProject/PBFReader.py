@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to read the OSM PBF format, the default format of the
+planet and Geofabrik extracts, several times smaller and faster to read than the xml.
+
+A PBF file is a sequence of blobs, each one a zlib compressed protocol buffer message:
+    OSMHeader - the bounding box and the features needed to read the file
+    OSMData   - a PrimitiveBlock of about 8000 nodes, ways or relations, with a string
+                table for all the keys, values, roles and user names of the block
+Nodes are usually stored as DenseNodes, where the ids, positions, timestamps, etc. are
+arrays of delta coded numbers, as are the node refs of the ways and the member ids of
+the relations.
+
+The protocol buffer messages are decoded here in Python (no protobuf package needed),
+and each node, way and relation is returned as an OSMReader.Record with the same tag,
+attributes and children as the xml:
+    <node id="1" lat="14.6500000" lon="121.0300000" version="2" changeset="100"
+          timestamp="2015-06-01T10:00:00Z" user="alice" uid="1"> <tag k="..." v="..."/>
+    <way ...> <nd ref="1"/> ... <tag .../>
+    <relation ...> <member type="way" ref="10" role="outer"/> ... <tag .../>
+so shape_element, auditMap and auditTag work the same with a .osm.pbf file.  The bounding
+box of the header is returned as a <bounds> element, like in the xml.
+
+The blocks are independent of each other, they are decoded by a pool of processes,
+keeping the file order.  Only the elements of the tags asked for are built.
+
+Usage:
+    for element in OSMReader("philippines-latest.osm.pbf", ["node", "way"]):
+        ...
+"""
+
+from collections import deque
+import multiprocessing
+import struct
+import time
+import zlib
+
+from OSMReader import Record, nonascii, _fixtext
+
+SUPPORTED_FEATURES = set(["OsmSchema-V0.6", "DenseNodes", "HistoricalInformation"])
+MAX_HEADER_SIZE = 64 * 1024
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+MEMBER_TYPES = ["node", "way", "relation"]
+
+HEADER_LENGTH = struct.Struct(">I")
+
+
+class PBFReader(object):
+
+    def __init__(self, source, tags=None, processes=None):
+        """
+            source - file name or file object of the .osm.pbf
+            tags - element tags to return, None for all of them
+            processes - no. of processes decoding the blocks, None for the no. of cpus
+        """
+        self.source = source
+        self.tags = set(tags) if tags is not None else None
+        self.processes = processes if processes is not None else multiprocessing.cpu_count()
+        self.root = None
+
+    def __iter__(self):
+        f = open(self.source, "rb") if isinstance(self.source, basestring) else self.source
+        try:
+            blobs = iterBlobs(f)
+            for blobType, blob in blobs:
+                if blobType == "OSMHeader":
+                    self.root, bounds = decodeHeader(decodeBlob(blob))
+                    if bounds is not None and (self.tags is None or "bounds" in self.tags): yield bounds
+                    break
+                if blobType == "OSMData": raise ValueError("OSMData before the OSMHeader")
+
+            data = (blob for blobType, blob in blobs if blobType == "OSMData")
+            if self.processes > 1:
+                blocks = self._decodeParallel(data)
+            else:
+                blocks = (decodeBlock((blob, self.tags)) for blob in data)
+            for records in blocks:
+                for record in records: yield record
+        finally:
+            if f is not self.source: f.close()
+
+    def _decodeParallel(self, blobs):
+        #at most 2 blocks per process in progress, so memory stays bounded
+        pool = multiprocessing.Pool(self.processes)
+        pending = deque()
+        try:
+            for blob in blobs:
+                pending.append(pool.apply_async(decodeBlock, ((blob, self.tags),)))
+                if len(pending) >= 2 * self.processes: yield pending.popleft().get()
+            while pending: yield pending.popleft().get()
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+
+def iterBlobs(f):
+    """
+        Yields (type, blob) of each BlobHeader and Blob of the file.
+    """
+    while True:
+        data = f.read(4)
+        if len(data) == 0: return
+        if len(data) < 4: raise ValueError("Truncated PBF file")
+        size = HEADER_LENGTH.unpack(data)[0]
+        if size > MAX_HEADER_SIZE: raise ValueError("BlobHeader too big: {0}".format(size))
+        header = f.read(size)
+        buf = bytearray(header)
+        blobType, dataSize = None, 0
+        for field, value in iterFields(buf, 0, len(buf)):
+            if field == 1: blobType = header[value[0]:value[1]]
+            elif field == 3: dataSize = value
+        if dataSize > MAX_BLOB_SIZE: raise ValueError("Blob too big: {0}".format(dataSize))
+        blob = f.read(dataSize)
+        if len(blob) < dataSize: raise ValueError("Truncated PBF file")
+        yield blobType, blob
+
+
+def decodeBlob(blob):
+    buf = bytearray(blob)
+    for field, value in iterFields(buf, 0, len(buf)):
+        if field == 1: return blob[value[0]:value[1]]
+        if field == 3: return zlib.decompress(blob[value[0]:value[1]])
+        if field in [4, 5, 6, 7]: raise ValueError("Only raw and zlib blobs are supported")
+    return b""
+
+
+"""
+    Protocol buffer decoding: a message is a sequence of (field number << 3 | wire type)
+    keys followed by a varint (wire type 0), 8 bytes (1), a length and the bytes (2) or
+    4 bytes (5).  Packed repeated numbers are a length and the varints.
+"""
+
+def readVarint(buf, pos):
+    b = buf[pos]
+    if b < 0x80: return b, pos + 1
+    result = b & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        b = buf[pos]
+        result |= (b & 0x7f) << shift
+        if b < 0x80: return result, pos + 1
+        shift += 7
+
+
+def iterFields(buf, pos, end):
+    """
+        Yields (field number, value), the value is an int for varints and fixed numbers,
+        (start, end) for length delimited fields.
+    """
+    while pos < end:
+        key, pos = readVarint(buf, pos)
+        wireType = key & 7
+        if wireType == 0:
+            value, pos = readVarint(buf, pos)
+        elif wireType == 2:
+            size, pos = readVarint(buf, pos)
+            value = (pos, pos + size)
+            pos += size
+        elif wireType == 1:
+            value = struct.unpack_from("<q", buf, pos)[0]
+            pos += 8
+        elif wireType == 5:
+            value = struct.unpack_from("<i", buf, pos)[0]
+            pos += 4
+        else:
+            raise ValueError("Unsupported wire type: {0}".format(wireType))
+        yield key >> 3, value
+
+
+def unpacked(buf, span):
+    values = []
+    append = values.append
+    pos, end = span
+    while pos < end:
+        b = buf[pos]
+        if b < 0x80:
+            append(b)
+            pos += 1
+        else:
+            value, pos = readVarint(buf, pos)
+            append(value)
+    return values
+
+
+def unpackedDelta(buf, span):
+    values = []
+    append = values.append
+    last = 0
+    for n in unpacked(buf, span):
+        last += (n >> 1) ^ -(n & 1)
+        append(last)
+    return values
+
+
+def int64(n):
+    #int64 fields are not zigzag coded, a negative number is a 10 byte varint
+    return n - (1 << 64) if n >= (1 << 63) else n
+
+
+def zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def decodeHeader(data):
+    """
+        Returns the <osm> root Record and the <bounds> Record (None if no bbox).
+    """
+    buf = bytearray(data)
+    bounds = None
+    generator = "PBF"
+    for field, value in iterFields(buf, 0, len(buf)):
+        if field == 1:
+            box = dict((f, zigzag(v)) for f, v in iterFields(buf, value[0], value[1]))
+            bounds = Record("bounds", {"minlon": formatCoord(box.get(1, 0)), "maxlon": formatCoord(box.get(2, 0)),
+                                       "maxlat": formatCoord(box.get(3, 0)), "minlat": formatCoord(box.get(4, 0))}, [])
+        elif field == 4:
+            feature = str(data[value[0]:value[1]])
+            if feature not in SUPPORTED_FEATURES: raise ValueError("Unsupported PBF feature: {0}".format(feature))
+        elif field == 16:
+            generator = str(data[value[0]:value[1]])
+    return Record("osm", {"version": "0.6", "generator": generator}, []), bounds
+
+
+def formatCoord(nano):
+    """
+        Nanodegrees to the 7 decimals of the xml, i.e. 146500000000 -> "14.6500000".
+    """
+    if nano % 100 != 0: return "%.9f" % (nano / 1e9)
+    units = nano // 100
+    sign = "-" if units < 0 else ""
+    units = abs(units)
+    return "%s%d.%07d" % (sign, units // 10000000, units % 10000000)
+
+
+def formatTime(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(seconds))
+
+
+class Block(object):
+    """
+        The string table and the scales of a PrimitiveBlock.
+    """
+
+    def __init__(self, data, buf):
+        self.strings = []
+        self.groups = []
+        self.granularity = 100
+        self.latOffset = 0
+        self.lonOffset = 0
+        self.dateGranularity = 1000
+        for field, value in iterFields(buf, 0, len(buf)):
+            if field == 1:
+                for f, span in iterFields(buf, value[0], value[1]):
+                    if f == 1: self.strings.append(decodeString(data[span[0]:span[1]]))
+            elif field == 2: self.groups.append(value)
+            elif field == 17: self.granularity = value
+            elif field == 18: self.dateGranularity = value
+            elif field == 19: self.latOffset = int64(value)
+            elif field == 20: self.lonOffset = int64(value)
+
+    def info(self, attrib, version=None, timestamp=None, changeset=None, uid=None, userSid=None):
+        if version is not None and version >= 0: attrib["version"] = str(version)
+        if timestamp is not None: attrib["timestamp"] = formatTime(timestamp * self.dateGranularity // 1000)
+        if changeset is not None: attrib["changeset"] = str(changeset)
+        #an anonymous edit has an empty user, the xml has neither the uid nor the user
+        user = self.strings[userSid] if userSid is not None else ""
+        if uid is not None and len(user) > 0:
+            attrib["uid"] = str(uid)
+            attrib["user"] = user
+
+
+def decodeString(s):
+    #same as the xml backends, ascii strings are str and the others unicode
+    if nonascii(s): return _fixtext(s.decode("utf-8"))
+    return s
+
+
+def decodeBlock(args):
+    """
+        Returns the Records of the elements of a PrimitiveBlock blob, in file order.
+    """
+    blob, tags = args
+    data = decodeBlob(blob)
+    buf = bytearray(data)
+    block = Block(data, buf)
+    records = []
+    for start, end in block.groups:
+        for field, value in iterFields(buf, start, end):
+            if field == 2:
+                if tags is None or "node" in tags: decodeDenseNodes(block, buf, value, records)
+            elif field == 1:
+                if tags is None or "node" in tags: records.append(decodeNode(block, buf, value))
+            elif field == 3:
+                if tags is None or "way" in tags: records.append(decodeWay(block, buf, value))
+            elif field == 4:
+                if tags is None or "relation" in tags: records.append(decodeRelation(block, buf, value))
+    return records
+
+
+def tagRecords(block, keys, vals):
+    strings = block.strings
+    return [Record("tag", {"k": strings[k], "v": strings[v]}) for k, v in zip(keys, vals)]
+
+
+def decodeInfo(block, buf, span, attrib):
+    fields = dict(iterFields(buf, span[0], span[1]))
+    block.info(attrib, fields.get(1), int64(fields[2]) if 2 in fields else None,
+               int64(fields[3]) if 3 in fields else None, fields.get(4), fields.get(5))
+
+
+def decodeDenseNodes(block, buf, span, records):
+    ids = lats = lons = keysVals = ()
+    info = {}
+    for field, value in iterFields(buf, span[0], span[1]):
+        if field == 1: ids = unpackedDelta(buf, value)
+        elif field == 5:
+            for f, v in iterFields(buf, value[0], value[1]):
+                if f == 1: info["version"] = unpacked(buf, v)
+                elif f in [2, 3, 4, 5]: info[f] = unpackedDelta(buf, v)
+        elif field == 8: lats = unpackedDelta(buf, value)
+        elif field == 9: lons = unpackedDelta(buf, value)
+        elif field == 10: keysVals = unpacked(buf, value)
+
+    versions = info.get("version")
+    timestamps, changesets, uids, userSids = info.get(2), info.get(3), info.get(4), info.get(5)
+    strings = block.strings
+    granularity, latOffset, lonOffset = block.granularity, block.latOffset, block.lonOffset
+    kv = 0
+    for i in xrange(len(ids)):
+        attrib = {"id": str(ids[i]),
+                  "lat": formatCoord(latOffset + granularity * lats[i]),
+                  "lon": formatCoord(lonOffset + granularity * lons[i])}
+        if versions is not None:
+            block.info(attrib, versions[i], timestamps[i] if timestamps else None,
+                       changesets[i] if changesets else None, uids[i] if uids else None,
+                       userSids[i] if userSids else None)
+
+        #keys_vals is k, v, k, v, ..., 0 for each node
+        children = []
+        while kv < len(keysVals):
+            k = keysVals[kv]
+            if k == 0:
+                kv += 1
+                break
+            children.append(Record("tag", {"k": strings[k], "v": strings[keysVals[kv + 1]]}))
+            kv += 2
+        records.append(Record("node", attrib, children))
+
+
+def decodeNode(block, buf, span):
+    attrib = {}
+    keys = vals = ()
+    lat = lon = 0
+    for field, value in iterFields(buf, span[0], span[1]):
+        if field == 1: attrib["id"] = str(zigzag(value))
+        elif field == 2: keys = unpacked(buf, value)
+        elif field == 3: vals = unpacked(buf, value)
+        elif field == 4: decodeInfo(block, buf, value, attrib)
+        elif field == 8: lat = zigzag(value)
+        elif field == 9: lon = zigzag(value)
+    attrib["lat"] = formatCoord(block.latOffset + block.granularity * lat)
+    attrib["lon"] = formatCoord(block.lonOffset + block.granularity * lon)
+    return Record("node", attrib, tagRecords(block, keys, vals))
+
+
+def decodeWay(block, buf, span):
+    attrib = {}
+    keys = vals = refs = ()
+    for field, value in iterFields(buf, span[0], span[1]):
+        if field == 1: attrib["id"] = str(int64(value))
+        elif field == 2: keys = unpacked(buf, value)
+        elif field == 3: vals = unpacked(buf, value)
+        elif field == 4: decodeInfo(block, buf, value, attrib)
+        elif field == 8: refs = unpackedDelta(buf, value)
+    children = [Record("nd", {"ref": str(ref)}) for ref in refs]
+    children.extend(tagRecords(block, keys, vals))
+    return Record("way", attrib, children)
+
+
+def decodeRelation(block, buf, span):
+    attrib = {}
+    keys = vals = roles = memberIds = types = ()
+    for field, value in iterFields(buf, span[0], span[1]):
+        if field == 1: attrib["id"] = str(int64(value))
+        elif field == 2: keys = unpacked(buf, value)
+        elif field == 3: vals = unpacked(buf, value)
+        elif field == 4: decodeInfo(block, buf, value, attrib)
+        elif field == 8: roles = unpacked(buf, value)
+        elif field == 9: memberIds = unpackedDelta(buf, value)
+        elif field == 10: types = unpacked(buf, value)
+    strings = block.strings
+    children = [Record("member", {"type": MEMBER_TYPES[t], "ref": str(ref), "role": strings[role]})
+                for t, ref, role in zip(types, memberIds, roles)]
+    children.extend(tagRecords(block, keys, vals))
+    return Record("relation", attrib, children)
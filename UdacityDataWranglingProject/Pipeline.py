@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to run the whole audit and export in a single pass over the
+OSM xml, instead of parsing the same file three times (MapStructureAudit, MapContentAudit
+and PrepForDB).
+
+Each top level element read by OSMReader is handed to a list of stages.  A stage is any
+object with the methods below:
+    process(element) - called for each top level element, i.e. <node>, <way>, <relation>
+    finish(root)     - called once at the end, writes the artifact of the stage
+
+Available stages and the artifacts they write:
+    structure - MapStructureAudit.StructureAudit, prints the invalid attributes,
+                unknown node references, element counts and unique users
+    tagkv     - MapStructureAudit.TagKVCollector, writes tagKV.stats
+    content   - ContentAuditStage, writes mapcontentAudit.csv from the collected k and v
+    json      - ShapeStage, writes <file>.json (or <file>_qc.json) for mongoimport
+
+Usage:
+    python Pipeline.py qc.osm
+    python Pipeline.py qc.osm --stages structure,json --onlyQC --backend expat
+"""
+
+import argparse
+import time
+
+from OSMReader import OSMReader, peakMemoryMB, BACKENDS
+from Metrics import Metrics, NULL_METRICS, clock
+from Sinks import openSink, FORMATS
+from TagStats import TagStatsReader
+import MapStructureAudit
+import MapContentAudit
+import PrepForDB
+
+STAGES = ["structure", "tagkv", "content", "json"]
+
+
+class ContentAuditStage(object):
+    """
+        Writes mapcontentAudit.csv using the k and v collected by a TagKVCollector,
+        the collector has to be processed (and finished) before this stage.
+    """
+
+    def __init__(self, collector, filename="mapcontentAudit.csv"):
+        self.collector = collector
+        self.filename = filename
+
+    def process(self, element):
+        pass
+
+    def finish(self, root):
+        print "\nWriting %s" % self.filename
+        MapContentAudit.writeAudit(TagStatsReader(self.collector.filename), self.filename)
+
+
+class ShapeStage(object):
+    """
+        Shapes <node> and <way> elements with PrepForDB.shape_element and writes the
+        documents to sink, by default the file of format (see Sinks.openSink).
+    """
+
+    def __init__(self, file_in, pretty=None, onlyQC=False, sink=None, format="json"):
+        self.onlyQC = onlyQC
+        self.corrections = PrepForDB.loadCorrections()
+        self.corrected_values = {}
+        self.sink = sink if sink is not None else openSink(PrepForDB.outputFileName(file_in, onlyQC), format, pretty)
+
+    def process(self, element):
+        if element.tag not in ["node", "way"]: return
+        el = PrepForDB.shape_element(element, self.corrections, self.corrected_values, self.onlyQC)
+        if el: self.sink.write(el)
+
+    def finish(self, root):
+        self.sink.close()
+        if hasattr(self.sink, "file_out"): print "\nWrote %s" % self.sink.file_out
+
+
+def createStages(file_in, names=STAGES, pretty=None, onlyQC=False, format="json"):
+    stages = []
+    collector = None
+    for name in names:
+        if name == "structure":
+            stages.append(MapStructureAudit.StructureAudit())
+        elif name in ["tagkv", "content"]:
+            if collector is None:
+                collector = MapStructureAudit.TagKVCollector()
+                stages.append(collector)
+            if name == "content": stages.append(ContentAuditStage(collector))
+        elif name == "json":
+            stages.append(ShapeStage(file_in, pretty, onlyQC, format=format))
+        else:
+            raise ValueError("Unknown stage: {0}".format(name))
+    return stages
+
+
+def runPipeline(file_in, stages, backend="etree", metrics=NULL_METRICS):
+    """
+        With metrics, the time of each stage is reported under the class name of the stage.
+    """
+    start = time.time()
+    timed = metrics.enabled
+    names = [stage.__class__.__name__ for stage in stages]
+    reader = OSMReader(metrics.watch(file_in), backend=backend)
+    if timed: t = clock()
+    for element in reader:
+        if timed:
+            t = metrics.add("parse", t)
+            metrics.count(element.tag)
+            for name, stage in zip(names, stages):
+                stage.process(element)
+                t = metrics.add(name, t)
+            metrics.tick()
+        else:
+            for stage in stages: stage.process(element)
+
+    for stage in stages: stage.finish(reader.root)
+    metrics.close()
+
+    print "\nelapsed time (s): %.1f" % (time.time() - start)
+    print "peak memory (MB): %.1f" % peakMemoryMB()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single pass audit and json export of an OSM xml file")
+    parser.add_argument("file_in", nargs="?", default="qc.osm")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help="comma separated stages to run, from: " + ", ".join(STAGES))
+    parser.add_argument("--pretty", action="store_true")
+    parser.add_argument("--onlyQC", action="store_true")
+    parser.add_argument("--format", default="json", choices=FORMATS)
+    parser.add_argument("--backend", default="etree", choices=BACKENDS)
+    parser.add_argument("--metrics", help="json lines file for the progress metrics, - for stderr")
+    parser.add_argument("--metricsInterval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    metrics = Metrics(args.metrics, args.metricsInterval) if args.metrics else NULL_METRICS
+    runPipeline(args.file_in, createStages(args.file_in, args.stages.split(","), args.pretty, args.onlyQC, args.format),
+                args.backend, metrics)
@@ -16,6 +16,11 @@ Below are the corrections done:
 5.  There are 2 additional correction done to street attribute: 
         - converting abbreviated street type format.  i.e. St. to Street
         - appying proper case format when all are in lower case.  i.e. old sauyo road to Old Sauyo Road
+    The corrected street names are cached, the cache is emptied once there are
+    STREET_NAME_CACHE_SIZE of them.
+
+The tag keys and the repeated values (user, uid, tag values, ...) of the records are
+interned (see OSMReader.Interner), so the records buffered for a batch share them.
 
 
 The json/dictionary output for each node and way record will look like this:
@@ -52,18 +57,51 @@ The json/dictionary output for each node and way record will look like this:
 should be turned into
 "node_refs": ["305896090", "1719825889"]
 
+With process_map(file_in, geometry="coords"), the positions of the nodes are kept in a
+memory-mapped NodeStore while streaming, and the way also gets the node coordinates:
+"coords": [[41.9757030, -87.6921867], [41.9757540, -87.6921310]]
+or with geometry="geojson", a GeoJSON LineString (Polygon for a closed way):
+"geometry": {"type": "LineString", "coordinates": [[-87.6921867, 41.9757030], ...]}
+
+To extract only a region and/or some tags, process_map(file_in, elementFilter=...) skips
+the elements rejected by a RegionFilter.ElementFilter before they are shaped:
+process_map("philippines.osm", elementFilter=ElementFilter(Region([(14.58, 120.98, 14.78, 121.13)])))
+
+
+To rerun with new corrections without parsing the xml again, process_map(file_in,
+intermediate=True) keeps the parsed elements in <file_in>.records, see Intermediate.py.
+
+
+To overlap the reading, shaping and writing, process_map(file_in, pipeline="process",
+processes=2) runs them in a reader thread, a pool and a writer thread, see ShapePipeline.
+
 
-The parsed records are saved to MongoDB using the generated json file via mongoimport command.
+The parsed records are saved to MongoDB using the generated json file via mongoimport command,
+or inserted straight into a collection with process_map(file_in, sink=Sinks.MongoSink(...)).
 
 """
 
 
-import xml.etree.ElementTree as ET
 import pprint
 import re
-import codecs
-import json
 import csv
+import hashlib
+import multiprocessing
+import multiprocessing.dummy
+import os
+import pickle
+import Queue
+import shutil
+import threading
+
+from OSMReader import OSMReader, peakMemoryMB, isPBF, toRecord, Interner
+from CompressedInput import compression, stripCompression
+from OSMShards import shardOffsets, ShardFile
+from Sinks import openSink, sinkFileName, serializer
+from Metrics import NULL_METRICS, clock
+from NodeStore import NodeStore, addNode, addGeometry
+from Checkpoint import Checkpoint, CHECKPOINT_BYTES
+from Intermediate import Intermediate
 
 
 streetSuffix = ["Street", "Avenue", "Lane", "Highway", "Boulevard", "Extension", "Drive", "Road"]
@@ -92,31 +130,37 @@ lower_colon = re.compile(r'^([a-z]|_)*:([a-z]|_)*$')
 problemchars = re.compile(r'[=\+/&<>;\'"\?%#$@\,\. \t\r\n]')
 
 CREATED = [ "version", "changeset", "timestamp", "user", "uid"]
+INTERNED_CREATED = ["version", "changeset", "user", "uid"]
+STREET_NAME_CACHE_SIZE = 10000
 DEBUG = False
 
-def shape_element(element, corrections, corrected_values, onlyQC = False):
+interned = Interner()
+
+def shape_element(element, corrections, corrected_values, onlyQC = False, metrics = NULL_METRICS):
+    timed = metrics.enabled
     node = {}
     createdAttr = {}
     pos = []
     node_refs = []
     address = {}
     if element.tag == "node" or element.tag == "way" :
-        #process the node/way attributes
-        for name, val in element.attrib.iteritems():
-            if name in CREATED: createdAttr[name] = val
+        #process the node/way attributes, items() and get() work without building the
+        #attrib dict of a CompactRecord
+        for name, val in element.items():
+            if name in CREATED: createdAttr[name] = interned(val) if name in INTERNED_CREATED else val
             elif name in ["lat", "lon"]:
                 if len(pos) == 0:
                     try:
-                        pos.append(float(element.attrib["lat"]))
-                        pos.append(float(element.attrib["lon"]))
+                        pos.append(float(element.get("lat")))
+                        pos.append(float(element.get("lon")))
                     except: continue
             else: node[name] = val
         
         #process the child elements, expecting only tag and nd
         for elem in element.iter():
             if elem.tag == "tag":
-                k = elem.attrib["k"].strip()
-                v = elem.attrib["v"].strip()
+                k = interned(elem.get("k").strip())
+                v = elem.get("v").strip()
                 
                 #do not include k with problem characters
                 if problemchars.search(k): continue
@@ -131,20 +175,24 @@ def shape_element(element, corrections, corrected_values, onlyQC = False):
                 
                 
                 kId = k_arr[1] if len(k_arr) == 2 else k_arr[0]
+                isAddress = len(k_arr) == 2 and k_arr[0] in ["addr",""]
 
-                correction = corrections.get(kId, None)
-                corrected_v = v
-                if correction != None:
-                    corrected_v = correction.get(v, corrected_v)
+                if timed: t = clock()
+                if isAddress and kId == "street":
+                    corrected_v = corrections.streets.get(v, None)
+                    if corrected_v is None: corrected_v = getCorrectedStreetName(v)
+                else:
+                    corrected_v = corrections.values.get((kId, v), v)
+                corrected_v = interned(corrected_v)
+                if timed: metrics.add("correction", t)
                         
-                if len(k_arr) == 2 and k_arr[0] in ["addr",""]: 
-                    if kId == "street": corrected_v = getCorrectedStreetName(corrected_v)
-                    address[k_arr[1]] = corrected_v
+                if isAddress: 
+                    address[interned(kId)] = corrected_v
                 else: node[k] = corrected_v
                 
                 if (DEBUG == True and corrected_v != v): corrected_values[v] = corrected_v
                 
-            elif elem.tag == "nd": node_refs.append(elem.attrib["ref"])
+            elif elem.tag == "nd": node_refs.append(elem.get("ref"))
         
         if len(address) > 0: 
             #only process Quezon City?            
@@ -171,18 +219,458 @@ def shape_element(element, corrections, corrected_values, onlyQC = False):
     in the json file.  I've modified this code to not return a list of elements and
     to remove maintaining a list of said elements because this is causing large memory
     usage that takes a long time for the python code to exit normally.
+    
+    The shaped elements are written to sink (see Sinks.py), by default the file sink of
+    format: "json", "json.gz", "json.zst" or "bson".
+    
+    With processes > 1, the file is split into byte ranges that are shaped in parallel
+    by worker processes, see shapeShards().  The output is the same as with one process,
+    this is only available for the file output and an uncompressed xml file_in.
+
+    file_in can be a .osm.bz2 or .osm.gz, it is decompressed while reading (see
+    CompressedInput.py), and qc.osm.bz2 is written to qc.osm.json.  It can also be a
+    .osm.pbf (see PBFReader.py).
+    
+    With metrics (see Metrics.py), the progress and the time spent to parse, shape
+    (correction included), serialize and write are reported while running.
+    
+    With geometry ("coords" or "geojson"), the ways get the coordinates of their nodes,
+    see NodeStore.py.  The node positions are kept in nodeStoreFile.ids/.coords, or
+    temporary files if None.  This needs the nodes before the ways, so processes = 1
+    (or a pipeline).
+    
+    With pipeline ("thread" or "process"), reading, shaping and writing overlap, see
+    ShapePipeline.  processes is then the no. of threads or processes shaping batches of
+    batchSize elements, with at most queueSize batches in progress.
+    
+    With checkpointBytes, a checkpoint is saved to <output file>.checkpoint every
+    checkpointBytes of input, and resume = True continues a run that was interrupted from
+    its last checkpoint, see Checkpoint.py.  This is only available for the "json" and
+    "bson" file output, without processes, pipeline, geometry or elementFilter.
+    
+    With intermediate = True, the elements parsed from file_in are kept in
+    <file_in>.records before they are corrected, and the next runs read them from there
+    instead of parsing file_in, until file_in changes, see Intermediate.py.  This is not
+    available with checkpointBytes, or processes > 1 without a pipeline.
 """
-def process_map(file_in, pretty = None, onlyQC = False):
+def process_map(file_in, pretty = None, onlyQC = False, processes = 1, sink = None, backend = "etree",
+                metrics = NULL_METRICS, geometry = None, nodeStoreFile = None, elementFilter = None,
+                format = "json", pipeline = None, batchSize = 1000, queueSize = 8, checkpointBytes = None,
+                resume = False, intermediate = False):
     # You do not need to change this file
+    file_out = outputFileName(file_in, onlyQC)
+    corrections = loadCorrections()
+                
+    corrected_values = {}
+    if pipeline not in [None, "thread", "process"]: raise ValueError("Unknown pipeline: {0}".format(pipeline))
+    
+    if resume and checkpointBytes is None: checkpointBytes = CHECKPOINT_BYTES
+    checkpoint = None
+    saved = None
+    if checkpointBytes is not None:
+        if sink is not None or format not in ["json", "bson"]: raise ValueError("checkpoints need a json or bson file output")
+        if processes > 1 or pipeline is not None or geometry is not None or elementFilter is not None:
+            raise ValueError("checkpoints need processes = 1, without pipeline, geometry or elementFilter")
+        checkpoint = Checkpoint(file_in, sinkFileName(file_out, format) + ".checkpoint", checkpointBytes)
+        if resume: saved = checkpoint.load()
+    
+    if intermediate:
+        if checkpointBytes is not None: raise ValueError("intermediate is not available with checkpoints")
+        if processes > 1 and pipeline is None: raise ValueError("intermediate needs processes = 1 or a pipeline")
+        records = Intermediate(file_in, ["node", "way"])
+    
+    if processes > 1 and pipeline is None:
+        if sink is not None: raise ValueError("processes > 1 only writes to a file")
+        if geometry is not None: raise ValueError("geometry needs processes = 1")
+        if elementFilter is not None: raise ValueError("elementFilter needs processes = 1")
+        if compression(file_in) is not None or isPBF(file_in): raise ValueError("processes > 1 needs an uncompressed xml file")
+        shapeShards(file_in, file_out, corrections, corrected_values, pretty, onlyQC, processes, backend, format)
+    else:
+        #the file sinks opened here can take documents serialized by the pipeline workers
+        serialized = sink is None and geometry is None
+        if sink is None: sink = openSink(file_out, format, pretty, position = saved["position"] if saved else None)
+        sink.metrics = metrics
+        timed = metrics.enabled
+        store = NodeStore(nodeStoreFile) if geometry is not None else None
+        unresolved = 0
+        skipped = 0
+        if checkpoint is not None:
+            if saved is not None:
+                print "\nResuming from byte %d of %s" % (saved["offset"], file_in)
+                corrected_values.update(saved["state"])
+            elements = checkpoint.iterElements(lambda: (sink.tell(), corrected_values),
+                                               saved["offset"] if saved else 0, ["node", "way"], backend, metrics)
+        elif not intermediate:
+            elements = OSMReader(metrics.watch(file_in), ["node", "way"], backend)
+        elif records.valid():
+            print "\nReading the elements from", records.path
+            elements = records.read(metrics)
+        else:
+            elements = records.write(OSMReader(metrics.watch(file_in), ["node", "way"], backend))
+        try:
+            if pipeline is not None:
+                shaper = ShapePipeline(sink, corrections, onlyQC, pipeline, processes, batchSize, queueSize,
+                                       metrics, store, geometry, elementFilter,
+                                       (format, pretty) if serialized else None)
+                shaper.run(elements)
+                corrected_values.update(shaper.corrected_values)
+                skipped, unresolved = shaper.skipped, shaper.unresolved
+            else:
+                if timed: t = clock()
+                for element in elements:
+                    if timed:
+                        t = metrics.add("parse", t)
+                        metrics.count(element.tag)
+                    if elementFilter is not None and not elementFilter.accept(element):
+                        #the nodes outside the region are still needed for the geometry of the ways
+                        if store is not None and element.tag == "node": addNode(store, element)
+                        skipped += 1
+                        if timed: t = metrics.add("filter", t)
+                        continue
+                    if timed and elementFilter is not None: t = metrics.add("filter", t)
+                    el = shape_element(element, corrections, corrected_values, onlyQC, metrics)
+                    if timed: t = metrics.add("shape", t)
+                    if store is not None:
+                        if element.tag == "node": addNode(store, element)
+                        elif el and addGeometry(el, store, geometry) == False: unresolved += 1
+                        if timed: t = metrics.add("geometry", t)
+                    if el: sink.write(el)
+                    if timed:
+                        metrics.tick()
+                        t = clock()
+        finally:
+            sink.close()
+            metrics.close()
+            if store is not None: store.close()
+        if checkpoint is not None: checkpoint.remove()
+        if skipped > 0: print "\n%d elements filtered out" % skipped
+        if unresolved > 0: print "\n%d ways without geometry, some of their nodes are missing" % unresolved
+    
+     
+    if DEBUG == True:
+        print "\n****** CORRECTED TAG V **************" 
+        pprint.pprint(corrected_values)
+    
+    print "\npeak memory (MB): %.1f" % peakMemoryMB()
+    
+
+"""
+    The input is split into processes * SHARDS_PER_PROCESS byte ranges aligned on <node>,
+    <way> and <relation> start tags.  Each worker process gets the corrections map once,
+    when it is started, and writes the json of a range to a <file_out>.partNNNN file.
+    The parts are appended to file_out in file order, as soon as all the ranges before
+    them are done, so the output is in the same order as the input.  The gzip members,
+    zstd frames and BSON documents of the other formats can be appended the same way.
+"""
+SHARDS_PER_PROCESS = 4
+_worker = {}
+
+def _initShardWorker(corrections, pretty, onlyQC, backend, format):
+    _worker["corrections"] = corrections
+    _worker["backend"] = backend
+    _worker["pretty"] = pretty
+    _worker["onlyQC"] = onlyQC
+    _worker["format"] = format
+
+
+def _shapeShard(args):
+    file_in, start, end, part = args
+    corrected_values = {}
+    sink = openSink(part, _worker["format"], _worker["pretty"])
+    try:
+        with ShardFile(file_in, start, end) as shard:
+            for element in OSMReader(shard, ["node", "way"], _worker["backend"]):
+                el = shape_element(element, _worker["corrections"], corrected_values, _worker["onlyQC"])
+                if el: sink.write(el)
+    finally:
+        sink.close()
+    return sink.file_out, corrected_values
+
+
+def shapeShards(file_in, file_out, corrections, corrected_values, pretty = None, onlyQC = False, processes = 2, backend = "etree",
+                format = "json"):
+    shards = shardOffsets(file_in, processes * SHARDS_PER_PROCESS)
+    tasks = [(file_in, start, end, "{0}.part{1:04d}".format(file_out, i))
+             for i, (start, end) in enumerate(shards)]
+    
+    pool = multiprocessing.Pool(processes, _initShardWorker, (corrections, pretty, onlyQC, backend, format))
+    try:
+        with open(sinkFileName(file_out, format), "wb") as fo:
+            for part, values in pool.imap(_shapeShard, tasks):
+                with open(part, "rb") as fi: shutil.copyfileobj(fi, fo)
+                os.remove(part)
+                corrected_values.update(values)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+"""
+    ShapePipeline overlaps the reading, shaping and writing of process_map:
+        reader thread - parses the input, filters the elements and puts batches of
+                        batchSize elements on the pool
+        pool          - threads or processes shaping the batches, and serializing the
+                        documents when the sink is a file sink opened by process_map
+        writer thread - takes the shaped batches in file order, adds the geometry and
+                        writes them to the sink
+    The batches in progress are on a queue of queueSize, the reader waits when it is full,
+    so the memory stays bounded when the shaping or the writing is the slowest stage.
+    
+    An error in any stage stops the others, and is raised by run().  The processes get
+    the corrections once, when they are started, like the shard workers.
+"""
+def _initPipelineWorker(corrections, onlyQC, serialization):
+    _worker["corrections"] = corrections
+    _worker["onlyQC"] = onlyQC
+    _worker["serialize"] = serializer(*serialization) if serialization is not None else None
+
+
+def _shapeBatch(elements):
+    """
+        Returns the documents of the elements, None for the elements that are skipped, the
+        corrected values, and the time spent.
+    """
+    start = clock()
+    corrected_values = {}
+    corrections, onlyQC, serialize = _worker["corrections"], _worker["onlyQC"], _worker["serialize"]
+    docs = []
+    for element in elements:
+        el = shape_element(element, corrections, corrected_values, onlyQC)
+        if el and serialize is not None: el = serialize(el)
+        docs.append(el if el else None)
+    return docs, corrected_values, clock() - start
+
+
+class ShapePipeline(object):
+
+    def __init__(self, sink, corrections, onlyQC = False, pool = "process", processes = 1, batchSize = 1000,
+                 queueSize = 8, metrics = NULL_METRICS, store = None, geometry = None, elementFilter = None,
+                 serialization = None):
+        """
+            pool - "thread" or "process", the pool shaping the batches
+            processes - no. of threads or processes of the pool
+            serialization - (format, pretty) of the sink, to serialize in the pool and
+                            write the bytes with sink.buffer(), None to write the documents
+        """
+        self.sink = sink
+        self.corrections = corrections
+        self.onlyQC = onlyQC
+        self.pool = pool
+        self.processes = processes
+        self.batchSize = batchSize
+        self.queueSize = queueSize
+        self.metrics = metrics
+        self.store = store
+        self.geometry = geometry
+        self.elementFilter = elementFilter
+        self.serialization = serialization
+        self.corrected_values = {}
+        self.skipped = 0
+        self.unresolved = 0
+
+    def run(self, elements):
+        Pool = multiprocessing.Pool if self.pool == "process" else multiprocessing.dummy.Pool
+        pool = Pool(self.processes, _initPipelineWorker, (self.corrections, self.onlyQC, self.serialization))
+        queue = Queue.Queue(self.queueSize)
+        self.stop = threading.Event()
+        self.errors = []
+        threads = [threading.Thread(target=self._read, args=(elements, pool, queue)),
+                   threading.Thread(target=self._write, args=(queue,))]
+        try:
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            #join with a timeout, so Ctrl-C is not blocked
+            for thread in threads:
+                while thread.is_alive(): thread.join(0.1)
+        except:
+            self.stop.set()
+            pool.terminate()
+            raise
+        if len(self.errors) > 0:
+            pool.terminate()
+            pool.join()
+            raise self.errors[0]
+        pool.close()
+        pool.join()
+
+    def _put(self, queue, item):
+        #waits for a free slot, unless another stage failed
+        while not self.stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _read(self, elements, pool, queue):
+        metrics, timed = self.metrics, self.metrics.enabled
+        elementFilter = self.elementFilter
+        keepNodes = self.store is not None
+        try:
+            batch = []
+            #(no. of elements of the batch before it, node) for the node positions
+            nodes = []
+            if timed: t = clock()
+            for element in elements:
+                if self.stop.is_set(): return
+                if timed:
+                    t = metrics.add("parse", t)
+                    metrics.count(element.tag)
+                element = toRecord(element)
+                #the nodes outside the region are still needed for the geometry of the ways
+                if keepNodes and element.tag == "node": nodes.append((len(batch), element))
+                if elementFilter is not None and not elementFilter.accept(element): self.skipped += 1
+                else: batch.append(element)
+                if len(batch) >= self.batchSize:
+                    if not self._submit(pool, queue, batch, nodes): return
+                    batch, nodes = [], []
+                if timed: t = clock()
+            if len(batch) > 0 or len(nodes) > 0:
+                if not self._submit(pool, queue, batch, nodes): return
+        except Exception as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            self._put(queue, None)
+
+    def _submit(self, pool, queue, batch, nodes):
+        metrics, timed = self.metrics, self.metrics.enabled
+        result = pool.apply_async(_shapeBatch, (batch,))
+        if timed: t = clock()
+        done = self._put(queue, (result, nodes))
+        if timed: metrics.add("backpressure", t)
+        return done
+
+    def _write(self, queue):
+        metrics, timed = self.metrics, self.metrics.enabled
+        sink, store = self.sink, self.store
+        try:
+            while True:
+                try:
+                    item = queue.get(timeout=0.1)
+                except Queue.Empty:
+                    if self.stop.is_set(): return
+                    continue
+                if item is None: break
+                result, nodes = item
+                if timed: t = clock()
+                docs, corrected_values, seconds = result.get()
+                if timed:
+                    t = metrics.add("wait", t)
+                    #the time spent in the pool, summed over the threads or processes
+                    metrics.timers["shape"] = metrics.timers.get("shape", 0.0) + seconds
+                self.corrected_values.update(corrected_values)
+                
+                if self.serialization is not None:
+                    sink.buffer("".join(doc for doc in docs if doc is not None))
+                    if timed: t = metrics.add("write", t)
+                else:
+                    n = 0
+                    for i, doc in enumerate(docs):
+                        #the nodes read before the element, the same as in the sequential loop
+                        while n < len(nodes) and nodes[n][0] <= i:
+                            addNode(store, nodes[n][1])
+                            n += 1
+                        if doc is None: continue
+                        if store is not None and doc["type"] == "way":
+                            if addGeometry(doc, store, self.geometry) == False: self.unresolved += 1
+                        sink.write(doc)
+                    for position, node in nodes[n:]: addNode(store, node)
+                    if timed: t = metrics.add("write", t)
+                if timed: metrics.tick()
+        except Exception as e:
+            self.errors.append(e)
+            self.stop.set()
+
+
+def outputFileName(file_in, onlyQC = False):
+    #qc.osm.bz2 and qc.osm.pbf are written to qc.osm.json
+    file_in = stripCompression(file_in)
+    if file_in.endswith(".pbf"): file_in = file_in[:-len(".pbf")]
     if (onlyQC == True):
-        file_out = "{0}_qc.json".format(file_in)
-    else:   
-        file_out = "{0}.json".format(file_in)
+        return "{0}_qc.json".format(file_in)
+    return "{0}.json".format(file_in)
+
+
+"""
+    The corrections from mapcontentAudit_WithCorrection.csv are compiled to a flat
+    (k, v) -> corrected v lookup.  For addr:street, the corrected value also has the
+    street type and lower case corrections of correctStreetName applied.
     
+    The compiled corrections are cached in <csv file>.cache, and only compiled again if
+    the csv file is changed, that is if its modification time or size is different and
+    its sha1 hash is different.  The cache has plain dictionaries, so the same
+    corrections can be loaded (or pickled to worker processes) from any module.
+"""
+class CompiledCorrections(object):
+
+    def __init__(self, values, streets):
+        self.values = values    #(k, v) -> corrected v
+        self.streets = streets  #addr:street v -> corrected v
+
+    def __len__(self):
+        return len(self.values)
+
+
+def compileCorrections(corrections):
+    values = {}
+    streets = {}
+    for kId, correctionMap in corrections.iteritems():
+        for v, correction in correctionMap.iteritems():
+            values[(kId, v)] = correction
+            if kId == "street": streets[v] = correctStreetName(correction)
+    return CompiledCorrections(values, streets)
+
+
+def loadCorrections(filename = "mapcontentAudit_WithCorrection.csv", cacheFile = None):
+    if cacheFile is None: cacheFile = filename + ".cache"
+    stat = os.stat(filename)
+    cached = readCorrectionsCache(cacheFile)
     
+    if cached is not None and cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size:
+        compiled = CompiledCorrections(cached["values"], cached["streets"])
+    else:
+        with open(filename, "rb") as infile:
+            sha1 = hashlib.sha1(infile.read()).hexdigest()
+        if cached is not None and cached["sha1"] == sha1:
+            compiled = CompiledCorrections(cached["values"], cached["streets"])
+        else:
+            compiled = compileCorrections(readCorrections(filename))
+        writeCorrectionsCache(cacheFile, {"mtime": stat.st_mtime, "size": stat.st_size, "sha1": sha1,
+                                          "values": compiled.values, "streets": compiled.streets})
     
+    print "\n****** CORRECTIONS **************"
+    print "%d corrections" % len(compiled)
+    if DEBUG == True: pprint.pprint(compiled.values)
+    return compiled
+
+
+def readCorrectionsCache(cacheFile):
+    try:
+        with open(cacheFile, "rb") as infile:
+            return pickle.load(infile)
+    except:
+        return None
+
+
+def writeCorrectionsCache(cacheFile, cached):
+    tmp = cacheFile + ".tmp"
+    try:
+        with open(tmp, "wb") as output:
+            pickle.dump(cached, output, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, cacheFile)
+    except (IOError, OSError):
+        print "Could not write the corrections cache", cacheFile
+
+
+def readCorrections(filename = "mapcontentAudit_WithCorrection.csv"):
     corrections = {}
-    with open("mapcontentAudit_WithCorrection.csv", "rb") as infile:
+    with open(filename, "rb") as infile:
         if infile: 
             csvReader = csv.DictReader(infile)
             prevK = None
@@ -202,24 +690,7 @@ def process_map(file_in, pretty = None, onlyQC = False):
                     prevK = k
             
             if prevK !=  None: corrections[prevK] = correctionMap
-                
-    print "\n****** CORRECTIONS **************"                
-    pprint.pprint(corrections)
-                
-    corrected_values = {}
-    with codecs.open(file_out, "w") as fo:
-        for _, element in ET.iterparse(file_in):
-            el = shape_element(element, corrections, corrected_values, onlyQC)
-            if el:
-                if pretty:
-                    fo.write(json.dumps(el, indent=2)+"\n")
-                else:
-                    fo.write(json.dumps(el) + "\n")
-    
-     
-    if DEBUG == True:
-        print "\n****** CORRECTED TAG V **************" 
-        pprint.pprint(corrected_values)
+    return corrections
     
 
 def toUnicode(val):
@@ -236,7 +707,22 @@ def validPostCode(postcode):
     except:
         return False
 
+_streetNames = {}
+
 def getCorrectedStreetName(v):
+    """
+        correctStreetName, cached for up to STREET_NAME_CACHE_SIZE street names, the cache
+        is emptied when it is full.  A dict get and set are atomic, so the threads of a
+        pipeline can share it.
+    """
+    corrected = _streetNames.get(v, None)
+    if corrected is None:
+        corrected = correctStreetName(v)
+        if len(_streetNames) >= STREET_NAME_CACHE_SIZE: _streetNames.clear()
+        _streetNames[v] = corrected
+    return corrected
+
+def correctStreetName(v):
     
     #Correct for abbreviated street type, if any.
     #i.e. St. to Street    
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to check that the <nd ref="..."/> and <member ref="..."/>
+references point to a <node>, <way> or <relation> of the map, whatever the order of the
+elements in the file (i.e. merged or unsorted extracts where ways come before nodes).
+
+The declared ids of each element type are kept in a SortedIdIndex, the exact, compact
+list of ids.
+
+With a nodeIndexFile, the indexes are written to files that are only appended to, so a
+checkpoint (see Checkpoint.py) only links them.
+
+While streaming, a reference is looked up in the index.  References that are not
+declared yet are kept in a SortedIdIndex of their own, without repeats and written to
+<nodeIndexFile>.<source>.<type> with a nodeIndexFile, and checked again once the whole
+file is read, so a reference to an element that comes later in the file is not
+reported.
+
+BloomReferenceCheck only keeps a BloomFilter of the declared ids, for
+auditMap(approximate=True).
+
+Usage:
+    refs = ReferenceCheck()
+    refs.declare("node", 1)
+    refs.reference("nd", "node", "2")
+    refs.declare("node", 2)
+    refs.unknown()      #{} - every reference is declared
+"""
+
+import math
+import os
+
+from IdIndex import SortedIdIndex
+
+OSM_TYPES = ["node", "way", "relation"]
+
+MASK64 = (1 << 64) - 1
+
+
+class BloomFilter(object):
+
+    def __init__(self, capacity=10000000, errorRate=0.01):
+        """
+            capacity - expected no. of ids, errorRate - false positive rate at capacity
+        """
+        bits = int(-capacity * math.log(errorRate) / (math.log(2) ** 2))
+        self.size = max(8, bits)
+        self.hashes = max(1, int(round(self.size * math.log(2) / capacity)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, id1):
+        #double hashing, the two hashes are from a 64 bit multiplicative mix of the id
+        h = (id1 * 0x9E3779B97F4A7C15) & MASK64
+        h ^= h >> 31
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in xrange(self.hashes)]
+
+    def add(self, id1):
+        bits = self.bits
+        for pos in self._positions(id1):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, id1):
+        bits = self.bits
+        for pos in self._positions(id1):
+            if not bits[pos >> 3] & (1 << (pos & 7)): return False
+        return True
+
+
+class ReferenceCheck(object):
+
+    def __init__(self, nodeIndexFile=None):
+        """
+            nodeIndexFile - file for the node ids (see SortedIdIndex), the way and relation
+                            ids go to nodeIndexFile.way and .relation.  None to keep them
+                            in memory
+        """
+        self.nodeIndexFile = nodeIndexFile
+        self.declared = {}
+        for osmType in OSM_TYPES:
+            path = None
+            if nodeIndexFile is not None:
+                path = nodeIndexFile if osmType == "node" else "{0}.{1}".format(nodeIndexFile, osmType)
+            self.declared[osmType] = SortedIdIndex(path)
+        self.deferred = {}       #(source, type) -> SortedIdIndex of ids not declared when referenced
+        self.invalid = {}        #(source, type) -> set of refs that are not numbers
+
+    def declare(self, osmType, id1):
+        self.declared[osmType].add(id1)
+
+    def reference(self, source, osmType, ref):
+        """
+            source - the referencing element, "nd" or "member"
+            osmType - type of the referenced element, ref - id as found in the xml
+        """
+        try:
+            id1 = int(ref)
+        except:
+            self.invalid.setdefault((source, osmType), set()).add(ref)
+            return
+
+        if osmType in self.declared and id1 in self.declared[osmType]: return
+
+        ids = self.deferred.get((source, osmType), None)
+        if ids is None:
+            path = None
+            if self.nodeIndexFile is not None and osmType in OSM_TYPES:
+                path = "{0}.{1}.{2}".format(self.nodeIndexFile, source, osmType)
+            ids = self.deferred[(source, osmType)] = SortedIdIndex(path)
+        ids.add(id1)
+
+    def unknown(self):
+        """
+            Returns (source, type) -> set of refs that are not declared in the whole file.
+        """
+        unknown = {}
+        for key, refs in self.invalid.iteritems():
+            unknown.setdefault(key, set()).update(refs)
+        for (source, osmType), ids in self.deferred.iteritems():
+            declared = self.declared.get(osmType, ())
+            for id1 in ids:
+                if id1 not in declared: unknown.setdefault((source, osmType), set()).add(str(id1))
+        return unknown
+
+    def close(self):
+        for osmType, index in self.declared.iteritems():
+            index.close()
+            if osmType != "node" and index.path is not None and os.path.exists(index.path): os.remove(index.path)
+        for ids in self.deferred.itervalues():
+            ids.close()
+            if ids.path is not None and os.path.exists(ids.path): os.remove(ids.path)
+
+
+class BloomReferenceCheck(object):
+    """
+        ReferenceCheck in a fixed amount of memory, for auditMap(approximate=True): the
+        declared ids are only kept in the Bloom filters, and a reference is only checked
+        against the ids declared before it.  It gives the no. of references that are not
+        declared, a false positive of a filter hides a reference that is not declared.
+    """
+
+    def __init__(self, capacity=10000000, errorRate=0.01):
+        self.filters = {}
+        self.declared = {}
+        for osmType in OSM_TYPES:
+            self.filters[osmType] = BloomFilter(capacity if osmType == "node" else max(1, capacity // 8), errorRate)
+            self.declared[osmType] = 0
+        self.missing = {}        #(source, type) -> no. of refs not declared before them
+
+    def declare(self, osmType, id1):
+        self.filters[osmType].add(id1)
+        self.declared[osmType] += 1
+
+    def reference(self, source, osmType, ref):
+        try:
+            id1 = int(ref)
+        except:
+            id1 = None
+        if id1 is not None and osmType in self.filters and id1 in self.filters[osmType]: return
+        self.missing[(source, osmType)] = self.missing.get((source, osmType), 0) + 1
+
+    def unknown(self):
+        return dict(self.missing)
+
+    def falsePositiveRate(self):
+        """
+            The highest false positive rate of the filters, with the ids declared so far.
+        """
+        rates = []
+        for osmType, bloom in self.filters.iteritems():
+            rates.append((1 - math.exp(-bloom.hashes * self.declared[osmType] / float(bloom.size))) ** bloom.hashes)
+        return max(rates)
+
+    def close(self):
+        pass
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to extract only part of a map, i.e. a city out of a country
+file, without shaping the elements that are not needed.
+
+ElementFilter is checked on each element read, before shape_element, and keeps:
+    - the nodes inside the region (bounding boxes and/or polygons)
+    - the ways with at least one node inside the region, i.e. the ways touching it
+    - the relations with at least one node or way member that is kept
+and, if tag predicates are given, only the elements matching all of them.  The nodes and
+ways are checked against the region independently of the tags, so a way touching the
+region is found even if its nodes do not match the tags.  This needs the nodes before
+the ways and the ways before the relations, like in the OSM files.
+
+Polygons are checked with a grid of tiles over their bounding box.  A tile is classified,
+once, as inside, outside or on the boundary of the polygon.  Only the nodes in the
+boundary tiles need the exact point in polygon check, using the polygon edges that cross
+the row of the tile.
+
+Tag predicates:
+    "amenity"               - has the amenity tag
+    "amenity=restaurant"    - the amenity tag is restaurant
+    "amenity!=restaurant"   - no amenity tag, or it is not restaurant
+    or any function of the {k: v} tags of the element that returns True or False
+
+Usage:
+    region = Region(bboxes=[parseBBox("14.58,120.98,14.78,121.13")],
+                    polygons=loadPolygons("quezon_city.poly"))
+    process_map("philippines.osm", elementFilter=ElementFilter(region, ["addr:street"]))
+"""
+
+import json
+import math
+
+from IdIndex import SortedIdIndex
+
+INSIDE = 1
+OUTSIDE = 0
+BOUNDARY = 2
+
+
+def parseBBox(text):
+    """
+        "minlat,minlon,maxlat,maxlon" to a tuple of floats.
+    """
+    minlat, minlon, maxlat, maxlon = [float(x) for x in text.split(",")]
+    return (minlat, minlon, maxlat, maxlon)
+
+
+def loadPolygons(filename):
+    """
+        Reads the polygons of an Osmosis .poly file or of a GeoJSON Polygon/MultiPolygon,
+        as lists of rings of (lat, lon).  The holes are rings of the same polygon.
+    """
+    with open(filename) as f:
+        text = f.read()
+
+    if filename.endswith(".poly"):
+        rings = []
+        ring = None
+        for line in text.splitlines()[1:]:
+            line = line.strip()
+            if len(line) == 0: continue
+            if line == "END":
+                if ring is None: break
+                rings.append(ring)
+                ring = None
+            elif ring is None:
+                ring = []
+            else:
+                lon, lat = [float(x) for x in line.split()[:2]]
+                ring.append((lat, lon))
+        #.poly rings are of the same area, holes start with "!"
+        return [rings]
+
+    geo = json.loads(text)
+    if geo.get("type") == "Feature": geo = geo["geometry"]
+    if geo["type"] == "Polygon": coordinates = [geo["coordinates"]]
+    elif geo["type"] == "MultiPolygon": coordinates = geo["coordinates"]
+    else: raise ValueError("Expecting a Polygon or MultiPolygon: {0}".format(geo["type"]))
+    #GeoJSON positions are [lon, lat]
+    return [[[(y, x) for x, y in positions] for positions in polygon] for polygon in coordinates]
+
+
+class PolygonShape(object):
+    """
+        A polygon, a list of rings of (lat, lon), holes included (even-odd rule).
+    """
+
+    def __init__(self, rings, tileSize=0.01):
+        self.tileSize = tileSize
+        self.edges = []
+        for ring in rings:
+            for i in range(len(ring)):
+                a, b = ring[i - 1], ring[i]
+                if a != b: self.edges.append((a, b))
+        lats = [p[0] for ring in rings for p in ring]
+        lons = [p[1] for ring in rings for p in ring]
+        self.bbox = (min(lats), min(lons), max(lats), max(lons))
+
+        #edges crossing each row of tiles
+        self.rows = {}
+        for edge in self.edges:
+            lo = min(edge[0][0], edge[1][0])
+            hi = max(edge[0][0], edge[1][0])
+            for row in range(self._row(lo), self._row(hi) + 1):
+                self.rows.setdefault(row, []).append(edge)
+        self.tiles = {}
+
+    def _row(self, lat):
+        return int(math.floor(lat / self.tileSize))
+
+    def contains(self, lat, lon):
+        bbox = self.bbox
+        if lat < bbox[0] or lat > bbox[2] or lon < bbox[1] or lon > bbox[3]: return False
+        row = self._row(lat)
+        tile = (row, int(math.floor(lon / self.tileSize)))
+        state = self.tiles.get(tile, None)
+        if state is None:
+            state = self.tiles[tile] = self._classify(tile)
+        if state == BOUNDARY: return self._pointInPolygon(lat, lon, self.rows.get(row, ()))
+        return state == INSIDE
+
+    def _classify(self, tile):
+        size = self.tileSize
+        minlat, minlon = tile[0] * size, tile[1] * size
+        maxlat, maxlon = minlat + size, minlon + size
+        edges = self.rows.get(tile[0], ())
+        for a, b in edges:
+            if _segmentIntersectsRect(a, b, minlat, minlon, maxlat, maxlon): return BOUNDARY
+        #no edge crosses the tile, so the whole tile is like its center
+        return INSIDE if self._pointInPolygon(minlat + size / 2, minlon + size / 2, edges) else OUTSIDE
+
+    def _pointInPolygon(self, lat, lon, edges):
+        #ray casting towards increasing lon, only the edges crossing the row can cross it
+        inside = False
+        for (lat1, lon1), (lat2, lon2) in edges:
+            if (lat1 > lat) != (lat2 > lat):
+                crossLon = lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1)
+                if lon < crossLon: inside = not inside
+        return inside
+
+
+def _segmentIntersectsRect(a, b, minlat, minlon, maxlat, maxlon):
+    #Liang-Barsky clipping of the segment a-b with the rectangle
+    t0, t1 = 0.0, 1.0
+    dlat, dlon = b[0] - a[0], b[1] - a[1]
+    for p, q in ((-dlat, a[0] - minlat), (dlat, maxlat - a[0]), (-dlon, a[1] - minlon), (dlon, maxlon - a[1])):
+        if p == 0:
+            if q < 0: return False
+        else:
+            t = q / p
+            if p < 0:
+                if t > t1: return False
+                t0 = max(t0, t)
+            else:
+                if t < t0: return False
+                t1 = min(t1, t)
+    return t0 <= t1
+
+
+class Region(object):
+
+    def __init__(self, bboxes=(), polygons=(), tileSize=0.01):
+        """
+            bboxes - (minlat, minlon, maxlat, maxlon) tuples
+            polygons - lists of rings of (lat, lon), see loadPolygons()
+            tileSize - size in degrees of the tiles of the polygon grid
+        """
+        self.bboxes = list(bboxes)
+        self.polygons = [PolygonShape(rings, tileSize) for rings in polygons]
+
+    def contains(self, lat, lon):
+        for minlat, minlon, maxlat, maxlon in self.bboxes:
+            if minlat <= lat <= maxlat and minlon <= lon <= maxlon: return True
+        for polygon in self.polygons:
+            if polygon.contains(lat, lon): return True
+        return False
+
+
+def tagPredicate(predicate):
+    if callable(predicate): return predicate
+    if "!=" in predicate:
+        k, v = predicate.split("!=", 1)
+        return lambda tags: tags.get(k) != v
+    if "=" in predicate:
+        k, v = predicate.split("=", 1)
+        if v == "*": return lambda tags: k in tags
+        return lambda tags: tags.get(k) == v
+    return lambda tags: predicate in tags
+
+
+class ElementFilter(object):
+
+    def __init__(self, region=None, tags=()):
+        """
+            region - a Region, None to keep any position
+            tags - tag predicates, all of them must match
+        """
+        self.region = region
+        self.predicates = [tagPredicate(p) for p in tags]
+        self.nodes = SortedIdIndex() if region is not None else None
+        self.ways = SortedIdIndex() if region is not None else None
+        self.kept = {}
+
+    def accept(self, element):
+        """
+            Returns True if the element is to be kept.  Called for every <node> and <way>
+            (and <relation>) in the file order.
+        """
+        if self.region is not None and not self._inRegion(element): return False
+        if self.predicates:
+            tags = dict((child.attrib["k"], child.attrib["v"]) for child in element if child.tag == "tag")
+            for predicate in self.predicates:
+                if not predicate(tags): return False
+        self.kept[element.tag] = self.kept.get(element.tag, 0) + 1
+        return True
+
+    def _inRegion(self, element):
+        tag = element.tag
+        if tag == "node":
+            try:
+                inside = self.region.contains(float(element.attrib["lat"]), float(element.attrib["lon"]))
+            except (KeyError, ValueError):
+                return False
+            if inside: self.nodes.add(int(element.attrib["id"]))
+            return inside
+
+        if tag == "way":
+            for child in element:
+                if child.tag == "nd" and _isIn(child.attrib["ref"], self.nodes):
+                    self.ways.add(int(element.attrib["id"]))
+                    return True
+            return False
+
+        if tag == "relation":
+            for child in element:
+                if child.tag != "member": continue
+                memberType = child.attrib.get("type")
+                if memberType == "node" and _isIn(child.attrib["ref"], self.nodes): return True
+                if memberType == "way" and _isIn(child.attrib["ref"], self.ways): return True
+            return False
+
+        return True
+
+
+def _isIn(ref, index):
+    try:
+        return int(ref) in index
+    except ValueError:
+        return False
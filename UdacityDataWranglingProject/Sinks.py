@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to write the documents shaped by PrepForDB.shape_element.
+A sink is any object with the methods below:
+    write(doc) - called for each shaped document
+    close()    - called once at the end, writes anything still buffered
+and a metrics attribute (see Metrics.py), the time to serialize and write are added to it.
+
+Available sinks:
+    JsonFileSink       - one json document per line, the input of mongoimport
+    CompressedJsonSink - the same json lines compressed with gzip, or zstd if zstandard
+                         is installed, the compression is done on a background thread
+    BsonFileSink       - a sequence of BSON documents, loaded with mongorestore, only if
+                         bson (from pymongo) is installed
+    MongoSink          - inserts the documents straight into a MongoDB collection, in
+                         batches, so there is no json file to write and read back with
+                         mongoimport
+
+The file sinks serialize with one encoder for all the documents, and gather the lines in
+a buffer of bufferSize bytes that is written at once.  openSink() returns the file sink
+of a format, FORMATS, with the extension of the format added to the file name.
+serializer() returns the serialization of the file sink of a format, so the documents
+can be serialized somewhere else (i.e. in the worker processes of a pipelined
+process_map) and written with buffer().
+
+Usage:
+    process_map("qc.osm", format="json.gz")     #writes qc.osm.json.gz
+    process_map("qc.osm", sink=MongoSink(db="osm", name="qc", batchSize=5000))
+
+    #testing without a mongod, any object with insert_many() will do, i.e. mongomock
+    process_map("qc.osm", sink=MongoSink(collection=mongomock.MongoClient().osm.qc))
+"""
+
+import json
+import os
+import Queue
+import threading
+import time
+import zlib
+
+from Metrics import NULL_METRICS, clock
+
+try:
+    import pymongo
+    from pymongo.errors import AutoReconnect, ConnectionFailure, NetworkTimeout, BulkWriteError
+    TRANSIENT_ERRORS = (AutoReconnect, ConnectionFailure, NetworkTimeout)
+except ImportError:
+    pymongo = None
+    BulkWriteError = None
+    TRANSIENT_ERRORS = ()
+
+try:
+    import bson
+    bsonEncode = getattr(bson, "encode", None) or bson.BSON.encode
+except (ImportError, AttributeError):
+    #AttributeError - the standalone bson package, it is not the one of pymongo
+    bson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DUPLICATE_KEY = 11000
+BUFFER_SIZE = 1 << 20
+
+FORMATS = ["json", "json.gz", "json.zst", "bson"]
+
+
+def sinkFileName(file_out, format="json"):
+    """
+        The file written by openSink(file_out, format), file_out is the .json file name.
+    """
+    if format == "json": return file_out
+    if format == "bson": return (file_out[:-len(".json")] if file_out.endswith(".json") else file_out) + ".bson"
+    return file_out + format[len("json"):]
+
+
+def serializer(format="json", pretty=None):
+    """
+        The function serializing a document to the bytes written by openSink(..., format).
+    """
+    if format not in FORMATS: raise ValueError("Unknown format: {0}".format(format))
+    if format == "bson":
+        if bson is None: raise ImportError("bson (pymongo) is needed to write .bson files")
+        return bsonEncode
+    encode = json.JSONEncoder(indent=2 if pretty else None).encode
+    return lambda doc: encode(doc) + "\n"
+
+
+def openSink(file_out, format="json", pretty=None, bufferSize=BUFFER_SIZE, position=None):
+    """
+        position - for "json" and "bson", the size the existing file is cut to before
+                   writing after it, None to write a new file (see Checkpoint.py)
+    """
+    if format not in FORMATS: raise ValueError("Unknown format: {0}".format(format))
+    file_out = sinkFileName(file_out, format)
+    if format == "json": return JsonFileSink(file_out, pretty, bufferSize, position)
+    if format == "bson": return BsonFileSink(file_out, bufferSize, position)
+    if position is not None: raise ValueError("A {0} file can not be continued".format(format))
+    return CompressedJsonSink(file_out, format.split(".")[1], pretty, bufferSize)
+
+
+class JsonFileSink(object):
+
+    def __init__(self, file_out, pretty=None, bufferSize=BUFFER_SIZE, position=None):
+        self.file_out = file_out
+        self.pretty = pretty
+        self.bufferSize = bufferSize
+        self.position = position
+        self.encode = json.JSONEncoder(indent=2 if pretty else None).encode
+        self.lines = []
+        self.buffered = 0
+        self.fo = self.open()
+        self.metrics = NULL_METRICS
+
+    def open(self):
+        if self.position is None: return open(self.file_out, "wb")
+        fo = open(self.file_out, "r+b")
+        fo.seek(0, os.SEEK_END)
+        if fo.tell() < self.position:
+            fo.close()
+            raise ValueError("{0} is shorter than {1} bytes".format(self.file_out, self.position))
+        fo.truncate(self.position)
+        fo.seek(self.position)
+        return fo
+
+    def write(self, doc):
+        if self.metrics.enabled:
+            t = clock()
+            line = self.serialize(doc)
+            t = self.metrics.add("serialize", t)
+            self.buffer(line)
+            self.metrics.add("write", t)
+        else:
+            self.buffer(self.serialize(doc))
+
+    def serialize(self, doc):
+        return self.encode(doc) + "\n"
+
+    def buffer(self, data):
+        self.lines.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.bufferSize: self.flush()
+
+    def flush(self):
+        if len(self.lines) == 0: return
+        self.writeChunk("".join(self.lines))
+        self.lines = []
+        self.buffered = 0
+
+    def writeChunk(self, chunk):
+        self.fo.write(chunk)
+
+    def tell(self):
+        """
+            The size of the file once everything buffered is written to the disk.
+        """
+        self.flush()
+        self.fo.flush()
+        os.fsync(self.fo.fileno())
+        return self.fo.tell()
+
+    def close(self):
+        self.flush()
+        self.fo.close()
+
+
+class CompressedJsonSink(JsonFileSink):
+    """
+        The buffered chunks are put on a small queue, a thread compresses them and writes
+        them to the file.  zlib and zstandard release the GIL while compressing, so the
+        compression runs alongside the parsing and shaping of the next elements.
+    """
+
+    def __init__(self, file_out, compression="gz", pretty=None, bufferSize=BUFFER_SIZE, level=6, queueSize=8):
+        if compression == "zst" and zstandard is None: raise ImportError("zstandard is needed to write .zst files")
+        if compression not in ["gz", "zst"]: raise ValueError("Unknown compression: {0}".format(compression))
+        self.compression = compression
+        self.level = level
+        self.queue = Queue.Queue(queueSize)
+        self.error = None
+        JsonFileSink.__init__(self, file_out, pretty, bufferSize)
+        self.thread = threading.Thread(target=self._compress)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _compressor(self):
+        if self.compression == "zst": return zstandard.ZstdCompressor(level=self.level).compressobj()
+        #wbits 16 + 15 is the gzip format
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def _compress(self):
+        compressor = None
+        while True:
+            chunk = self.queue.get()
+            if self.error is not None:
+                #keep taking the chunks so write() is not blocked, until close()
+                if chunk is None: break
+                continue
+            try:
+                if compressor is None: compressor = self._compressor()
+                if chunk is None:
+                    self.fo.write(compressor.flush())
+                    break
+                self.fo.write(compressor.compress(chunk))
+            except Exception as e:
+                self.error = e
+                if chunk is None: break
+
+    def writeChunk(self, chunk):
+        if self.error is not None: raise self.error
+        self.queue.put(chunk)
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.fo.close()
+        if self.error is not None: raise self.error
+
+
+class BsonFileSink(JsonFileSink):
+    """
+        Documents encoded as BSON one after the other, the format of mongodump, so the
+        file can be loaded with: mongorestore -d osm -c qc qc.osm.bson
+    """
+
+    def __init__(self, file_out, bufferSize=BUFFER_SIZE, position=None):
+        if bson is None: raise ImportError("bson (pymongo) is needed to write .bson files")
+        JsonFileSink.__init__(self, file_out, None, bufferSize, position)
+
+    def serialize(self, doc):
+        return bsonEncode(doc)
+
+
+"""
+    MongoClient keeps a connection pool, so there is one client per uri for the process,
+    shared by all the MongoSink.
+"""
+_clients = {}
+
+def getClient(uri):
+    if pymongo is None:
+        raise ImportError("pymongo is needed to write to MongoDB")
+    client = _clients.get(uri, None)
+    if client is None:
+        client = _clients[uri] = pymongo.MongoClient(uri)
+    return client
+
+
+class MongoSink(object):
+
+    def __init__(self, collection=None, uri="mongodb://localhost:27017", db="osm", name="qc",
+                 batchSize=1000, retries=5, retryDelay=0.5, verbose=True):
+        """
+            collection - collection to insert to, if None it is db.name of the uri
+            batchSize - no. of documents per insert_many()
+            retries - no. of retries of a batch on a transient (connection) error, waiting
+                      retryDelay seconds, doubled on each retry
+        """
+        if collection is None: collection = getClient(uri)[db][name]
+        self.collection = collection
+        self.batchSize = batchSize
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.verbose = verbose
+        self.batch = []
+        self.inserted = 0
+        self.start = time.time()
+        self.metrics = NULL_METRICS
+
+    def write(self, doc):
+        self.batch.append(doc)
+        if len(self.batch) >= self.batchSize: self.flush()
+
+    def flush(self):
+        if len(self.batch) == 0: return
+        if self.metrics.enabled: t = clock()
+        delay = self.retryDelay
+        for attempt in range(self.retries + 1):
+            try:
+                self.collection.insert_many(self.batch, ordered=False)
+                break
+            except TRANSIENT_ERRORS:
+                if attempt == self.retries: raise
+                time.sleep(delay)
+                delay *= 2
+            except Exception as e:
+                #insert_many adds the _id to the documents, so on a retry the documents that
+                #made it the first time are duplicates, they are already in the collection
+                if attempt == 0 or not self._onlyDuplicates(e): raise
+                break
+        self.inserted += len(self.batch)
+        self.batch = []
+        if self.metrics.enabled: self.metrics.add("write", t)
+
+    def _onlyDuplicates(self, e):
+        if BulkWriteError is None or not isinstance(e, BulkWriteError): return False
+        errors = e.details.get("writeErrors", [])
+        return len(errors) > 0 and all(err.get("code") == DUPLICATE_KEY for err in errors)
+
+    def close(self):
+        self.flush()
+        elapsed = time.time() - self.start
+        if self.verbose:
+            print "\ninserted %d documents in %.1f s, %.0f documents/s" % (
+                self.inserted, elapsed, self.inserted / elapsed if elapsed > 0 else 0)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to keep approximate statistics of a stream in a fixed amount
+of memory, whatever the size of the map, for auditMap(approximate=True):
+    HyperLogLog     - no. of distinct items (users, values of a key), 2 ** p registers of
+                      a byte, with a relative standard error of 1.04 / sqrt(2 ** p)
+    CountMinSketch  - count of each item, depth rows of width counters.  An estimate is
+                      never below the real count, and above it by at most
+                      e / width * total with a probability of 1 - e ** -depth
+    HeavyHitters    - the k most frequent items, with their CountMinSketch estimates
+    ReservoirSample - a uniform random sample of k items of the stream
+
+The items are hashed with Python's hash(), mixed to 64 bits with the splitmix64
+finalizer, so str and unicode items are hashed the same, and the sketches of the same
+stream are the same from one run to the next.
+
+Usage:
+    users = HyperLogLog(14)
+    users.add("1219059")
+    len(users)          #estimated no. of distinct users
+    users.error()       #relative standard error, 0.0081
+
+    tags = HeavyHitters(100)
+    tags.add("amenity")
+    tags.top()          #[("amenity", 1)]
+"""
+
+from array import array
+import heapq
+import math
+import random
+
+MASK64 = (1 << 64) - 1
+
+
+def hash64(item):
+    z = (hash(item) + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+class HyperLogLog(object):
+
+    def __init__(self, p=14):
+        """
+            p - 2 ** p registers, from 4 to 16
+        """
+        if not 4 <= p <= 16: raise ValueError("p must be from 4 to 16")
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self.rest = 64 - p
+        self.restMask = (1 << self.rest) - 1
+
+    def add(self, item):
+        h = hash64(item)
+        i = h >> self.rest
+        #position of the first 1 bit in the remaining bits
+        rank = self.rest - (h & self.restMask).bit_length() + 1
+        if rank > self.registers[i]: self.registers[i] = rank
+
+    def merge(self, other):
+        if other.p != self.p: raise ValueError("Only sketches with the same p can be merged")
+        registers = self.registers
+        for i, r in enumerate(other.registers):
+            if r > registers[i]: registers[i] = r
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+    def estimate(self):
+        m = self.m
+        if m >= 128: alpha = 0.7213 / (1 + 1.079 / m)
+        else: alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(b"\x00")
+        #small range correction, linear counting of the empty registers
+        if estimate <= 2.5 * m and zeros > 0: return m * math.log(float(m) / zeros)
+        return estimate
+
+    def error(self):
+        """
+            Relative standard error of the estimate, about 68% of the estimates are
+            within this error and 95% within twice this error.
+        """
+        return 1.04 / math.sqrt(self.m)
+
+
+class CountMinSketch(object):
+
+    def __init__(self, width=2719, depth=5):
+        """
+            width - counters per row, the error is e / width of the total count
+            depth - rows, the error bound holds with a probability of 1 - e ** -depth
+        """
+        self.width = width
+        self.depth = depth
+        self.counts = array("L", [0]) * (width * depth)
+        self.total = 0
+
+    @classmethod
+    def fromError(cls, epsilon=0.001, delta=0.01):
+        """
+            The sketch overestimating by at most epsilon * total, with a probability of
+            1 - delta.
+        """
+        return cls(int(math.ceil(math.e / epsilon)), int(math.ceil(math.log(1.0 / delta))))
+
+    def _indexes(self, item):
+        h = hash64(item)
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in xrange(self.depth)]
+
+    def add(self, item, n=1):
+        """
+            Adds n to the count of item, returns the new estimate.  The counters are only
+            raised as much as needed (conservative update), so the error is smaller.
+        """
+        counts = self.counts
+        indexes = self._indexes(item)
+        estimate = min(counts[i] for i in indexes) + n
+        for i in indexes:
+            if counts[i] < estimate: counts[i] = estimate
+        self.total += n
+        return estimate
+
+    def __getitem__(self, item):
+        counts = self.counts
+        return min(counts[i] for i in self._indexes(item))
+
+    def merge(self, other):
+        #the conservative update makes the merged counts an upper bound too
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Only sketches of the same size can be merged")
+        counts = self.counts
+        for i, c in enumerate(other.counts): counts[i] += c
+        self.total += other.total
+
+    def errorBound(self):
+        """
+            Returns (maximum overestimate, probability that it holds).
+        """
+        return math.e / self.width * self.total, 1 - math.exp(-self.depth)
+
+
+class HeavyHitters(object):
+
+    def __init__(self, k=100, width=2719, depth=5):
+        """
+            k - no. of most frequent items kept, with a CountMinSketch of width and depth
+        """
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self.minimum = 0
+
+    def add(self, item, n=1):
+        estimate = self.sketch.add(item, n)
+        candidates = self.candidates
+        if item in candidates:
+            candidates[item] = estimate
+        elif len(candidates) < self.k:
+            candidates[item] = estimate
+            if len(candidates) == self.k: self.minimum = min(candidates.itervalues())
+        elif estimate > self.minimum:
+            #the counts of the candidates only grow, so self.minimum is a lower bound of the
+            #least frequent candidate, only looked up when it may be replaced
+            self.minimum = min(candidates.itervalues())
+            if estimate > self.minimum:
+                del candidates[min(candidates, key=candidates.get)]
+                candidates[item] = estimate
+                self.minimum = min(candidates.itervalues())
+
+    def top(self, n=None):
+        """
+            Returns [(item, estimated count)], the most frequent first.
+        """
+        top = heapq.nlargest(n or self.k, self.candidates.iteritems(), key=lambda kv: (kv[1], kv[0]))
+        return [(item, self.sketch[item]) for item, count in top]
+
+    def errorBound(self):
+        return self.sketch.errorBound()
+
+
+class ReservoirSample(object):
+
+    def __init__(self, k=100, seed=0):
+        """
+            k - size of the sample, seed - of the random generator, so runs are repeatable
+        """
+        self.k = k
+        self.items = []
+        self.seen = 0
+        self.random = random.Random(seed)
+
+    def add(self, item):
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            #the item replaces one of the sample with a probability of k / seen
+            i = self.random.randint(0, self.seen - 1)
+            if i < self.k: self.items[i] = item
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The purpose of this class is to keep the k and v attributes of the <tag> elements, with the
+number of times each (k, v) pair occurs, without keeping all of them in memory.
+
+TagStatsWriter counts the (k, v) pairs in a dict while streaming.  When the dict has
+maxEntries pairs it is sorted and spilled to a temporary run file, so memory stays
+bounded whatever the number of distinct values.  Once there are MERGE_RUNS runs of the
+same level, they are merged into one run of the next level, so there are few runs to
+open at the end.  On close, the runs are merged with heapq.merge into the store:
+    <path>      - one json line [k, v, count] per pair, sorted by k then v
+    <path>.idx  - json list of [k, offset, distinct values, occurrences], sorted by k
+Stores of several files or shards are merged the same way with mergeStores().
+
+TagStatsReader reads the index only, the values of a key are read when they are asked
+for, so MapContentAudit can go through the keys one at a time.
+
+Usage:
+    writer = TagStatsWriter("tagKV.stats")
+    writer.add("addr:street", "Santolan Road")
+    writer.close()
+
+    stats = TagStatsReader("tagKV.stats")
+    for k, values in stats.iteritems():     #values is {v: count}
+        ...
+    mergeStores(["north.stats", "south.stats"], "all.stats")
+"""
+
+import heapq
+import json
+import os
+import tempfile
+import uuid
+
+MERGE_RUNS = 8
+
+class TagStatsWriter(object):
+
+    def __init__(self, path="tagKV.stats", maxEntries=1000000):
+        """
+            path - the store file, the index is written to path + ".idx"
+            maxEntries - distinct (k, v) pairs kept in memory before spilling to a run file
+        """
+        self.path = path
+        self.maxEntries = maxEntries
+        self.counts = {}
+        self.runs = []          #(level, run file)
+        self.dropped = []       #run files merged since the last checkpoint
+        self.checkpointed = False
+        #in the name of the run files, so a writer restored from a checkpoint only
+        #removes its own runs, not those of another writer of the same store
+        self.writerId = uuid.uuid4().hex[:12]
+
+    def add(self, k, v, n=1):
+        counts = self.counts
+        key = (k, v)
+        counts[key] = counts.get(key, 0) + n
+        if len(counts) >= self.maxEntries: self.spill()
+
+    def spill(self):
+        if len(self.counts) == 0: return
+        triples = ([k, v, count] for (k, v), count in sorted(self.counts.iteritems()))
+        self.runs.append((0, self._writeRun(triples)))
+        self.counts = {}
+        #the last MERGE_RUNS runs are merged while they have the same level
+        runs = self.runs
+        while len(runs) >= MERGE_RUNS and all(level == runs[-1][0] for level, run in runs[-MERGE_RUNS:]):
+            merged = runs[-MERGE_RUNS:]
+            del runs[-MERGE_RUNS:]
+            runs.append((merged[0][0] + 1, self._writeRun(mergeTriples([_readTriples(run) for level, run in merged]))))
+            for level, run in merged: self._drop(run)
+
+    def _runPrefix(self):
+        #<directory>/<store name>.<writer id>.XXXXXX.run
+        directory, name = os.path.split(os.path.abspath(self.path))
+        return directory, "{0}.{1}.".format(name, self.writerId)
+
+    def _writeRun(self, triples):
+        directory, prefix = self._runPrefix()
+        fd, run = tempfile.mkstemp(prefix=prefix, suffix=".run", dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            for triple in triples:
+                f.write(json.dumps(triple) + "\n")
+        return run
+
+    def _drop(self, run):
+        #the last checkpoint still has the runs merged after it, see __getstate__
+        if self.checkpointed: self.dropped.append(run)
+        else: os.remove(run)
+
+    def close(self):
+        if len(self.runs) == 0:
+            #everything is still in memory, no need for a run file
+            triples = ((k, v, count) for (k, v), count in sorted(self.counts.iteritems()))
+            writeStore(self.path, triples)
+        else:
+            self.spill()
+            try:
+                writeStore(self.path, mergeTriples([_readTriples(run) for level, run in self.runs]))
+            finally:
+                for level, run in self.runs: os.remove(run)
+                for run in self.dropped:
+                    if os.path.exists(run): os.remove(run)
+        self.counts = {}
+        self.runs = []
+        self.dropped = []
+
+    def __getstate__(self):
+        #pickled for a checkpoint (see Checkpoint.py), with the counts in memory (at most
+        #maxEntries) and the names of the run files, that are kept until the next one
+        for run in self.dropped:
+            if os.path.exists(run): os.remove(run)
+        self.dropped = []
+        self.checkpointed = True
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        #the runs this writer wrote after the checkpoint are not needed
+        directory, prefix = self._runPrefix()
+        runs = set(os.path.basename(run) for level, run in self.runs)
+        for filename in os.listdir(directory):
+            if filename.startswith(prefix) and filename.endswith(".run") and filename not in runs:
+                os.remove(os.path.join(directory, filename))
+
+
+class TagStatsReader(object):
+
+    def __init__(self, path="tagKV.stats"):
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            self.index = json.load(f)
+        self.offsets = dict((k, offset) for k, offset, distinct, total in self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, k):
+        return k in self.offsets
+
+    def keys(self):
+        return [entry[0] for entry in self.index]
+
+    def summary(self):
+        """
+            Returns [k, distinct values, occurrences] of each key.
+        """
+        return [[k, distinct, total] for k, offset, distinct, total in self.index]
+
+    def values(self, k):
+        """
+            Returns {v: count} of the key k, read from the store.
+        """
+        values = {}
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[k])
+            for line in f:
+                k1, v, count = json.loads(line)
+                if k1 != k: break
+                values[v] = count
+        return values
+
+    def iteritems(self):
+        """
+            Yields (k, {v: count}) for each key in order, reading the store once.
+        """
+        k = None
+        values = {}
+        for k1, v, count in self:
+            if k1 != k:
+                if k is not None: yield k, values
+                k = k1
+                values = {}
+            values[v] = count
+        if k is not None: yield k, values
+
+    def __iter__(self):
+        return _readTriples(self.path)
+
+
+def _readTriples(path):
+    with open(path, "rb") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def mergeTriples(sources):
+    """
+        Merges sorted iterables of [k, v, count], the counts of the same (k, v) are added.
+    """
+    current = None
+    for k, v, count in heapq.merge(*sources):
+        if current is not None and current[0] == k and current[1] == v:
+            current[2] += count
+            continue
+        if current is not None: yield current
+        current = [k, v, count]
+    if current is not None: yield current
+
+
+def writeStore(path, triples):
+    """
+        Writes the sorted [k, v, count] triples to the store and its index, through
+        temporary files so an interrupted run does not leave a half written store.
+    """
+    index = []
+    with open(path + ".tmp", "wb") as f:
+        for k, v, count in triples:
+            if len(index) == 0 or index[-1][0] != k:
+                index.append([k, f.tell(), 0, 0])
+            index[-1][2] += 1
+            index[-1][3] += count
+            f.write(json.dumps([k, v, count]) + "\n")
+    with open(path + ".idx.tmp", "wb") as f:
+        json.dump(index, f)
+    os.rename(path + ".tmp", path)
+    os.rename(path + ".idx.tmp", path + ".idx")
+
+
+def mergeStores(paths, path):
+    writeStore(path, mergeTriples([iter(TagStatsReader(p)) for p in paths]))
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of CompressedInput.py, run with:
+    python -m unittest test_CompressedInput
+"""
+
+import bz2
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import CompressedInput
+from CompressedInput import (openInput, streamStarts, decompressRange, ParallelBz2File,
+                             ThreadedDecompressFile)
+
+
+def osmText(rng, nodes):
+    #xml like text of random length, so the streams end at any bit of a byte
+    lines = ['<node id="{0}" lat="14.{1}" lon="121.{2}" user="{3}"/>\n'.format(
+                 i, rng.randint(0, 10 ** 7), rng.randint(0, 10 ** 7), "%x" % rng.getrandbits(rng.randint(1, 32)))
+             for i in xrange(nodes)]
+    return b"".join(lines)
+
+
+def readAll(f, size):
+    data = []
+    while True:
+        chunk = f.read(size)
+        if len(chunk) == 0: break
+        data.append(chunk)
+    return b"".join(data)
+
+
+def decompressAll(data):
+    #bz2.decompress of Python 2 stops after the first stream
+    chunks = []
+    while len(data) > 0:
+        decompressor = bz2.BZ2Decompressor()
+        chunks.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+
+class CompressedInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.rng = random.Random(1)
+        self.chunkSize = CompressedInput.CHUNK_SIZE
+
+    def tearDown(self):
+        CompressedInput.CHUNK_SIZE = self.chunkSize
+        shutil.rmtree(self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f: f.write(data)
+        return path
+
+    def multiStream(self, streams):
+        """
+            Returns the text, the bz2 file made of one stream per part of it and the
+            offsets of the streams.
+        """
+        parts = [osmText(self.rng, self.rng.randint(1, 300)) for i in xrange(streams)]
+        compressed = [bz2.compress(part, self.rng.randint(1, 9)) for part in parts]
+        offsets = [sum(len(c) for c in compressed[:i]) for i in xrange(streams)]
+        return b"".join(parts), b"".join(compressed), offsets
+
+    def testStreamStarts(self):
+        for i in xrange(20):
+            text, data, offsets = self.multiStream(10)
+            self.assertEqual(streamStarts(data), offsets[1:])
+            self.assertEqual(streamStarts(data, offsets[5] + 1), offsets[6:])
+        noise = bytes(bytearray(self.rng.getrandbits(8) for i in xrange(1 << 20)))
+        self.assertEqual(streamStarts(bz2.compress(noise)), [])
+
+    def testRanges(self):
+        text, data, offsets = self.multiStream(60)
+        path = self.write("multi.osm.bz2", data)
+        CompressedInput.CHUNK_SIZE = 4000
+        ranges = list(ParallelBz2File(path, 2).ranges())
+        self.assertTrue(len(ranges) > 1)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start, end), (nextStart, nextEnd) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, nextStart)
+            self.assertTrue(nextStart in offsets)
+        self.assertEqual(b"".join(decompressRange(path, start, end) for start, end in ranges), decompressAll(data))
+        self.assertEqual(decompressAll(data), text)
+
+    def testMultiStreamBz2(self):
+        text, data, offsets = self.multiStream(40)
+        path = self.write("multi.osm.bz2", data)
+        CompressedInput.CHUNK_SIZE = 4000
+        f = openInput(path, processes=2, tools=False)
+        self.assertTrue(isinstance(f, ParallelBz2File))
+        with f: self.assertEqual(readAll(f, 777), text)
+        self.assertEqual(f.bytesRead, len(data))
+
+    def testSingleStreamBz2(self):
+        text = osmText(self.rng, 5000)
+        path = self.write("single.osm.bz2", bz2.compress(text))
+        f = openInput(path, processes=2, tools=False)
+        self.assertTrue(isinstance(f, ThreadedDecompressFile))
+        with f: self.assertEqual(readAll(f, 1000), text)
+        with openInput(path, processes=2, tools=False) as f: self.assertEqual(f.read(), bz2.BZ2File(path).read())
+
+    def testMultiMemberGz(self):
+        path = os.path.join(self.directory, "multi.osm.gz")
+        parts = [osmText(self.rng, self.rng.randint(1, 300)) for i in xrange(10)]
+        with open(path, "wb") as out:
+            for part in parts:
+                member = gzip.GzipFile(fileobj=out, mode="wb")
+                member.write(part)
+                member.close()
+        with openInput(path) as f: self.assertEqual(readAll(f, 1000), b"".join(parts))
+        with openInput(path) as f: self.assertEqual(f.read(), gzip.open(path).read())
+
+    def testBz2Tool(self):
+        text, data, offsets = self.multiStream(5)
+        path = self.write("multi.osm.bz2", data)
+        f = openInput(path, tools=True)
+        if not isinstance(f, CompressedInput.PipeDecompressFile): return      #no lbzip2 or pbzip2
+        with f: self.assertEqual(readAll(f, 1000), text)
+
+    def testNotCompressed(self):
+        path = self.write("map.osm", b"<osm/>")
+        with openInput(path) as f: self.assertEqual(f.read(), b"<osm/>")
+
+
+if __name__ == "__main__":
+    unittest.main()
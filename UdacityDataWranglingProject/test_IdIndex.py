@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of IdIndex.py, run with:
+    python -m unittest test_IdIndex
+"""
+
+import math
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+from IdIndex import SortedIdIndex
+
+
+class SortedIdIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "ids.idx")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, index, ids):
+        ids = sorted(set(ids))
+        for id1 in ids: self.assertTrue(id1 in index, id1)
+        for id1 in [-1, ids[-1] + 1] + [id1 + 1 for id1 in ids if id1 + 1 not in ids][:100]:
+            self.assertFalse(id1 in index, id1)
+        self.assertEqual(list(index), ids)
+        self.assertEqual(len(index), len(ids))
+
+    def testSorted(self):
+        index = SortedIdIndex(self.path, bufferSize=16)
+        ids = range(0, 1000, 3)
+        for id1 in ids: index.add(id1)
+        index.add(ids[-1])
+        self.assertEqual(index.runs, [])
+        self.assertTrue(index.stored > 0 and len(index.ids) > 0)
+        self.check(index, ids)
+        index.close()
+        self.assertEqual(os.listdir(self.directory), ["ids.idx"])
+
+    def testOutOfOrder(self):
+        #sorted ids in the file and the buffer, out of order ones in the runs and pending
+        index = SortedIdIndex(self.path, bufferSize=16, pendingLimit=8)
+        ids = range(0, 2000, 2)
+        for id1 in ids: index.add(id1)
+        late = range(1, 2000, 2)
+        random.Random(1).shuffle(late)
+        for id1 in late + late[:50]: index.add(id1)
+        self.assertTrue(index.stored > 0 and len(index.ids) > 0 and len(index.pending) > 0)
+        self.assertTrue(1 < len(index.runs) <= math.log(len(late), 2) + 1)
+        self.check(index, ids + late)
+        index.close()
+        self.assertEqual(os.listdir(self.directory), ["ids.idx"])
+
+    def testShuffled(self):
+        for path in [None, self.path]:
+            ids = [random.Random(2).randint(0, 10 ** 12) for i in xrange(3000)]
+            ids += ids[:500]
+            random.Random(3).shuffle(ids)
+            index = SortedIdIndex(path, bufferSize=32, pendingLimit=16)
+            for id1 in ids: index.add(id1)
+            for run in index.runs: self.assertEqual(list(run), sorted(set(run)))
+            self.check(index, ids)
+            index.close()
+
+    def testCheckpoint(self):
+        index = SortedIdIndex(self.path, bufferSize=16, pendingLimit=8)
+        rng = random.Random(4)
+        ids = [rng.randint(0, 10 ** 6) for i in xrange(500)]
+        for id1 in ids: index.add(id1)
+        state = pickle.dumps(index)
+        #the runs merged and the ids added after the checkpoint are not in the restored one
+        for i in xrange(500): index.add(rng.randint(0, 10 ** 6))
+        restored = pickle.loads(state)
+        self.check(restored, ids)
+        restored.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of NearDuplicates.py, run with:
+    python -m unittest test_NearDuplicates
+"""
+
+import random
+import re
+import unittest
+
+from NearDuplicates import normalize, deletions, editDistance, findClusters, canonicalValues
+
+
+def levenshtein(a, b):
+    previous = range(len(b) + 1)
+    for i in xrange(1, len(a) + 1):
+        current = [i]
+        for j in xrange(1, len(b) + 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1])))
+        previous = current
+    return previous[len(b)]
+
+
+def bruteForceClusters(values, counts, maxDistance=2, charsPerEdit=5):
+    #every pair of values compared, the groups built the same way around the best value
+    limit = lambda v: min(maxDistance, len(v) // charsPerEdit)
+    near = lambda a, b: (re.findall(r"\d+", a) == re.findall(r"\d+", b) and
+                         levenshtein(a, b) <= min(limit(a), limit(b)))
+    clusters = []
+    grouped = set()
+    for v in sorted(values, key=lambda v: (-counts.get(v, 0), -len(v), v)):
+        if v in grouped: continue
+        members = [v] + [w for w in values if w not in grouped and w != v and near(v, w)]
+        grouped.update(members)
+        if len(members) > 1: clusters.append((v, sorted(members)))
+    return sorted(clusters)
+
+
+class DeletionsTest(unittest.TestCase):
+
+    def testDeletions(self):
+        self.assertEqual(deletions("abc", 0), set(["abc"]))
+        self.assertEqual(deletions("abc", 1), set(["abc", "bc", "ac", "ab"]))
+        self.assertEqual(deletions("abc", 2), set(["abc", "bc", "ac", "ab", "a", "b", "c"]))
+
+    def testNearDuplicatesShareADeletion(self):
+        #a substitution, an insertion and a transposition
+        for a, b in [("santolan", "santolon"), ("quirno", "quirino"), ("tomas", "tomsa")]:
+            self.assertTrue(deletions(a, 2) & deletions(b, 2))
+        self.assertFalse(deletions("santolan", 1) & deletions("santosin", 1))
+
+
+class EditDistanceTest(unittest.TestCase):
+
+    def testSameAsFullMatrix(self):
+        rng = random.Random(1)
+        for i in xrange(2000):
+            a = "".join(rng.choice("abc") for j in xrange(rng.randint(0, 8)))
+            b = "".join(rng.choice("abc") for j in xrange(rng.randint(0, 8)))
+            for limit in xrange(4):
+                self.assertEqual(editDistance(a, b, limit), min(levenshtein(a, b), limit + 1))
+
+
+class FindClustersTest(unittest.TestCase):
+
+    def testTypo(self):
+        clusters = findClusters(["Quirino Highway", "Quirno Highway", "Santolan Road"],
+                                {"Quirino Highway": 12, "Quirno Highway": 1})
+        self.assertEqual(clusters, [("Quirino Highway", ["Quirino Highway", "Quirno Highway"])])
+
+    def testNormalizedValuesAreDuplicates(self):
+        clusters = findClusters(["E. Rodriguez Sr.", "E Rodriguez Sr", "ERodriguez Sr."])
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(len(clusters[0][1]), 3)
+
+    def testEditsPerLength(self):
+        #"santord" (7 characters) gets 1 edit, "sant" (4 characters) none
+        self.assertEqual(len(findClusters(["Santos Rd", "Santo Rd"])), 1)
+        self.assertEqual(findClusters(["Santos Rd", "Sant Rd"]), [])
+        self.assertEqual(findClusters(["Sant", "Sent"]), [])
+        #long values get at most maxDistance edits
+        self.assertEqual(len(findClusters(["Sen L Sumulong Memorial", "Sen L Sumulong Memorixx"])), 1)
+        self.assertEqual(findClusters(["Sen L Sumulong Memorial", "Sen L Sumulong Memoxxxx"]), [])
+        self.assertEqual(len(findClusters(["Sen L Sumulong Memorial", "Sen L Sumulong Memoxxxx"], maxDistance=4)), 1)
+
+    def testNumberedStreets(self):
+        avenues = ["{0}th Avenue".format(i) for i in xrange(4, 21)]
+        roads = ["Road {0}".format(i) for i in xrange(1, 20)]
+        self.assertEqual(findClusters(avenues + roads), [])
+        self.assertEqual(findClusters(avenues + ["10th Avenu"]), [("10th Avenue", ["10th Avenu", "10th Avenue"])])
+
+    def testValuesAreNotChained(self):
+        values = ["Maginhawa Street", "Maginhawa Stree", "Maginhawa Stre", "Maginhawa Str", "Maginhawa St"]
+        clusters = findClusters(values, {"Maginhawa Street": 5})
+        self.assertEqual(clusters, [("Maginhawa Str", ["Maginhawa St", "Maginhawa Str"]),
+                                    ("Maginhawa Street", ["Maginhawa Stre", "Maginhawa Stree", "Maginhawa Street"])])
+        for canonical, members in clusters:
+            for v in members: self.assertTrue(levenshtein(normalize(canonical), normalize(v)) <= 2)
+
+    def testKnownTyposAreNotCanonical(self):
+        corrections = {"Quirno Highway": "Quirino Highway"}
+        normalizer = lambda v: normalize(corrections.get(v, v))
+        values = ["quirino hiway", "Quirno Highway"]
+        #on a count tie the longer value wins, even a typo
+        self.assertEqual(canonicalValues(values, normalizer=normalizer)["quirino hiway"], "Quirno Highway")
+        canonical = canonicalValues(values, normalizer=normalizer, corrections=corrections)
+        self.assertEqual(canonical, {"quirino hiway": "Quirino Highway", "Quirno Highway": "Quirino Highway"})
+
+    def testSameAsBruteForce(self):
+        rng = random.Random(2)
+        for i in xrange(20):
+            values = set("".join(rng.choice("aab1") for j in xrange(rng.randint(4, 12))) for k in xrange(200))
+            counts = dict((v, rng.randint(0, 3)) for v in values)
+            self.assertEqual(findClusters(values, counts), bruteForceClusters(values, counts))
+
+
+if __name__ == "__main__":
+    unittest.main()
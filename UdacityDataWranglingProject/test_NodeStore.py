@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of NodeStore.py, run with:
+    python -m unittest test_NodeStore
+"""
+
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from NodeStore import NodeStore, SCALE, _mergeNewest, addGeometry
+
+
+def position(id1):
+    return (round(14 + id1 * 1e-7, 7), round(121 - id1 * 1e-7, 7))
+
+
+class NodeStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "qc.nodes")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testSorted(self):
+        store = NodeStore(self.path, bufferSize=16)
+        ids = range(1, 1000, 3)
+        for id1 in ids: store.add(id1, *position(id1))
+        self.assertTrue(store.stored > 0 and len(store.ids) > 0)
+        for id1 in ids: self.assertEqual(store.get(id1), position(id1))
+        for id1 in [0, 2, 998, 1000]: self.assertEqual(store.get(id1), None)
+        self.assertEqual(len(store), len(ids))
+        store.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["qc.nodes.coords", "qc.nodes.ids"])
+
+    def testOutOfOrder(self):
+        #sorted nodes in the files and the buffer, out of order ones in the runs and the dict
+        store = NodeStore(self.path, bufferSize=16, unsortedLimit=8)
+        ids = range(0, 2000, 2)
+        for id1 in ids: store.add(id1, *position(id1))
+        late = range(1, 2000, 2)
+        random.Random(1).shuffle(late)
+        for id1 in late: store.add(id1, *position(id1))
+        self.assertTrue(store.stored > 0 and len(store.ids) > 0 and len(store.unsorted) > 0)
+        self.assertTrue(1 < len(store.runs) <= math.log(len(late), 2) + 1)
+        for id1 in ids + late: self.assertEqual(store.get(id1), position(id1))
+        self.assertEqual(store.get(2000), None)
+        self.assertEqual(store.get(-1), None)
+        store.close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ["qc.nodes.coords", "qc.nodes.ids"])
+
+    def testLastAddedWins(self):
+        store = NodeStore(None, bufferSize=16, unsortedLimit=8)
+        rng = random.Random(2)
+        ids = range(1, 1001)
+        rng.shuffle(ids)
+        for id1 in ids: store.add(id1, *position(id1))
+        moved = {}
+        for id1 in rng.sample(ids, 100):
+            moved[id1] = (rng.randint(-90 * SCALE, 90 * SCALE) / float(SCALE),
+                          rng.randint(-180 * SCALE, 180 * SCALE) / float(SCALE))
+            store.add(id1, *moved[id1])
+        for id1 in ids: self.assertEqual(store.get(id1), moved.get(id1, position(id1)))
+        path = store.path
+        store.close()
+        self.assertFalse(any(name.startswith(os.path.basename(path)) for name in os.listdir(os.path.dirname(path))))
+
+    def testMergeNewest(self):
+        older = [(1, 10, 10), (3, 30, 30), (5, 50, 50)]
+        newer = [(2, 20, 20), (3, 33, 33), (6, 60, 60)]
+        self.assertEqual(list(_mergeNewest(iter(older), iter(newer))),
+                         [(1, 10, 10), (2, 20, 20), (3, 33, 33), (5, 50, 50), (6, 60, 60)])
+
+    def testAddGeometry(self):
+        store = NodeStore()
+        for id1 in [1, 2, 3]: store.add(id1, *position(id1))
+        doc = {"node_refs": ["1", "2", "3", "1"]}
+        self.assertTrue(addGeometry(doc, store, "geojson"))
+        self.assertEqual(doc["geometry"]["type"], "Polygon")
+        self.assertEqual(doc["geometry"]["coordinates"][0][1], [position(2)[1], position(2)[0]])
+        self.assertFalse(addGeometry({"node_refs": ["1", "4"]}, store))
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
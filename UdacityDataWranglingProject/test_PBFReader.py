@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of PBFReader.py, run with:
+    python -m unittest test_PBFReader
+"""
+
+from io import BytesIO
+import struct
+import unittest
+import zlib
+
+from AttributeCheck import AttributeCheck
+from PBFReader import PBFReader
+
+
+def varint(n):
+    out = bytearray()
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def zigzag(n):
+    return n << 1 if n >= 0 else (-n << 1) - 1
+
+
+def number(field, n):
+    return varint(field << 3) + varint(n)
+
+
+def message(field, data):
+    return varint(field << 3 | 2) + varint(len(data)) + data
+
+
+def packed(field, numbers):
+    return message(field, b"".join(varint(n) for n in numbers))
+
+
+def delta(numbers):
+    last = 0
+    coded = []
+    for n in numbers:
+        coded.append(zigzag(n - last))
+        last = n
+    return coded
+
+
+def blob(blobType, data):
+    body = number(2, len(data)) + message(3, zlib.compress(data))
+    header = message(1, blobType) + number(3, len(body))
+    return struct.pack(">I", len(header)) + header + body
+
+
+def pbfFile(strings, groups):
+    """
+        A .osm.pbf with a single PrimitiveBlock.
+    """
+    header = message(4, b"OsmSchema-V0.6") + message(4, b"DenseNodes")
+    block = message(1, b"".join(message(1, s) for s in strings)) + b"".join(message(2, g) for g in groups)
+    return BytesIO(blob(b"OSMHeader", header) + blob(b"OSMData", block))
+
+
+#string 0 is always empty, the user of an anonymous edit
+STRINGS = [b"", b"alice", b"highway", b"residential"]
+TIMESTAMP = 1433152800
+
+
+def denseNodes():
+    info = (packed(1, [2, 1]) + packed(2, delta([TIMESTAMP, TIMESTAMP])) + packed(3, delta([100, 101])) +
+            packed(4, delta([7, 0])) + packed(5, delta([1, 0])))
+    return message(2, packed(1, delta([1, 2])) + message(5, info) +
+                   packed(8, delta([146500000, 146510000])) + packed(9, delta([1210300000, 1210310000])) +
+                   packed(10, [2, 3, 0, 0]))
+
+
+def way(wayId, uid, userSid):
+    info = number(1, 1) + number(2, TIMESTAMP) + number(3, 102) + number(4, uid) + number(5, userSid)
+    return message(3, number(1, wayId) + packed(2, [2]) + packed(3, [3]) + message(4, info) + packed(8, delta([1, 2])))
+
+
+def read(pbf):
+    return list(PBFReader(pbf, processes=1))
+
+
+class PBFReaderTest(unittest.TestCase):
+
+    def testSameAsXml(self):
+        records = read(pbfFile(STRINGS, [denseNodes(), way(10, 7, 1)]))
+        self.assertEqual([record.tag for record in records], ["node", "node", "way"])
+        node, way10 = records[0], records[2]
+        self.assertEqual(node.attrib, {"id": "1", "lat": "14.6500000", "lon": "121.0300000", "version": "2",
+                                       "timestamp": "2015-06-01T10:00:00Z", "changeset": "100",
+                                       "uid": "7", "user": "alice"})
+        self.assertEqual([child.attrib for child in node.children], [{"k": "highway", "v": "residential"}])
+        self.assertEqual(way10.attrib["user"], "alice")
+        self.assertEqual([(child.tag, child.attrib) for child in way10.children],
+                         [("nd", {"ref": "1"}), ("nd", {"ref": "2"}), ("tag", {"k": "highway", "v": "residential"})])
+
+    def testAnonymousEditHasNeitherUidNorUser(self):
+        records = read(pbfFile(STRINGS, [denseNodes(), way(11, 0, 0)]))
+        for record in records[1:]:
+            self.assertFalse("uid" in record.attrib)
+            self.assertFalse("user" in record.attrib)
+            self.assertEqual(record.attrib["changeset"], "101" if record.tag == "node" else "102")
+
+    def testAnonymousEditIsInvalid(self):
+        check = AttributeCheck("node")
+        for i, record in enumerate(read(pbfFile(STRINGS, [denseNodes()]))): check.add(record.attrib, i)
+        self.assertEqual([valid for row, attrib, valid in check.validate()], [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of RegionFilter.py, run with:
+    python -m unittest test_RegionFilter
+"""
+
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from RegionFilter import loadPolygons, PolygonShape, Region, _segmentIntersectsRect
+
+
+def pointInRings(lat, lon, rings):
+    #ray casting with every edge of every ring
+    inside = False
+    for ring in rings:
+        for i in xrange(len(ring)):
+            (lat1, lon1), (lat2, lon2) = ring[i - 1], ring[i]
+            if (lat1 > lat) != (lat2 > lat):
+                if lon < lon1 + (lat - lat1) * (lon2 - lon1) / (lat2 - lat1): inside = not inside
+    return inside
+
+
+def starRing(rng, lat, lon, radius, points):
+    #a star shaped ring around (lat, lon), with sharp spikes crossing many tiles
+    angles = sorted(rng.uniform(0, 2 * math.pi) for i in xrange(points))
+    ring = []
+    for angle in angles:
+        r = radius * rng.uniform(0.2, 1.0)
+        ring.append((lat + r * math.sin(angle), lon + r * math.cos(angle)))
+    return ring
+
+
+class SegmentIntersectsRectTest(unittest.TestCase):
+
+    def testCases(self):
+        rect = (0.0, 0.0, 1.0, 1.0)
+        self.assertTrue(_segmentIntersectsRect((0.2, 0.2), (0.8, 0.8), *rect))
+        self.assertTrue(_segmentIntersectsRect((-1.0, 0.5), (2.0, 0.5), *rect))
+        self.assertTrue(_segmentIntersectsRect((-0.5, 0.5), (0.5, -0.5), *rect))
+        self.assertFalse(_segmentIntersectsRect((-0.5, 0.4), (0.4, -0.5), *rect))
+        self.assertFalse(_segmentIntersectsRect((2.0, 0.0), (2.0, 1.0), *rect))
+        self.assertFalse(_segmentIntersectsRect((0.5, 1.5), (0.5, 3.0), *rect))
+
+    def testSameAsSampling(self):
+        rng = random.Random(1)
+        for i in xrange(2000):
+            a = (rng.uniform(-1, 2), rng.uniform(-1, 2))
+            b = (rng.uniform(-1, 2), rng.uniform(-1, 2))
+            samples = [(a[0] + (b[0] - a[0]) * t / 1000.0, a[1] + (b[1] - a[1]) * t / 1000.0) for t in xrange(1001)]
+            hit = any(0 <= lat <= 1 and 0 <= lon <= 1 for lat, lon in samples)
+            #a segment only grazing a corner can be missed by the samples
+            if hit: self.assertTrue(_segmentIntersectsRect(a, b, 0.0, 0.0, 1.0, 1.0))
+            elif not _segmentIntersectsRect(a, b, -0.001, -0.001, 1.001, 1.001):
+                self.assertFalse(_segmentIntersectsRect(a, b, 0.0, 0.0, 1.0, 1.0))
+
+
+class PolygonShapeTest(unittest.TestCase):
+
+    def checkRandomPoints(self, rings, tileSize, rng):
+        shape = PolygonShape(rings, tileSize)
+        minlat, minlon, maxlat, maxlon = shape.bbox
+        for i in xrange(5000):
+            lat = rng.uniform(minlat - tileSize, maxlat + tileSize)
+            lon = rng.uniform(minlon - tileSize, maxlon + tileSize)
+            self.assertEqual(shape.contains(lat, lon), pointInRings(lat, lon, rings), (lat, lon, tileSize))
+        return shape
+
+    def testSameAsBruteForce(self):
+        rng = random.Random(2)
+        for tileSize in [0.001, 0.01, 0.05, 1.0]:
+            rings = [starRing(rng, 14.65, 121.03, 0.1, 40)]
+            shape = self.checkRandomPoints(rings, tileSize, rng)
+            states = set(shape.tiles.itervalues())
+            if tileSize < 0.05: self.assertEqual(len(states), 3)
+
+    def testHoles(self):
+        rng = random.Random(3)
+        outer = [(14.5, 120.9), (14.5, 121.2), (14.8, 121.2), (14.8, 120.9)]
+        hole = [(14.6, 121.0), (14.7, 121.0), (14.7, 121.1), (14.6, 121.1)]
+        shape = self.checkRandomPoints([outer, hole], 0.01, rng)
+        self.assertTrue(shape.contains(14.55, 121.05))
+        self.assertFalse(shape.contains(14.65, 121.05))
+
+    def testRegionOfSeveralPolygons(self):
+        rng = random.Random(4)
+        first, second = starRing(rng, 14.6, 121.0, 0.05, 20), starRing(rng, 14.7, 121.1, 0.05, 20)
+        region = Region(polygons=[[first], [second]])
+        for i in xrange(2000):
+            lat, lon = rng.uniform(14.5, 14.8), rng.uniform(120.9, 121.2)
+            self.assertEqual(region.contains(lat, lon), pointInRings(lat, lon, [first]) or pointInRings(lat, lon, [second]))
+
+
+class LoadPolygonsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f: f.write(text)
+        return path
+
+    def testPoly(self):
+        path = self.write("city.poly", "city\n1\n  121.0 14.6\n  121.1 14.6\n  121.1 14.7\nEND\n"
+                                       "!2\n  121.04 14.64\n  121.05 14.64\n  121.05 14.65\nEND\nEND\n")
+        self.assertEqual(loadPolygons(path), [[[(14.6, 121.0), (14.6, 121.1), (14.7, 121.1)],
+                                               [(14.64, 121.04), (14.64, 121.05), (14.65, 121.05)]]])
+
+    def testGeoJSON(self):
+        polygon = [[[121.0, 14.6], [121.1, 14.6], [121.1, 14.7], [121.0, 14.6]]]
+        path = self.write("city.geojson", json.dumps({"type": "Feature", "properties": {},
+                                                      "geometry": {"type": "MultiPolygon", "coordinates": [polygon]}}))
+        self.assertEqual(loadPolygons(path), [[[(14.6, 121.0), (14.6, 121.1), (14.7, 121.1), (14.6, 121.0)]]])
+        path = self.write("line.geojson", json.dumps({"type": "LineString", "coordinates": polygon[0]}))
+        self.assertRaises(ValueError, loadPolygons, path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of Sketches.py, run with:
+    python -m unittest test_Sketches
+"""
+
+import unittest
+
+from Sketches import HyperLogLog, CountMinSketch, HeavyHitters, ReservoirSample
+
+
+class HyperLogLogTest(unittest.TestCase):
+
+    def testSmallCountIsExact(self):
+        users = HyperLogLog(14)
+        for i in xrange(50): users.add(str(i))
+        users.add("0")
+        self.assertEqual(len(users), 50)
+
+    def testEstimateWithinErrorBound(self):
+        users = HyperLogLog(14)
+        for i in xrange(100000): users.add(str(i))
+        self.assertTrue(abs(len(users) - 100000) < 3 * users.error() * 100000)
+
+    def testMerge(self):
+        a, b = HyperLogLog(10), HyperLogLog(10)
+        for i in xrange(1000): a.add(i)
+        for i in xrange(500, 1500): b.add(i)
+        a.merge(b)
+        self.assertTrue(abs(len(a) - 1500) < 3 * a.error() * 1500)
+        self.assertRaises(ValueError, a.merge, HyperLogLog(12))
+
+
+class CountMinSketchTest(unittest.TestCase):
+
+    def testNeverBelowRealCount(self):
+        sketch = CountMinSketch(100, 4)
+        counts = {}
+        for i in xrange(10000):
+            item = str(i % 997)
+            sketch.add(item)
+            counts[item] = counts.get(item, 0) + 1
+        error, probability = sketch.errorBound()
+        for item, count in counts.iteritems():
+            self.assertTrue(count <= sketch[item] <= count + error)
+
+    def testFromError(self):
+        sketch = CountMinSketch.fromError(0.001, 0.01)
+        self.assertEqual((sketch.width, sketch.depth), (2719, 5))
+
+
+class HeavyHittersTest(unittest.TestCase):
+
+    def testCandidateThatGrewIsKept(self):
+        top = HeavyHitters(2)
+        for item, n in [("a", 5), ("b", 11), ("c", 2)]:
+            for i in xrange(n): top.add(item)
+        self.assertEqual(top.top(), [("b", 11), ("a", 5)])
+
+    def testMostFrequent(self):
+        top = HeavyHitters(3)
+        for i in xrange(10000): top.add(str(i % 50) if i % 10 else "x%d" % (i % 30 // 10))
+        self.assertEqual(sorted(item for item, count in top.top()), ["x0", "x1", "x2"])
+
+
+class ReservoirSampleTest(unittest.TestCase):
+
+    def testSample(self):
+        sample = ReservoirSample(10, seed=1)
+        for i in xrange(1000): sample.add(i)
+        self.assertEqual(len(sample), 10)
+        self.assertEqual(sample.seen, 1000)
+        self.assertEqual(len(set(sample)), 10)
+
+    def testRepeatable(self):
+        a, b = ReservoirSample(5, seed=3), ReservoirSample(5, seed=3)
+        for i in xrange(100):
+            a.add(i)
+            b.add(i)
+        self.assertEqual(list(a), list(b))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests of TagStats.py, run with:
+    python -m unittest test_TagStats
+"""
+
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import unittest
+
+from TagStats import TagStatsWriter, TagStatsReader, mergeStores, MERGE_RUNS
+
+
+def randomTags(rng, n):
+    return [(rng.choice(["addr:street", "addr:postcode", "amenity", "name"]), "v{0}".format(rng.randint(0, 400)))
+            for i in xrange(n)]
+
+
+def countTags(tags):
+    counts = {}
+    for k, v in tags:
+        values = counts.setdefault(k, {})
+        values[v] = values.get(v, 0) + 1
+    return counts
+
+
+class TagStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tagKV.stats")
+        self.rng = random.Random(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def runFiles(self):
+        return [name for name in os.listdir(self.directory) if name.endswith(".run")]
+
+    def checkStore(self, path, counts):
+        stats = TagStatsReader(path)
+        self.assertEqual(stats.keys(), sorted(counts))
+        self.assertEqual(dict(stats.iteritems()), counts)
+        for k in counts: self.assertEqual(stats.values(k), counts[k])
+        self.assertEqual(stats.summary(), [[k, len(counts[k]), sum(counts[k].values())] for k in sorted(counts)])
+
+    def testInMemory(self):
+        tags = randomTags(self.rng, 1000)
+        writer = TagStatsWriter(self.path)
+        for k, v in tags: writer.add(k, v)
+        writer.close()
+        self.assertEqual(self.runFiles(), [])
+        self.checkStore(self.path, countTags(tags))
+
+    def testSpillAndMerge(self):
+        tags = randomTags(self.rng, 5000)
+        writer = TagStatsWriter(self.path, maxEntries=10)
+        for k, v in tags:
+            writer.add(k, v)
+            #runs of MERGE_RUNS - 1 at most per level
+            levels = [level for level, run in writer.runs]
+            self.assertEqual(levels, sorted(levels, reverse=True))
+            for level in set(levels): self.assertTrue(levels.count(level) < MERGE_RUNS)
+        self.assertTrue(max(level for level, run in writer.runs) >= 2)
+        self.assertEqual(len(self.runFiles()), len(writer.runs))
+        writer.close()
+        self.assertEqual(self.runFiles(), [])
+        self.checkStore(self.path, countTags(tags))
+
+    def testResume(self):
+        tags = randomTags(self.rng, 3000)
+        writer = TagStatsWriter(self.path, maxEntries=10)
+        for k, v in tags[:1000]: writer.add(k, v)
+        state = pickle.dumps(writer)
+        #the runs written and merged after the checkpoint are lost with the process
+        for k, v in tags[1000:2000]: writer.add(k, v)
+        writer = pickle.loads(state)
+        self.assertEqual(sorted(self.runFiles()), sorted(os.path.basename(run) for level, run in writer.runs))
+        for k, v in tags[1000:]: writer.add(k, v)
+        writer.close()
+        self.assertEqual(self.runFiles(), [])
+        self.checkStore(self.path, countTags(tags))
+
+    def testWritersOfTheSameStore(self):
+        first, second = TagStatsWriter(self.path, maxEntries=10), TagStatsWriter(self.path, maxEntries=10)
+        tags = randomTags(self.rng, 2000)
+        for k, v in tags[:1000]: first.add(k, v)
+        for k, v in tags[1000:]: second.add(k, v)
+        first = pickle.loads(pickle.dumps(first))
+        second.close()
+        self.checkStore(self.path, countTags(tags[1000:]))
+        first.close()
+        self.checkStore(self.path, countTags(tags[:1000]))
+        self.assertEqual(self.runFiles(), [])
+
+    def testMergeStores(self):
+        tags = randomTags(self.rng, 2000)
+        paths = []
+        for i in xrange(3):
+            paths.append(os.path.join(self.directory, "{0}.stats".format(i)))
+            writer = TagStatsWriter(paths[-1], maxEntries=50)
+            for k, v in tags[i::3]: writer.add(k, v)
+            writer.close()
+        mergeStores(paths, self.path)
+        self.checkStore(self.path, countTags(tags))
+
+
+if __name__ == "__main__":
+    unittest.main()